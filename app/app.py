@@ -81,9 +81,11 @@ class AppCoordinator:
                 ORMQuary(
                     self._sql_alchemy_settings,
                     self._robot_logger,
-                    PartNumberFilter(self._robot_logger)
+                    PartNumberFilter(self._robot_logger),
+                    self._settings.lookup
                 )
             )
+            self.database_service.add_update_listener(self._orm_service.on_table_updated)
         return self._orm_service
 
     @property
@@ -201,7 +203,7 @@ class AppCoordinator:
     async def _collection_data(self, input_data: list[InputData]):
         data_generate_dict_list = [data.dict(by_alias=True) for data in input_data]
 
-        async def process_item(item):
+        async def prepare_item(item):
             try:
                 part_number = item.get('P/N')
                 vendor = item.get('ВЕНДОР')
@@ -212,21 +214,39 @@ class AppCoordinator:
                 exc_part_numbers = await self.data_service.generate_exceptions(
                     item, normalized_part_number, vendor
                 )
+                if not exc_part_numbers:
+                    raise ValueError("нет ключей для поиска")
+                return item, exc_part_numbers, normalized_comment
 
-                self._robot_logger.debug(f"Захват lock для обработки item {part_number}")
-                await self.orm_service.directory_books_query(item, exc_part_numbers, normalized_comment)
+            except Exception as e:
+                self._robot_logger.error(f"Error processing item {item.get('P/N')}: {e}")
+                return None
+
+        async def complete_item(item):
+            try:
+                part_number = item.get('P/N')
+                vendor = item.get('ВЕНДОР')
                 self.data_service.costs_by_category(item)
                 category = item.get('КАТЕГОРИЯ')
                 if category not in ('LIC-1', 'SOFT-1', 'MSCL'):
                     await self.external_search_service.search(
                         item, part_number, vendor, self.data_service._part_number_filter
                     )
-                self._robot_logger.debug(f"Lock освобожден для item {part_number}")
 
             except Exception as e:
                 self._robot_logger.error(f"Error processing item {item.get('P/N')}: {e}")
 
-        tasks = [process_item(item) for mass in data_generate_dict_list for item in mass.get('input_data')]
+        async def process_sheet(mass):
+            prepared = await asyncio.gather(*(prepare_item(item) for item in mass.get('input_data')))
+            batch = [entry for entry in prepared if entry is not None]
+            try:
+                await self.orm_service.directory_books_query_many(batch)
+            except Exception as e:
+                # Категория и внешний поиск выполняются и для строк, оставшихся без данных справочников.
+                self._robot_logger.error(f"Error processing sheet {mass.get('sheet_name')}: {e}")
+            await asyncio.gather(*(complete_item(item) for item, _, _ in batch))
+
+        tasks = [process_sheet(mass) for mass in data_generate_dict_list]
         await asyncio.gather(*tasks, return_exceptions=False)
 
         return data_generate_dict_list
@@ -239,6 +259,7 @@ class AppCoordinator:
                 self._robot_logger.info(f"No data found in {file_path}")
                 return False
             _data_collection = await self._collection_data(_input_data)
+            self.orm_service.log_lookup_summary(file_path.name)
             for data in _data_collection:
                 if self.excel_handler_service.write_to_excel(data, file_path.name):
                     self.email_service.send_email(
@@ -263,6 +284,7 @@ class AppCoordinator:
 
     async def _monitor_and_process(self):
         """Запуск мониторинга файлов и обработки email."""
+        await self.database_service.initialize()
         monitor_task = asyncio.create_task(self._monitor_files())
         sys_monitor_task = asyncio.create_task(self.sys_handler_service.start_monitoring())
         self._robot_logger.verify_logs_and_alert()
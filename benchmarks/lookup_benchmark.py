@@ -0,0 +1,230 @@
+"""
+Нагрузочный прогон поиска по справочникам на синтетических книгах.
+
+    python -m benchmarks.lookup_benchmark --rows 100000 --keys 5000 --engine sql --output sql.json
+    python -m benchmarks.lookup_benchmark --rows 100000 --keys 5000 --engine memory --baseline sql.json
+
+Книги загружаются через DatabaseRepository, ключи проходят ExceptionGenerator и
+ORMQuary.directory_books_query(_many), как строки входного файла в AppCoordinator.
+"""
+from benchmarks.synthetic_books import SyntheticBooks, SyntheticHuaweiParsing, KEY_MIX
+from core import PartNumberFilter, ExceptionGenerator
+from infrastructure import SQLAlchemySettings, DatabaseRepository, ORMQuary
+from infrastructure.database.orm.orm_repository import AbstractQuaryORM
+from infrastructure.database.lookup.instrumentation import percentile
+from settings.config import AlchemyDB, LookupSettings, InstrumentationSettings
+from pathlib import Path
+from typing import Any, Optional
+import argparse
+import asyncio
+import json
+import sys
+import tempfile
+import time
+
+
+class BenchmarkLogger:
+    """IRobotLogger без вывода: отладочные сообщения поиска не должны попадать в замер. Ошибки — в stderr."""
+
+    def __init__(self):
+        self.errors = 0
+
+    def verify_logs_and_alert(self, file_path: Path = None):
+        pass
+
+    def success(self, message: str, extra: dict = None):
+        pass
+
+    def debug(self, message: str, extra: dict = None) -> None:
+        pass
+
+    def info(self, message: str, extra: dict = None) -> None:
+        pass
+
+    def error(self, message: str, extra: dict = None) -> None:
+        self.errors += 1
+        print(f'ERROR {message}', file=sys.stderr)
+
+    def critical(self, message: str, extra: dict = None) -> None:
+        self.error(message, extra)
+
+
+def latency_stats(samples: list[float]) -> dict[str, float]:
+    ordered = sorted(samples)
+    return {
+        'count': len(ordered),
+        'p50_ms': round(percentile(ordered, 0.5), 3),
+        'p95_ms': round(percentile(ordered, 0.95), 3),
+        'p99_ms': round(percentile(ordered, 0.99), 3),
+        'max_ms': round(ordered[-1], 3) if ordered else 0.0,
+    }
+
+
+async def load_books(repository: DatabaseRepository, books: SyntheticBooks) -> dict[str, Any]:
+    """Загружает книги и возвращает время загрузки каждой."""
+    await repository.initialize()
+    load = {}
+    for table_name, rows in books.books.items():
+        started = time.perf_counter()
+        report = await repository.load_table(table_name, rows)
+        elapsed = time.perf_counter() - started
+        load[table_name] = {
+            'rows': len(rows),
+            'seconds': round(elapsed, 3),
+            'rows_per_sec': round(len(rows) / elapsed, 1) if elapsed else None,
+            'insert_rows_per_sec': report.rows_per_sec,
+            'quarantined': len(report.quarantine),
+        }
+    return load
+
+
+async def prepare_items(books: SyntheticBooks, count: int, mix: dict[str, float], seed: int,
+                        logger: BenchmarkLogger) -> list[tuple[dict, list[str], str]]:
+    """Ключи поиска по строкам входного файла — так же, как AppCoordinator._collection_data."""
+    generator = ExceptionGenerator(SyntheticHuaweiParsing(books.huawei_models), logger)
+    prepared = []
+    for item in books.lookup_items(count, mix, seed):
+        normalized_part_number = PartNumberFilter.normalize_part_number(item['P/N'])
+        keys = await generator.generate_exceptions(item, normalized_part_number, item['ВЕНДОР'])
+        prepared.append((item, keys, PartNumberFilter.normalize_part_number(item['ОПИСАНИЕ'])))
+    return prepared
+
+
+async def replay(orm: ORMQuary, prepared: list[tuple[dict, list[str], str]], batch: int) -> dict[str, Any]:
+    """Прогоняет ключи через поиск и считает пропускную способность и задержки."""
+    by_kind: dict[str, list[float]] = {}
+    found: dict[str, int] = {}
+    started = time.perf_counter()
+    if batch:
+        latencies = []
+        for i in range(0, len(prepared), batch):
+            chunk = prepared[i:i + batch]
+            chunk_started = time.perf_counter()
+            await orm.directory_books_query_many(chunk)
+            latencies.append((time.perf_counter() - chunk_started) * 1000)
+        for item, _, _ in prepared:
+            found[item['kind']] = found.get(item['kind'], 0) + bool(item.get('ГДЕ НАШЛИ'))
+    else:
+        latencies = []
+        for item, keys, comment in prepared:
+            item_started = time.perf_counter()
+            await orm.directory_books_query(item, keys, comment)
+            elapsed_ms = (time.perf_counter() - item_started) * 1000
+            latencies.append(elapsed_ms)
+            by_kind.setdefault(item['kind'], []).append(elapsed_ms)
+            found[item['kind']] = found.get(item['kind'], 0) + bool(item.get('ГДЕ НАШЛИ'))
+    elapsed = time.perf_counter() - started
+    return {
+        'items': len(prepared),
+        'seconds': round(elapsed, 3),
+        'items_per_sec': round(len(prepared) / elapsed, 1) if elapsed else None,
+        'latency': latency_stats(latencies),
+        'latency_unit': f'batch of {batch}' if batch else 'item',
+        'by_kind': {kind: latency_stats(samples) for kind, samples in sorted(by_kind.items())},
+        'found': dict(sorted(found.items())),
+    }
+
+
+def compare(result: dict[str, Any], baseline: dict[str, Any]) -> None:
+    """Печатает отношение пропускной способности и задержек к сохранённому результату."""
+    current, previous = result['lookup'], baseline['lookup']
+    print(f"baseline: engine={baseline['config']['engine']} rows={baseline['config']['rows']}")
+    if current['items_per_sec'] and previous['items_per_sec']:
+        print(f"  items/sec  {previous['items_per_sec']:>10} -> {current['items_per_sec']:>10} "
+              f"(x{current['items_per_sec'] / previous['items_per_sec']:.2f})")
+    print(f"  latency per {previous['latency_unit']} -> per {current['latency_unit']}")
+    for name in ('p50_ms', 'p95_ms', 'p99_ms'):
+        print(f"  {name:<10} {previous['latency'][name]:>10} -> {current['latency'][name]:>10}")
+
+
+async def run(args: argparse.Namespace) -> dict[str, Any]:
+    logger = BenchmarkLogger()
+    mix = json.loads(args.mix) if args.mix else KEY_MIX
+    books = SyntheticBooks(args.rows, args.seed)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        db_path = Path(args.db) if args.db else Path(workdir) / 'benchmark.db'
+        reuse = args.db is not None and args.reuse_db and db_path.exists()
+        if db_path.exists() and not reuse:
+            db_path.unlink()
+        alchemy = AlchemyDB(url_database=f'sqlite+aiosqlite:///{db_path}')
+        settings = SQLAlchemySettings(alchemy.url_database, alchemy.pool_size, alchemy.max_overflow, alchemy.sqlite)
+        part_number_filter = PartNumberFilter(logger)
+        repository = DatabaseRepository(settings, logger, part_number_filter)
+        try:
+            load = {} if reuse else await load_books(repository, books)
+            if reuse:
+                await repository.initialize()
+
+            lookup_settings = LookupSettings(
+                engine=args.engine,
+                cache_size=args.cache_size,
+                concurrent_groups=not args.sequential,
+                instrumentation=InstrumentationSettings(enabled=True, window=args.keys * 10,
+                                                        slow_query_ms=float('inf')),
+            )
+            orm = ORMQuary(settings, logger, part_number_filter, lookup_settings)
+            repository.add_update_listener(orm.on_table_updated)
+            prepared = await prepare_items(books, args.keys, mix, args.seed + 1, logger)
+            if args.warmup:
+                await replay(orm, await prepare_items(books, args.warmup, mix, args.seed + 2, logger), args.batch)
+                AbstractQuaryORM.metrics.reset()
+            lookup = await replay(orm, prepared, args.batch)
+            stages = AbstractQuaryORM.metrics.summary()
+            cache = {'hits': orm.result_cache.hits, 'misses': orm.result_cache.misses} if orm.result_cache else None
+        finally:
+            await settings.engine.dispose()
+            await settings.read_engine.dispose()
+
+    return {
+        'config': {
+            'rows': args.rows,
+            'keys': args.keys,
+            'engine': args.engine,
+            'batch': args.batch,
+            'cache_size': args.cache_size,
+            'concurrent_groups': not args.sequential,
+            'seed': args.seed,
+            'mix': mix,
+        },
+        'load': load,
+        'lookup': lookup,
+        'stages': stages,
+        'cache': cache,
+        'errors': logger.errors,
+    }
+
+
+def parse_args(argv: Optional[list[str]] = None) -> argparse.Namespace:
+    defaults = LookupSettings()
+    parser = argparse.ArgumentParser(description='Benchmark of reference-book lookups on synthetic books.')
+    parser.add_argument('--rows', type=int, default=10000, help='rows in Свод; other books are scaled from it')
+    parser.add_argument('--keys', type=int, default=2000, help='input rows to look up')
+    parser.add_argument('--engine', default=defaults.engine, choices=('sql', 'memory', 'columnar'))
+    parser.add_argument('--batch', type=int, default=0, help='use directory_books_query_many with this batch size')
+    parser.add_argument('--cache-size', type=int, default=0, help='result cache size (0 measures every lookup)')
+    parser.add_argument('--sequential', action='store_true', help='disable concurrent lookup groups')
+    parser.add_argument('--warmup', type=int, default=200, help='lookups before the measured run')
+    parser.add_argument('--mix', help='JSON key mix, e.g. {"hit": 0.5, "miss": 0.5}')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--db', help='database file (temporary by default)')
+    parser.add_argument('--reuse-db', action='store_true', help='skip loading if --db already exists')
+    parser.add_argument('--output', help='write JSON results to this file')
+    parser.add_argument('--baseline', help='JSON results of a previous run to compare with')
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    args = parse_args(argv)
+    result = asyncio.run(run(args))
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        Path(args.output).write_text(text, encoding='utf-8')
+    else:
+        print(text)
+    if args.baseline:
+        compare(result, json.loads(Path(args.baseline).read_text(encoding='utf-8')))
+
+
+if __name__ == '__main__':
+    main()
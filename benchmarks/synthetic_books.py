@@ -0,0 +1,202 @@
+from infrastructure.database.orm.models import (Status,
+                                                PurchaseBuy,
+                                                PurchaseWant,
+                                                MainCategory,
+                                                SecondCategory,
+                                                Collision,
+                                                CodeBook,
+                                                ArchiveBook,
+                                                Chassis,
+                                                Agreements,
+                                                AgreementsCollision)
+from typing import Any, Optional
+import random
+
+
+CISCO_FAMILIES = ('WS-C', 'C9300-', 'C9200L-', 'N9K-C', 'N3K-C', 'ISR', 'ASR', 'SFP-', 'GLC-', 'PWR-C1-', 'NIM-')
+HUAWEI_FAMILIES = ('S5735-', 'S6730-', 'CE6881-', 'AR6140-', 'OSN', 'ES0W2', 'SFP-GE-', 'PAC', 'FAN-')
+SUFFIXES = ('S', 'E', 'A', 'L', 'K9', '24T', '48P', '24P4X', 'X', 'EI', 'HI')
+PORTS = ('08', '16', '24', '32', '48')
+
+PROJECTS = [f'PRJ{i:03d}' for i in range(40)]
+CATEGORIES = ['SW-1', 'SW-2', 'SW-3', 'OPT', 'PWR', 'RTR', 'LIC-1', 'SOFT-1', 'MSCL']
+
+COMMENTS = (
+    'Коммутатор {family} {ports} портов',
+    'Трансивер оптический {family}',
+    'Блок питания {family}',
+    'Лицензия на ПО {family}',
+    'Маршрутизатор {family} серии',
+    'Модуль расширения {ports}x10G',
+    '',
+)
+COLLISION_RULES = (
+    ('лицензия', 'LIC-1'),
+    ('ПО', 'SOFT-1'),
+    ('трансивер', 'OPT'),
+    ('блок питания', 'PWR'),
+    ('маршрутизатор', 'RTR'),
+)
+
+# Доли строк книг относительно размера Свода.
+BOOK_SHARES = {
+    CodeBook.__tablename__: 1.0,
+    ArchiveBook.__tablename__: 1.0,
+    PurchaseBuy.__tablename__: 0.2,
+    PurchaseWant.__tablename__: 0.1,
+    Chassis.__tablename__: 0.02,
+}
+
+# Состав ключей поиска по умолчанию: вид ключа -> доля.
+KEY_MIX = {
+    'hit': 0.35,
+    'partial': 0.1,
+    'extended': 0.1,
+    'miss': 0.2,
+    'cisco_r': 0.1,
+    'huawei_model': 0.15,
+}
+# Доля BOM-кодов Huawei, модели которых есть в Своде или Архиве: остальные раскрываются в модель без совпадений.
+HUAWEI_MODEL_HITS = 0.6
+
+
+class SyntheticHuaweiParsing:
+    """IParsing для ExceptionGenerator: раскрытие BOM-кода Huawei в модель по словарю вместо сайта Huawei."""
+
+    def __init__(self, models: dict[str, str]):
+        self.models = models
+
+    async def get_part_and_model(self, key: str) -> Optional[list[str]]:
+        model = self.models.get(key)
+        if model:
+            return [key, model]
+        return None
+
+
+class SyntheticBooks:
+    """
+    Детерминированные (по seed) справочники в формате строк Excel: заголовок столбца -> значение.
+    `rows` — размер Свода, остальные книги масштабируются по BOOK_SHARES.
+    """
+
+    def __init__(self, rows: int, seed: int = 1):
+        self.rows = rows
+        self._random = random.Random(seed)
+        self.part_numbers: dict[str, list[tuple[str, str]]] = {}
+        self.huawei_models: dict[str, str] = {}
+        self.books = self._generate()
+
+    def _part_number(self) -> tuple[str, str]:
+        rnd = self._random
+        vendor = rnd.choice(('CISCO', 'CISCO', 'HUAWEI'))
+        family = rnd.choice(CISCO_FAMILIES if vendor == 'CISCO' else HUAWEI_FAMILIES)
+        body = f'{rnd.randint(10, 99999)}{rnd.choice(PORTS)}'
+        return vendor, f'{family}{body}-{rnd.choice(SUFFIXES)}'
+
+    def _huawei_models(self) -> dict[str, list[tuple[str, str]]]:
+        """
+        BOM-коды Huawei -> модели. Модель без дефисов: ExceptionGenerator отдаёт её в ключи как есть,
+        и она совпадает с нормализованным парт-номером книги. Часть моделей добавляется в Свод или Архив.
+        """
+        rnd = self._random
+        seeded: dict[str, list[tuple[str, str]]] = {CodeBook.__tablename__: [], ArchiveBook.__tablename__: []}
+        for _ in range(max(1, self.rows // 20)):
+            family = rnd.choice(HUAWEI_FAMILIES).replace('-', '')
+            model = f'{family}{rnd.randint(10, 99999)}{rnd.choice(PORTS)}{rnd.choice(SUFFIXES)}'
+            self.huawei_models[f'0235{rnd.randint(0, 0xFFFF):04X}'] = model
+            if rnd.random() < HUAWEI_MODEL_HITS:
+                seeded[rnd.choice(list(seeded))].append(('HUAWEI', model))
+        return seeded
+
+    def _book_part_numbers(self, table_name: str, seeded: list[tuple[str, str]] = ()) -> list[tuple[str, str]]:
+        count = max(1, int(self.rows * BOOK_SHARES[table_name]) - len(seeded))
+        part_numbers = [self._part_number() for _ in range(count)] + list(seeded)
+        self._random.shuffle(part_numbers)
+        self.part_numbers[table_name] = part_numbers
+        return part_numbers
+
+    @staticmethod
+    def _comment(part_number: str, rnd: random.Random) -> str:
+        return rnd.choice(COMMENTS).format(family=part_number.split('-')[0], ports=rnd.choice(PORTS))
+
+    def _generate(self) -> dict[str, list[dict[str, Any]]]:
+        rnd = self._random
+        books: dict[str, list[dict[str, Any]]] = {
+            Agreements.__tablename__: [{'КОД ПРОЕКТА': project} for project in PROJECTS[:30]],
+            AgreementsCollision.__tablename__: [{'АКТИВНОСТИ ИСКЛЮЧЕНИЯ': project} for project in PROJECTS[25:35]],
+            MainCategory.__tablename__: [
+                {'КАТЕГОРИЯ': category, 'ТЗ': float(i), 'РЕМОНТЫ': 100 * i}
+                for i, category in enumerate(CATEGORIES)
+            ],
+            SecondCategory.__tablename__: [
+                {'МОДЕЛЬ НАЧИНАЕТСЯ С…': family.rstrip('-'), 'КАТЕГОРИЯ СЛОЖНОСТИ ТЗ': rnd.choice(CATEGORIES[:6])}
+                for family in CISCO_FAMILIES + HUAWEI_FAMILIES
+            ],
+            Collision.__tablename__: [
+                {'ОПИСАНИЕ ВКЛЮЧАЕТ': description, 'КАТЕГОРИЯ СЛОЖНОСТИ ТЗ': category}
+                for description, category in COLLISION_RULES
+            ],
+        }
+        huawei_rows = self._huawei_models()
+        requests = [f'REQ{i:06d}' for i in range(max(10, self.rows // 10))]
+        books[Status.__tablename__] = [
+            {'№ ЗАПРОСА': request, 'СТАТУС': rnd.choice(('отправлено', 'в работе', 'закрыт'))}
+            for request in requests
+        ]
+        books[CodeBook.__tablename__] = [
+            {'PART #': pn, 'НАЗНАЧЕНИЕ': f'{rnd.choice(PROJECTS)} склад', 'ЛОГИЧЕСКИЙ УЧЕТ': 'S1',
+             'CЕБЕСТОИМОСТЬ ЕДИНИЦЫ БЕЗ НДС': str(rnd.randint(1, 9999))}
+            for _, pn in self._book_part_numbers(CodeBook.__tablename__, huawei_rows[CodeBook.__tablename__])
+        ]
+        books[PurchaseBuy.__tablename__] = [
+            {'АРТИКУЛ': pn, 'КЛИЕНТ': 'client', 'НАЗНАЧЕНИЕ': rnd.choice(PROJECTS)}
+            for _, pn in self._book_part_numbers(PurchaseBuy.__tablename__)
+        ]
+        books[PurchaseWant.__tablename__] = [
+            {'P/N': pn, 'КЛИЕНТЫ': 'client', 'ЗАКУПАЕМ ПОД ЗАКАЗЧИКА': rnd.choice((None, 'да')),
+             'СУММА СОВМЕСТНОЙ ЗАКУПКИ': str(rnd.randint(1, 99)), 'МАГАЗИН': 'shop',
+             'ОЦЕНОЧНАЯ СТОИМОСТЬ': str(rnd.randint(1, 999))}
+            for _, pn in self._book_part_numbers(PurchaseWant.__tablename__)
+        ]
+        books[ArchiveBook.__tablename__] = [
+            {'P/N': pn, 'СТОИМОСТЬ ЗАКУПКИ ЗИП': str(rnd.randint(1, 999)), 'ЗИП': rnd.choice(('-', '0', 'ZIP1', None)),
+             'ДТК СЕРВИС': 'dtk', 'НАЗНАЧЕНИЕ': rnd.choice(PROJECTS), 'КОЛ-ВО': rnd.randint(1, 5),
+             '№ ЗАПРОСА': rnd.choice(requests), 'КАТЕГОРИЯ': rnd.choice(CATEGORIES)}
+            for _, pn in self._book_part_numbers(ArchiveBook.__tablename__, huawei_rows[ArchiveBook.__tablename__])
+        ]
+        books[Chassis.__tablename__] = [
+            {'P/N': pn, 'БП': 'PWR', 'FAN': 'FAN', 'КОММЕНТАРИИ': 'chassis'}
+            for _, pn in self._book_part_numbers(Chassis.__tablename__)
+        ]
+        return books
+
+    def lookup_items(self, count: int, mix: Optional[dict[str, float]] = None, seed: int = 2) -> list[dict[str, Any]]:
+        """
+        Строки входного файла (P/N, ВЕНДОР, ОПИСАНИЕ) с отметкой вида ключа `kind`:
+        hit — парт-номер из книги; partial — его часть (стадия LIKE); extended — парт-номер с хвостом
+        (стадия INSTR); miss — несуществующий; cisco_r — Cisco с префиксом R-;
+        huawei_model — BOM-код Huawei, раскрываемый в модель (часть моделей есть в Своде или Архиве).
+        """
+        rnd = random.Random(seed)
+        mix = mix or KEY_MIX
+        kinds = list(mix)
+        weights = [mix[kind] for kind in kinds]
+        known = [entry for table_name in BOOK_SHARES for entry in self.part_numbers[table_name]]
+        cisco = [pn for vendor, pn in known if vendor == 'CISCO'] or [pn for _, pn in known]
+        bom_codes = list(self.huawei_models) or ['02350000']
+
+        items = []
+        for kind in rnd.choices(kinds, weights, k=count):
+            vendor, pn = rnd.choice(known)
+            if kind == 'partial':
+                pn = pn[1:-2]
+            elif kind == 'extended':
+                pn = f'{pn}-{rnd.choice(SUFFIXES)}'
+            elif kind == 'miss':
+                vendor, pn = 'CISCO', f'ZZ{rnd.randint(0, 10 ** 9)}-{rnd.choice(SUFFIXES)}'
+            elif kind == 'cisco_r':
+                vendor, pn = 'CISCO', f'R-{rnd.choice(cisco)}'
+            elif kind == 'huawei_model':
+                vendor, pn = 'HUAWEI', rnd.choice(bom_codes)
+            items.append({'kind': kind, 'P/N': pn, 'ВЕНДОР': vendor, 'ОПИСАНИЕ': self._comment(pn, rnd)})
+        return items
@@ -1,15 +1,34 @@
-from typing import Protocol
+from typing import Optional, Protocol
 
 
 # DatabaseInterface
 class IDatabaseRepository(Protocol):
+    async def initialize(self):
+        ...
+
     async def asyncget_all_tables(self):
         ...
 
     async def update_table(self, event):
         ...
 
+    async def load_table(self, table_name: str, data: list[dict]):
+        ...
+
+    def add_update_listener(self, listener):
+        ...
+
 
 class IORMQuary(Protocol):
     async def directory_books_query(self, item: dict, keys: list, normalized_comment: str):
         ...
+
+    async def directory_books_query_many(self, batch: list[tuple[dict, list, str]]):
+        ...
+
+    async def on_table_updated(self, table_name: str, changed_keys: Optional[set[str]] = None,
+                               deleted_keys: Optional[set[str]] = None):
+        ...
+
+    def log_lookup_summary(self, label: str):
+        ...
@@ -1,15 +1,27 @@
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import delete, Table, inspect, text
+from sqlalchemy import Table, Column, inspect, text, select, update, func
 from sqlalchemy.orm import Session
-from infrastructure.database.orm.models import AbstractTable, FileMetadata
+from infrastructure.database.orm.models import AbstractTable, ArchiveBook, FileMetadata, ArchiveSummary
 from core import IDatabaseRepository, IPartNumberFilter, IRobotLogger
 from infrastructure.database.settings.db_settings import SQLAlchemySettings
-import pandas as pd
+from infrastructure.database.lookup.substring_index import (has_substring_index,
+                                                            create_trigram_index)
+from infrastructure.database.lookup.agreements import (projection_models,
+                                                       models_to_refresh,
+                                                       refresh_agreement_weights)
+from infrastructure.database.lookup.archive_summary import summary_depends_on, refresh_archive_summary
+from infrastructure.database.loading.bulk_insert import CHUNK_SIZE, LoadReport, insert_rows
+from infrastructure.database.loading.diff_load import has_row_hash, row_hash, assign_ids, plan_diff, apply_diff
+from infrastructure.database.loading.shadow_table import (create_shadow, index_shadow, swap_shadow, drop_shadow,
+                                                          existing_indexes, index_names)
+from infrastructure.database.loading.excel_reader import ExcelBookReader
+from infrastructure.database.loading.change_detection import FileDigest, ReloadMetrics, file_digest
 from pathlib import Path
 from sqlalchemy.ext.declarative import DeclarativeMeta
-from typing import Optional, List
-from datetime import datetime
+from typing import Iterable, Optional, List
 import asyncio
+import itertools
+import time
 
 
 class DatabaseRepository(IDatabaseRepository):
@@ -21,13 +33,35 @@ class DatabaseRepository(IDatabaseRepository):
         self.robot_logger = robot_logger
         self.part_number_filter = part_number_filter
         self._db_lock = asyncio.Lock()
+        self._update_listeners = []
+        self.reload_metrics = ReloadMetrics()
+
+    def add_update_listener(self, listener) -> None:
+        """
+        Подписывает корутину listener(table_name, changed_keys, deleted_keys) на успешное обновление таблицы.
+        changed_keys — нормализованные парт-номера изменённых строк или None, если изменилась вся таблица;
+        deleted_keys — парт-номера удалённых строк (их часть changed_keys).
+        """
+        self._update_listeners.append(listener)
+
+    async def _notify_table_updated(self, table_name: str, changed_keys: Optional[set[str]] = None,
+                                    deleted_keys: Optional[set[str]] = None) -> None:
+        """Оповещает подписчиков об обновлении таблицы."""
+        for listener in self._update_listeners:
+            try:
+                await listener(table_name, changed_keys, deleted_keys)
+            except Exception as e:
+                self.robot_logger.error(f"Ошибка обработчика обновления таблицы {table_name}: {e}")
 
     async def initialize(self):
-        """Инициализация базы данных и пользовательских функций."""
-        await self.settings_alchemy.initialize()
+        """Инициализация базы данных: таблицы, столбцы и индексы нормализованных парт-номеров."""
         if not await self._is_database_initialized():
             await self._create_all_tables()
         await self._ensure_all_tables_exist()
+        await self._ensure_normalized_columns()
+        await self._ensure_trigram_indexes()
+        await self._ensure_agreement_projection()
+        await self._ensure_archive_summary()
 
     async def _is_database_initialized(self) -> bool:
         """Проверяет, инициализирована ли база данных (существуют ли таблицы)."""
@@ -85,7 +119,7 @@ class DatabaseRepository(IDatabaseRepository):
         """
         Проверяет существующие таблицы на наличие недостающих столбцов и добавляет их.
         """
-        for table_name in existing_tables:
+        for table_name in existing_tables & set(AbstractTable.metadata.tables.keys()):
             try:
                 def get_columns_sync(connection: AsyncSession):
                     inspector = inspect(connection)
@@ -94,7 +128,7 @@ class DatabaseRepository(IDatabaseRepository):
                 table_metadata = AbstractTable.metadata.tables[table_name]
                 existing_columns = {col['name'] for col in await conn.run_sync(get_columns_sync)}
                 defined_columns = {col.name for col in table_metadata.columns}
-                await self._add_missing_columns(conn, table_name, table_metadata, existing_columns, defined_columns)
+                await self._add_missing_columns(table_name, table_metadata, existing_columns, defined_columns)
             except Exception as e:
                 self.robot_logger.error(f"Ошибка при проверке столбцов таблицы '{table_name}': {e}")
 
@@ -137,6 +171,88 @@ class DatabaseRepository(IDatabaseRepository):
                     self.robot_logger.error(f"Ошибка при добавлении столбца '{column_name}' в таблицу '{table_name}': {e}")
             await conn.commit()
 
+    async def _ensure_normalized_columns(self) -> None:
+        """
+        Создаёт индексы по нормализованным парт-номерам и заполняет столбец
+        для строк, загруженных до его появления.
+        """
+        async with self._db_lock:
+            for table in AbstractTable.metadata.sorted_tables:
+                normalized_columns = self._get_normalized_columns(table)
+                if not normalized_columns:
+                    continue
+                try:
+                    async with self.engine.begin() as conn:
+                        # После подмены теневой таблицей индекс книги может носить теневое имя.
+                        existing = await existing_indexes(conn, table)
+                        for index in table.indexes:
+                            if existing.isdisjoint(index_names(index)):
+                                await conn.run_sync(index.create)
+                        for column in normalized_columns:
+                            await self._fill_normalized_column(conn, table, column)
+                except Exception as e:
+                    self.robot_logger.error(f"Ошибка при заполнении нормализованных столбцов '{table.name}': {e}")
+
+    async def _ensure_trigram_indexes(self) -> None:
+        """Создаёт FTS5-индексы для поиска по вхождению парт-номера."""
+        async with self._db_lock:
+            for table in AbstractTable.metadata.sorted_tables:
+                if not has_substring_index(table):
+                    continue
+                try:
+                    async with self.engine.begin() as conn:
+                        await create_trigram_index(conn, table)
+                    self.robot_logger.debug(f"Триграммный индекс '{table.name}' готов.")
+                except Exception as e:
+                    self.robot_logger.error(f"Не удалось построить триграммный индекс '{table.name}': {e}")
+
+    async def _ensure_agreement_projection(self) -> None:
+        """Пересчитывает проекцию действующих договоров для книг."""
+        async with self._db_lock:
+            try:
+                async with self.engine.begin() as conn:
+                    await refresh_agreement_weights(conn, projection_models())
+            except Exception as e:
+                self.robot_logger.error(f"Не удалось пересчитать проекцию договоров: {e}")
+
+    async def _ensure_archive_summary(self) -> None:
+        """Пересчитывает агрегаты Архива (QTY, отправленные позиции)."""
+        async with self._db_lock:
+            try:
+                async with self.engine.begin() as conn:
+                    await refresh_archive_summary(conn)
+            except Exception as e:
+                self.robot_logger.error(f"Не удалось пересчитать агрегаты Архива: {e}")
+
+    async def _fill_normalized_column(self, conn, table: Table, column: Column) -> None:
+        """Заполняет пустые значения нормализованного столбца одним UPDATE через SQL-функцию normalize_pn."""
+        source = getattr(self._get_model_class_by_table_name(table.name), column.info['normalized_from'])
+        result = await conn.execute(
+            update(table).where(column.is_(None), source.isnot(None)).values(
+                {column: func.nullif(func.normalize_pn(source), '')}
+            )
+        )
+        if not result.rowcount:
+            return
+        self.robot_logger.success(f"Столбец '{column.name}' таблицы '{table.name}' заполнен: {result.rowcount} строк.")
+
+    @staticmethod
+    def _get_normalized_columns(table: Table) -> list[Column]:
+        """Возвращает служебные столбцы с нормализованными парт-номерами."""
+        return [column for column in table.columns if 'normalized_from' in column.info]
+
+    @staticmethod
+    def _get_book_columns(table: Table) -> list[Column]:
+        """Возвращает столбцы, которые должны присутствовать в Excel-книге."""
+        return [column for column in table.columns
+                if not column.primary_key and not column.info.get('derived')]
+
+    def _normalize_value(self, value) -> Optional[str]:
+        """Нормализует значение для служебного столбца."""
+        if not isinstance(value, str):
+            return None
+        return self.part_number_filter.normalize_part_number(value) or None
+
     async def get_all_tables(self) -> List[str]:
         """Возвращает список всех таблиц в базе данных."""
         async with self._db_lock:
@@ -146,7 +262,9 @@ class DatabaseRepository(IDatabaseRepository):
                     return inspector.get_table_names()
 
                 tables = await conn.run_sync(get_tables_sync)
-            return tables[1:] if tables else []
+            return [name for name in tables
+                    if name in AbstractTable.metadata.tables and name != FileMetadata.__tablename__
+                    and not AbstractTable.metadata.tables[name].info.get('derived')]
 
     def _get_model_class_by_table_name(self, table_name: str) -> Optional[type[DeclarativeMeta]]:
         """Получить ORM-класс по имени таблицы, используя рефлексию SQLAlchemy."""
@@ -161,86 +279,256 @@ class DatabaseRepository(IDatabaseRepository):
             self.robot_logger.info("Обновление БД заблокировано для чтения")
             file_path = Path(event.src_path)
             table = AbstractTable.metadata.tables.get(file_path.parent.name)
-            data = self._get_data_exl(table, file_path)
-            self.robot_logger.info(f'Начинаем обновление {table.name}')
-            if data:
-                async with self.session_factory() as session:
-                    async with session.begin():
-                        await session.execute(delete(table))
-                        await self._insert_data(session, table, data)
-                        await self._update_metadata(session, file_path)
+            # Хеш снимается до чтения: если файл изменится во время загрузки, следующее событие его перезагрузит.
+            try:
+                digest = file_digest(file_path)
+            except OSError as e:
+                self.robot_logger.error(f'Ошибка чтения файла для загрузки в БД {e}')
+                return
+            if await self._is_file_unchanged(table.name, digest):
+                self.reload_metrics.skipped += 1
+                self.reload_metrics.skipped_bytes += digest.size
+                self.robot_logger.info(
+                    f'Содержимое {file_path.name} не изменилось, перезагрузка {table.name} пропущена',
+                    extra=self.reload_metrics.as_dict()
+                )
+                return
+            reader = self._open_book(table, file_path)
+            if reader:
+                with reader:
+                    self.robot_logger.info(f'Начинаем обновление {table.name}')
+                    chunks = reader.chunks()
+                    first_chunk = next(chunks, None)
+                    if first_chunk:
+                        await self._replace_table(table, itertools.chain([first_chunk], chunks), digest)
+                        self.reload_metrics.performed += 1
+                        self.robot_logger.info(f'Книга {table.name} перезагружена', extra=self.reload_metrics.as_dict())
             self.robot_logger.success("Обновление БД завершено, разблокировано")
 
-    def _get_data_exl(self, obj: Table, path: Path):
-        """Читает данные из Excel-файла."""
+    async def _is_file_unchanged(self, model_type: str, digest: FileDigest) -> bool:
+        """Совпадают ли хеш и размер файла с последней успешной загрузкой книги."""
+        async with self.session_factory() as session:
+            metadata = await self._get_metadata(session, model_type)
+        return (metadata is not None and metadata.status == 'updated'
+                and metadata.content_hash == digest.content_hash and metadata.size == digest.size)
+
+    @staticmethod
+    async def _get_metadata(session: AsyncSession, model_type: str) -> Optional[FileMetadata]:
+        """Последняя запись метаданных файла книги."""
+        return (await session.execute(
+            select(FileMetadata).where(FileMetadata.model_type == model_type).order_by(FileMetadata.id.desc()).limit(1)
+        )).scalar_one_or_none()
+
+    async def load_table(self, table_name: str, data: list[dict]) -> LoadReport:
+        """Заменяет содержимое книги строками data так же, как загрузка из файла, но без метаданных файла."""
+        async with self._db_lock:
+            chunks = (data[start:start + CHUNK_SIZE] for start in range(0, len(data), CHUNK_SIZE))
+            return await self._replace_table(AbstractTable.metadata.tables[table_name], chunks)
+
+    async def _replace_table(self, table: Table, chunks: Iterable[list[dict]],
+                             digest: Optional[FileDigest] = None) -> LoadReport:
+        """
+        Загружает пачки строк в теневую таблицу и применяет её к книге, пересобирает производные данные
+        и оповещает подписчиков. Книги с хешем строк обновляются по разнице с сохранёнными строками;
+        остальные (и книги с большим числом изменений) подменяются теневой таблицей переименованием.
+        """
+        report = LoadReport(table.name)
+        async with self.session_factory() as session:
+            try:
+                async with session.begin():
+                    shadow, staged = await self._stage_rows(session, table, chunks, report)
+                    plan = None
+                    if has_row_hash(table):
+                        stored = (await session.execute(
+                            select(table.c.id, table.c.row_hash).order_by(table.c.id)
+                        )).all()
+                        plan = plan_diff(stored, staged)
+                    if plan is None:
+                        await index_shadow(session, table, shadow, bool(table.info.get('trigram_index')))
+            except Exception:
+                async with session.begin():
+                    await drop_shadow(session, table)
+                raise
+
+        async with self.session_factory() as session:
+            async with session.begin():
+                # pysqlite не открывает транзакцию перед DDL: без явного BEGIN DROP TABLE зафиксировался бы сразу.
+                await session.execute(text('BEGIN IMMEDIATE'))
+                started = time.perf_counter()
+                if plan is not None:
+                    changed_keys, deleted_keys = await apply_diff(session, table, shadow, plan)
+                    await drop_shadow(session, table)
+                    await refresh_agreement_weights(session, models_to_refresh(table.name), only_missing=True)
+                    self.robot_logger.info(
+                        f'Книга {table.name} обновлена по разнице',
+                        extra={'deleted': len(plan.deleted_ids), 'inserted': len(plan.inserts), 'keys': len(changed_keys)}
+                    )
+                else:
+                    changed_keys = deleted_keys = None
+                    await swap_shadow(session, table, shadow, bool(table.info.get('trigram_index')))
+                    await refresh_agreement_weights(session, models_to_refresh(table.name))
+                updated_tables = await self._finish_update(session, table, changed_keys, deleted_keys, digest)
+                self.robot_logger.debug(
+                    f'Книга {table.name} обновлена из теневой таблицы',
+                    extra={'apply_seconds': round(time.perf_counter() - started, 3)}
+                )
+
+        self._log_load_report(report.finish())
+        for table_name, (keys, deleted) in updated_tables.items():
+            await self._notify_table_updated(table_name, keys, deleted)
+        return report
+
+    async def _stage_rows(self, session: AsyncSession, table: Table, chunks: Iterable[list[dict]],
+                          report: LoadReport) -> tuple[Table, list[tuple[int, Optional[str]]]]:
+        """
+        Нормализует строки по пачкам и вставляет их в теневую таблицу; книга не меняется.
+        Возвращает теневую таблицу и (id, хеш) её строк в порядке файла.
+        """
+        shadow = await create_shadow(session, table)
+        staged = []
+        start = 0
+        for chunk in chunks:
+            rows = assign_ids(self._prepare_rows(table, chunk, report, start))
+            start += len(chunk)
+            quarantined = len(report.quarantine)
+            await insert_rows(session, shadow, rows, report)
+            rejected = {entry['index'] for entry in report.quarantine[quarantined:]}
+            staged.extend((values['id'], values.get('row_hash')) for index, values in rows if index not in rejected)
+        return shadow, staged
+
+    async def _finish_update(self, session: AsyncSession, table: Table, changed_keys: Optional[set[str]],
+                             deleted_keys: Optional[set[str]], digest: Optional[FileDigest]
+                             ) -> dict[str, tuple[Optional[set[str]], Optional[set[str]]]]:
+        """
+        Пересчитывает Архив Итоги и метаданные файла; возвращает обновлённые таблицы
+        с изменёнными и удалёнными парт-номерами для оповещения.
+        Книга, загруженная не из файла, больше не совпадает с файлом — его хеш сбрасывается.
+        """
+        updated_tables = {table.name: (changed_keys, deleted_keys)}
+        if summary_depends_on(table.name):
+            # Итоги группируются по парт-номеру: после разницы по Архиву пересчитываются только изменённые ключи.
+            # Статусы и договора меняют итоги любых ключей — тогда пересчёт полный.
+            # Группа итогов пропадает только вместе со строками Архива, поэтому удалённые ключи те же.
+            summary_changes = (changed_keys, deleted_keys) if table.name == ArchiveBook.__tablename__ else (None, None)
+            await refresh_archive_summary(session, summary_changes[0])
+            updated_tables[ArchiveSummary.__tablename__] = summary_changes
+        if digest is not None:
+            await self._update_metadata(session, digest)
+        else:
+            await session.execute(
+                update(FileMetadata).where(FileMetadata.model_type == table.name).values(content_hash=None)
+            )
+        return updated_tables
+
+    def _open_book(self, obj: Table, path: Path) -> Optional[ExcelBookReader]:
+        """Открывает Excel-файл книги для потокового чтения и проверяет заголовок."""
         try:
-            col_lower = pd.read_excel(path, nrows=0).columns.tolist()
-            col_upper = [str(col).upper() for col in col_lower]
-            if self._column_validate(obj, col_upper):
-                data = pd.read_excel(path, na_filter=False).to_dict('records')
-                return data
-            else:
-                self.robot_logger.error(f'Валидация названия столбцов не пройдена {obj}')
-                self.robot_logger.error(f'Book: {col_upper} Table: {obj.columns[:-1]}')
+            reader = ExcelBookReader(path)
         except Exception as e:
             self.robot_logger.error(f'Ошибка чтения файла для загрузки в БД {e}')
+            return None
+        if self._column_validate(obj, reader.header):
+            return reader
+        reader.close()
+        self.robot_logger.error(f'Валидация названия столбцов не пройдена {obj}')
+        self.robot_logger.error(f'Book: {reader.header} Table: {self._get_book_columns(obj)}')
         return None
 
-    async def _insert_data(self, session: AsyncSession, table: Table, data: list[dict]):
-        """Вставляет данные в таблицу."""
-        for item in data:
-            obj_table = self._obj_create(table, item)
-            if obj_table:
-                try:
-                    session.add(obj_table)
-                    await session.flush()
-                except Exception as e:
-                    await session.rollback()
-                    self.robot_logger.error(f'Не удалось добавить объект в {table.name} {obj_table}')
-                    self.robot_logger.error(f'{e}')
-                    continue
-        self.robot_logger.success('Данные записаны в БД.')
+    def _prepare_rows(self, table: Table, data: list[dict], report: LoadReport,
+                      start: int = 0) -> list[tuple[int, dict]]:
+        """
+        Проверяет и нормализует пачку строк: (номер строки, значения по ключам столбцов); start — номер первой строки.
+        Строки, не прошедшие проверку, попадают в карантин отчёта, строки без парт-номера пропускаются.
+        """
+        columns, normalized = self._load_columns(table)
+        book_keys = [key for _, key, _ in columns]
+        with_hash = has_row_hash(table)
+        rows = []
+        for index, item in enumerate(data, start=start):
+            try:
+                values = self._row_create(columns, normalized, item)
+            except ValueError as e:
+                report.quarantine_row(index, str(e), item)
+                continue
+            if values is None:
+                report.skipped += 1
+                continue
+            if with_hash:
+                values['row_hash'] = row_hash(values, book_keys)
+            rows.append((index, values))
+        return rows
 
-    def _obj_create(self, table: Table, item: dict):
-        """Создание объекта таблицы из данных."""
-        item = {k.upper(): v for k, v in item.items()}
-        obj_instance = self._get_model_class_by_table_name(table.name)()
-        try:
-            for attr in obj_instance.__mapper__.attrs:
-                attr_name = attr.expression.name
-                if attr_name in item:
-                    value = item[attr_name]
-                    if not attr.columns[0].nullable:
-                        if not isinstance(value, str) or not value:
-                            return None
-                        normalize_part_number = self.part_number_filter.normalize_part_number(value)
-                        if not normalize_part_number:
-                            return None
-                    setattr(obj_instance, attr.key, value)
-            return obj_instance
-        except Exception as e:
-            self.robot_logger.error(f'Ошибка создания объекта для БД {e}')
-            return None
+    def _load_columns(self, table: Table) -> tuple[list[tuple[str, str, bool]], list[tuple[str, str]]]:
+        """
+        Столбцы книги для загрузки: (заголовок Excel, ключ столбца, обязательный)
+        и служебные нормализованные столбцы: (ключ столбца, ключ столбца-источника).
+        """
+        model = self._get_model_class_by_table_name(table.name)
+        attrs = {attr.key: attr.columns[0] for attr in model.__mapper__.column_attrs}
+        columns = [(column.name, column.key, not column.nullable)
+                   for column in attrs.values() if not column.primary_key and not column.info.get('derived')]
+        normalized = [(column.key, attrs[column.info['normalized_from']].key)
+                      for column in attrs.values() if 'normalized_from' in column.info]
+        return columns, normalized
+
+    def _row_create(self, columns: list[tuple[str, str, bool]], normalized: list[tuple[str, str]],
+                    item: dict) -> Optional[dict]:
+        """
+        Значения строки по ключам столбцов. None — строка без обязательного значения (пропускается);
+        ValueError — обязательное значение есть, но не является парт-номером (строка в карантин).
+        """
+        item = {str(k).upper(): v for k, v in item.items()}
+        values = {}
+        for name, key, required in columns:
+            value = item.get(name)
+            if required:
+                if value is None or value == '':
+                    return None
+                if not isinstance(value, str) or not self.part_number_filter.normalize_part_number(value):
+                    raise ValueError(f'Недопустимое значение столбца {name}: {value!r}')
+            values[key] = value
+        for key, source in normalized:
+            values[key] = self._normalize_value(values.get(source))
+        return values
+
+    def _log_load_report(self, report: LoadReport) -> None:
+        """Скорость загрузки в лог; строки в карантине — ошибкой с образцами."""
+        summary = report.as_dict()
+        if report.quarantine:
+            self.robot_logger.error(
+                f'Строки книги {report.table_name} не загружены: {len(report.quarantine)}', extra=summary
+            )
+        else:
+            summary.pop('quarantine_sample')
+        self.robot_logger.success(
+            f'Данные записаны в БД: {report.table_name}, {report.inserted} строк, {report.rows_per_sec} строк/с',
+            extra=summary
+        )
 
-    async def _update_metadata(self, session: AsyncSession, file_path: Path, status: str = 'updated') -> None:
-        """Обновляет метаданные файла."""
+    async def _update_metadata(self, session: AsyncSession, digest: FileDigest, status: str = 'updated') -> None:
+        """Обновляет метаданные файла: время изменения, хеш содержимого и размер на момент чтения."""
+        file_path = digest.path
         filename = file_path.name
-        last_modified = datetime.fromtimestamp(file_path.stat().st_mtime)
+        last_modified = digest.last_modified
         model_type = file_path.parent.name
         try:
-            metadata = await session.get(FileMetadata, model_type)
+            metadata = await self._get_metadata(session, model_type)
             if metadata:
                 metadata.file_path = str(file_path)
                 metadata.last_modified = last_modified
                 metadata.status = status
                 metadata.filename = filename
+                metadata.content_hash = digest.content_hash
+                metadata.size = digest.size
             else:
                 metadata = FileMetadata(
                     model_type=model_type,
                     filename=filename,
                     file_path=str(file_path),
                     last_modified=last_modified,
-                    status=status
+                    status=status,
+                    content_hash=digest.content_hash,
+                    size=digest.size
                 )
                 session.add(metadata)
             self.robot_logger.success(f'Объект таблицы {model_type} обновлен.')
@@ -258,5 +546,5 @@ class DatabaseRepository(IDatabaseRepository):
 
     def _column_validate(self, obj: Table, columns: list[str]) -> bool:
         """Проверяет, существуют ли указанные столбцы в объекте."""
-        obj_column = [column.name for column in obj.columns[:-1]]
+        obj_column = [column.name for column in self._get_book_columns(obj)]
         return set(obj_column).issubset(columns)
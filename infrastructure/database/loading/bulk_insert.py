@@ -0,0 +1,72 @@
+from sqlalchemy import Table, insert
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Any, Optional
+import time
+
+
+CHUNK_SIZE = 5000
+QUARANTINE_SAMPLE = 20
+
+
+class LoadReport:
+    """Итог загрузки книги: сколько строк вставлено, пропущено (пустой парт-номер), отправлено в карантин и скорость."""
+
+    def __init__(self, table_name: str):
+        self.table_name = table_name
+        self.inserted = 0
+        self.skipped = 0
+        self.quarantine: list[dict[str, Any]] = []
+        self.elapsed = 0.0
+        self._started = time.perf_counter()
+
+    def quarantine_row(self, index: int, reason: str, row: dict[str, Any]) -> None:
+        """index — номер строки в исходных данных (с нуля)."""
+        row = {key: value if value is None or isinstance(value, (str, int, float)) else str(value)
+               for key, value in row.items()}
+        self.quarantine.append({'index': index, 'reason': reason, 'row': row})
+
+    def finish(self) -> 'LoadReport':
+        self.elapsed = time.perf_counter() - self._started
+        return self
+
+    @property
+    def rows_per_sec(self) -> Optional[float]:
+        if not self.elapsed:
+            return None
+        return round(self.inserted / self.elapsed, 1)
+
+    def as_dict(self, sample: int = QUARANTINE_SAMPLE) -> dict[str, Any]:
+        return {
+            'table': self.table_name,
+            'inserted': self.inserted,
+            'skipped': self.skipped,
+            'quarantined': len(self.quarantine),
+            'seconds': round(self.elapsed, 3),
+            'rows_per_sec': self.rows_per_sec,
+            'quarantine_sample': self.quarantine[:sample],
+        }
+
+
+async def insert_rows(session: AsyncSession, table: Table, rows: list[tuple[int, dict[str, Any]]],
+                      report: LoadReport, chunk_size: int = CHUNK_SIZE) -> None:
+    """
+    Вставляет подготовленные строки (номер строки, значения по ключам столбцов) пачками executemany.
+    Пачка выполняется в точке сохранения; если она не прошла, её строки вставляются по одной,
+    а отвергнутые базой попадают в карантин — остальная загрузка и транзакция не откатываются.
+    """
+    statement = insert(table)
+    for start in range(0, len(rows), chunk_size):
+        chunk = rows[start:start + chunk_size]
+        try:
+            async with session.begin_nested():
+                await session.execute(statement, [values for _, values in chunk])
+            report.inserted += len(chunk)
+        except SQLAlchemyError:
+            for index, values in chunk:
+                try:
+                    async with session.begin_nested():
+                        await session.execute(statement, values)
+                    report.inserted += 1
+                except SQLAlchemyError as e:
+                    report.quarantine_row(index, str(getattr(e, 'orig', None) or e), values)
@@ -0,0 +1,45 @@
+from datetime import datetime
+from pathlib import Path
+from typing import Any
+import hashlib
+
+
+READ_CHUNK = 1 << 20
+
+
+class FileDigest:
+    """Хеш содержимого, размер и время изменения файла книги на момент чтения."""
+
+    def __init__(self, path: Path, content_hash: str, size: int, last_modified: datetime):
+        self.path = path
+        self.content_hash = content_hash
+        self.size = size
+        self.last_modified = last_modified
+
+
+def file_digest(path: Path, chunk_size: int = READ_CHUNK) -> FileDigest:
+    """Хеширует файл потоком по chunk_size байт; stat снимается до чтения."""
+    stat = path.stat()
+    digest = hashlib.blake2b(digest_size=32)
+    size = 0
+    with path.open('rb') as file:
+        for block in iter(lambda: file.read(chunk_size), b''):
+            digest.update(block)
+            size += len(block)
+    return FileDigest(path, digest.hexdigest(), size, datetime.fromtimestamp(stat.st_mtime))
+
+
+class ReloadMetrics:
+    """Счётчики перезагрузок книг по событиям изменения файлов: выполненные и пропущенные (содержимое то же)."""
+
+    def __init__(self):
+        self.performed = 0
+        self.skipped = 0
+        self.skipped_bytes = 0
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            'reloads_performed': self.performed,
+            'reloads_skipped': self.skipped,
+            'skipped_bytes': self.skipped_bytes,
+        }
@@ -0,0 +1,124 @@
+from infrastructure.database.lookup.substring_index import remove_from_trigram_index, add_to_trigram_index
+from sqlalchemy import Table, Integer, bindparam, select, insert, delete
+from sqlalchemy.ext.asyncio import AsyncSession
+from difflib import SequenceMatcher
+from typing import Any, Optional
+import hashlib
+import json
+
+
+# Шаг id при полной загрузке: новые строки при перезагрузке по разнице получают id между соседями.
+ID_GAP = 1 << 20
+ID_CHUNK = 10000
+# Доля изменённых строк, после которой полная перезаливка дешевле.
+MAX_CHANGED_SHARE = 0.5
+
+
+def has_row_hash(table: Table) -> bool:
+    return 'row_hash' in table.c
+
+
+def row_hash(values: dict[str, Any], keys: list[str]) -> str:
+    """Хеш значений строки в порядке столбцов книги; 1 и '1' дают разные хеши."""
+    content = json.dumps([values.get(key) for key in keys], ensure_ascii=False, default=str, separators=(',', ':'))
+    return hashlib.blake2b(content.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def assign_ids(rows: list[tuple[int, dict[str, Any]]]) -> list[tuple[int, dict[str, Any]]]:
+    """id строк полной загрузки: по порядку строк файла с шагом ID_GAP."""
+    for index, values in rows:
+        values['id'] = (index + 1) * ID_GAP
+    return rows
+
+
+class DiffPlan:
+    """Изменения книги: id удаляемых строк и новые строки теневой таблицы с назначенными им id книги."""
+
+    def __init__(self):
+        self.deleted_ids: list[int] = []
+        self.inserts: list[tuple[int, int]] = []
+
+    @property
+    def changes(self) -> int:
+        return len(self.deleted_ids) + len(self.inserts)
+
+
+def plan_diff(stored: list[tuple[int, Optional[str]]], staged: list[tuple[int, Optional[str]]]) -> Optional[DiffPlan]:
+    """
+    Сопоставляет строки теневой таблицы с сохранёнными (id, хеш) по совпадающим блокам хешей (difflib):
+    совпавшие строки остаются на месте, новые получают id между соседями, поэтому порядок id
+    совпадает с порядком строк файла, как после полной перезаливки.
+    None — изменений слишком много или между соседями не осталось свободных id.
+    """
+    if not stored:
+        return None
+    matcher = SequenceMatcher(None, [digest for _, digest in stored], [digest for _, digest in staged])
+
+    plan = DiffPlan()
+    kept: set[int] = set()
+    previous_id = 0
+    position = 0
+    # Последний блок имеет нулевую длину и забирает строки после последнего совпадения.
+    for stored_start, start, size in matcher.get_matching_blocks():
+        next_id = stored[stored_start][0] if size else None
+        if not _place(plan, staged[position:start], previous_id, next_id):
+            return None
+        kept.update(row_id for row_id, _ in stored[stored_start:stored_start + size])
+        if size:
+            previous_id = stored[stored_start + size - 1][0]
+        position = start + size
+
+    plan.deleted_ids = [row_id for row_id, _ in stored if row_id not in kept]
+    if plan.changes > MAX_CHANGED_SHARE * max(len(staged), 1):
+        return None
+    return plan
+
+
+def _place(plan: DiffPlan, pending: list[tuple[int, Optional[str]]], previous_id: int, next_id: Optional[int]) -> bool:
+    """Назначает новым строкам id на интервале (previous_id, next_id); False — места не хватает."""
+    if not pending:
+        return True
+    step = ID_GAP if next_id is None else (next_id - previous_id) // (len(pending) + 1)
+    if step < 1:
+        return False
+    for position, (staged_id, _) in enumerate(pending, start=1):
+        plan.inserts.append((staged_id, previous_id + step * position))
+    return True
+
+
+async def apply_diff(session: AsyncSession, table: Table, shadow: Table, plan: DiffPlan) -> tuple[set[str], set[str]]:
+    """
+    Удаляет строки книги и копирует новые из теневой таблицы по плану, поддерживая триграммный индекс.
+    Возвращает нормализованные парт-номера удалённых и вставленных строк и отдельно — удалённых.
+    """
+    column = table.c.normalized_part_number
+    trigram_index = table.info.get('trigram_index')
+    changed: set[str] = set()
+    deleted: set[str] = set()
+
+    for start in range(0, len(plan.deleted_ids), ID_CHUNK):
+        ids = plan.deleted_ids[start:start + ID_CHUNK]
+        rows = (await session.execute(select(table.c.id, column).where(table.c.id.in_(ids)))).all()
+        deleted.update(value for _, value in rows if value)
+        if trigram_index:
+            await remove_from_trigram_index(session, table, [tuple(row) for row in rows])
+        await session.execute(delete(table).where(table.c.id.in_(ids)))
+
+    columns = [book_column.key for book_column in table.columns if not book_column.primary_key]
+    copy = insert(table).from_select(
+        ['id'] + columns,
+        select(bindparam('new_id', type_=Integer), *(shadow.c[key] for key in columns)).where(
+            shadow.c.id == bindparam('staged_id', type_=Integer)
+        )
+    )
+    for start in range(0, len(plan.inserts), ID_CHUNK):
+        chunk = plan.inserts[start:start + ID_CHUNK]
+        await session.execute(copy, [{'staged_id': staged_id, 'new_id': new_id} for staged_id, new_id in chunk])
+        ids = [new_id for _, new_id in chunk]
+        changed.update((await session.execute(
+            select(column).where(table.c.id.in_(ids), column.isnot(None))
+        )).scalars())
+        if trigram_index:
+            await add_to_trigram_index(session, table, ids)
+    changed.update(deleted)
+    return changed, deleted
@@ -0,0 +1,65 @@
+from infrastructure.database.loading.bulk_insert import CHUNK_SIZE
+from openpyxl import load_workbook
+from pathlib import Path
+from typing import Any, Iterator
+
+
+class ExcelBookReader:
+    """
+    Потоковое чтение книги-справочника за один проход: openpyxl в режиме read_only,
+    заголовок — первая строка первого листа, строки отдаются пачками по chunk_size.
+    Значения как у pd.read_excel(na_filter=False): пустая ячейка — '', целое число — int.
+    """
+
+    def __init__(self, path: Path, chunk_size: int = CHUNK_SIZE):
+        self.chunk_size = chunk_size
+        self._workbook = load_workbook(path, read_only=True, data_only=True)
+        self._rows = self._workbook.worksheets[0].iter_rows(values_only=True)
+        self.header = self._read_header()
+
+    def __enter__(self) -> 'ExcelBookReader':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._workbook.close()
+
+    def _read_header(self) -> list[str]:
+        """Заголовки столбцов в верхнем регистре; пустые хвостовые ячейки отбрасываются."""
+        header = list(next(self._rows, ()))
+        while header and header[-1] is None:
+            header.pop()
+        return [f'UNNAMED: {i}' if value is None else str(value).upper() for i, value in enumerate(header)]
+
+    @staticmethod
+    def _value(value: Any) -> Any:
+        if value is None:
+            return ''
+        if isinstance(value, float) and value.is_integer():
+            return int(value)
+        return value
+
+    def chunks(self) -> Iterator[list[dict[str, Any]]]:
+        """
+        Пачки строк «заголовок → значение». Пустые строки между данными сохраняются
+        (при загрузке они пропускаются), пустые строки в конце листа отбрасываются.
+        """
+        width = len(self.header)
+        chunk: list[dict[str, Any]] = []
+        blank = 0
+        for row in self._rows:
+            values = [self._value(value) for value in row[:width]]
+            if all(value == '' for value in values):
+                blank += 1
+                continue
+            chunk.extend(dict.fromkeys(self.header, '') for _ in range(blank))
+            blank = 0
+            values.extend([''] * (width - len(values)))
+            chunk.append(dict(zip(self.header, values)))
+            if len(chunk) >= self.chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
@@ -0,0 +1,88 @@
+from infrastructure.database.lookup.substring_index import trigram_table_name
+from sqlalchemy import Table, Column, Index, MetaData, text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession
+from typing import Union
+
+
+SHADOW_SUFFIX = '__shadow'
+
+
+def shadow_table(table: Table) -> Table:
+    """Теневая копия книги: те же столбцы без индексов, имя с суффиксом SHADOW_SUFFIX."""
+    return Table(
+        f'{table.name}{SHADOW_SUFFIX}', MetaData(),
+        *(Column(column.name, column.type, key=column.key, primary_key=column.primary_key, nullable=column.nullable)
+          for column in table.columns)
+    )
+
+
+def index_names(index: Index) -> tuple[str, str]:
+    """
+    Два имени индекса книги: исходное и теневое. Индекс переезжает вместе с таблицей при RENAME,
+    поэтому после подмены у книги остаётся одно из них, а следующая теневая таблица берёт другое.
+    """
+    return str(index.name), f'{index.name}{SHADOW_SUFFIX}'
+
+
+async def existing_indexes(conn: Union[AsyncConnection, AsyncSession], table: Table) -> set[str]:
+    """Имена индексов, уже построенных на таблице в базе."""
+    result = await conn.execute(
+        text("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = :name"), {'name': table.name}
+    )
+    return set(result.scalars())
+
+
+async def drop_shadow(session: AsyncSession, table: Table) -> None:
+    """Удаляет теневую таблицу и её триграммный индекс, оставшиеся от прерванной загрузки."""
+    shadow = shadow_table(table)
+    await session.execute(text(f'DROP TABLE IF EXISTS "{trigram_table_name(shadow)}"'))
+    await session.execute(text(f'DROP TABLE IF EXISTS "{shadow.name}"'))
+
+
+async def create_shadow(session: AsyncSession, table: Table) -> Table:
+    """Создаёт пустую теневую таблицу книги."""
+    await drop_shadow(session, table)
+    shadow = shadow_table(table)
+    connection = await session.connection()
+    await connection.run_sync(shadow.create)
+    return shadow
+
+
+async def index_shadow(session: AsyncSession, table: Table, shadow: Table, trigram_index: bool) -> None:
+    """
+    Строит индексы книги на заполненной теневой таблице — до подмены, вне блокировки книги.
+    Индексы B-дерева получают имена, не занятые книгой (см. index_names).
+    Триграммный индекс сразу ссылается на книгу (content), поэтому после переименования
+    остаётся действительным без перестроения.
+    """
+    live = await existing_indexes(session, table)
+    connection = await session.connection()
+    for index in table.indexes:
+        name = next(name for name in index_names(index) if name not in live)
+        shadow_index = Index(name, *(shadow.c[column.key] for column in index.columns), unique=index.unique)
+        await connection.run_sync(shadow_index.create)
+    if not trigram_index:
+        return
+    name = trigram_table_name(shadow)
+    await session.execute(text(
+        f'CREATE VIRTUAL TABLE "{name}" USING fts5('
+        f'normalized_part_number, content=\'{table.name}\', content_rowid=\'id\', tokenize=\'trigram\')'
+    ))
+    await session.execute(text(
+        f'INSERT INTO "{name}"(rowid, normalized_part_number) SELECT id, normalized_part_number FROM "{shadow.name}"'
+    ))
+
+
+async def swap_shadow(session: AsyncSession, table: Table, shadow: Table, trigram_index: bool) -> None:
+    """
+    Подменяет книгу теневой таблицей: DROP и RENAME в одной транзакции.
+    Читатели видят прежнюю книгу до фиксации; индексы уже построены и переезжают вместе с таблицей.
+    """
+    if trigram_index:
+        await session.execute(text(f'DROP TABLE IF EXISTS "{trigram_table_name(table)}"'))
+    await session.execute(text(f'DROP TABLE "{table.name}"'))
+    await session.execute(text(f'ALTER TABLE "{shadow.name}" RENAME TO "{table.name}"'))
+    if trigram_index:
+        await session.execute(text(
+            f'ALTER TABLE "{trigram_table_name(shadow)}" RENAME TO "{trigram_table_name(table)}"'
+        ))
@@ -0,0 +1,46 @@
+from sqlalchemy import select, update, func
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession
+from infrastructure.database.orm.models import AbstractTable, Agreements, AgreementsCollision
+from typing import Union
+
+
+AGREEMENT_SOURCES = {Agreements.__tablename__, AgreementsCollision.__tablename__}
+
+
+def projection_models() -> list:
+    """Книги со столбцом agreement_weight."""
+    return [cls for cls in AbstractTable.__subclasses__() if 'agreement_weight' in cls.__table__.c]
+
+
+def models_to_refresh(table_name: str) -> list:
+    """Книги, чью проекцию нужно пересчитать после перезаливки table_name."""
+    if table_name in AGREEMENT_SOURCES:
+        return projection_models()
+    return [cls for cls in projection_models() if cls.__tablename__ == table_name]
+
+
+def _weight_expression(model):
+    """Число сочетаний, которые давал join с Договора/Договора Исключения для строки книги."""
+    agreement_filter = model.__table__.c.agreement_weight.info['agreement_filter']
+    if agreement_filter == 'collisions':
+        return select(func.count()).select_from(AgreementsCollision).where(
+            func.instr(model.appointment, AgreementsCollision.project_code_collision) == 0
+        ).scalar_subquery()
+    return select(func.count()).select_from(Agreements).join(
+        AgreementsCollision, Agreements.project_code != AgreementsCollision.project_code_collision
+    ).where(
+        func.instr(model.appointment, Agreements.project_code) > 0
+    ).scalar_subquery()
+
+
+async def refresh_agreement_weights(conn: Union[AsyncConnection, AsyncSession], models: list,
+                                    only_missing: bool = False) -> None:
+    """
+    Пересчитывает agreement_weight одним UPDATE на книгу.
+    only_missing — только для строк без веса (вставленных при перезагрузке по разнице).
+    """
+    for model in models:
+        statement = update(model).values(agreement_weight=_weight_expression(model))
+        if only_missing:
+            statement = statement.where(model.agreement_weight.is_(None))
+        await conn.execute(statement.execution_options(synchronize_session=False))
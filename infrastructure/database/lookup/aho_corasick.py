@@ -0,0 +1,65 @@
+from collections import deque
+from typing import Iterable, Optional
+
+
+class AhoCorasick:
+    """
+    Автомат Ахо–Корасик над набором строк.
+    find_all находит все сохранённые строки, входящие в запрос, за один проход по запросу.
+    """
+
+    def __init__(self, patterns: Iterable[str]):
+        self._goto: list[dict[str, int]] = [{}]
+        self._fail: list[int] = [0]
+        self._terminal: list[Optional[str]] = [None]
+        self._output_link: list[int] = [0]
+        for pattern in patterns:
+            if pattern:
+                self._add(pattern)
+        self._build()
+
+    def __len__(self) -> int:
+        return sum(1 for terminal in self._terminal if terminal is not None)
+
+    def _add(self, pattern: str) -> None:
+        node = 0
+        for char in pattern:
+            child = self._goto[node].get(char)
+            if child is None:
+                child = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._terminal.append(None)
+                self._output_link.append(0)
+                self._goto[node][char] = child
+            node = child
+        self._terminal[node] = pattern
+
+    def _build(self) -> None:
+        """Строит суффиксные ссылки и ссылки на ближайший терминальный узел (обход в ширину)."""
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                fail = self._goto[fail].get(char, 0)
+                self._fail[child] = fail if fail != child else 0
+                fail = self._fail[child]
+                self._output_link[child] = fail if self._terminal[fail] is not None else self._output_link[fail]
+                queue.append(child)
+
+    def find_all(self, text: str) -> list[str]:
+        """Все различные сохранённые строки, входящие в text, в порядке первого вхождения."""
+        found: dict[str, None] = {}
+        node = 0
+        for char in text:
+            while node and char not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(char, 0)
+            match = node if self._terminal[node] is not None else self._output_link[node]
+            while match:
+                found[self._terminal[match]] = None
+                match = self._output_link[match]
+        return list(found)
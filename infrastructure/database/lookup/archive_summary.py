@@ -0,0 +1,169 @@
+from sqlalchemy import select, delete, func, literal, true
+from sqlalchemy.orm import aliased
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession
+from infrastructure.database.orm.models import ArchiveBook, ArchiveSummary, MainCategory, Status
+from infrastructure.database.lookup.agreements import AGREEMENT_SOURCES
+from infrastructure.database.lookup.substring_index import (
+    rebuild_trigram_index, remove_from_trigram_index, add_to_trigram_index
+)
+from typing import Iterable, Optional, Union
+
+
+SUMMARY_SOURCES = {ArchiveBook.__tablename__, Status.__tablename__} | AGREEMENT_SOURCES
+KEY_CHUNK = 500
+
+
+def summary_depends_on(table_name: str) -> bool:
+    """Нужно ли пересчитать Архив Итоги после перезаливки table_name."""
+    return table_name in SUMMARY_SOURCES
+
+
+def _latest_rows(grouped):
+    """
+    Значения «голых» столбцов берутся из последней по id строки группы (max(id)) —
+    ту же строку возвращал GROUP BY при поиске по одному ключу.
+    """
+    grouped = grouped.subquery()
+    latest = aliased(ArchiveBook)
+    return grouped, latest, select(grouped).join(latest, latest.id == grouped.c.latest_id)
+
+
+def latest_category_id(a):
+    """
+    Коррелированный подзапрос: id последней строки парт-номера строки a (Архив) с категорией
+    из Основных Категорий. Категория по точному совпадению берётся из этой строки — по тому же
+    правилу max(id), что и значения Архив Итогов.
+    """
+    latest = aliased(ArchiveBook)
+    category = aliased(MainCategory)
+    return select(
+        func.max(latest.id)
+    ).join(
+        category, latest.category == category.category
+    ).where(
+        latest.normalized_part_number == a.normalized_part_number,
+        latest.part_number == a.part_number,
+    ).scalar_subquery()
+
+
+def _shipped_query(scope=true()):
+    """Строки для каскада поиска: отправленные, с ЗИП и прошедшие фильтр договоров; scope — условие на строки Архива."""
+    a = ArchiveBook
+    grouped, latest, query = _latest_rows(select(
+        func.max(a.id).label('latest_id'),
+        func.sum(a.amount * a.agreement_weight).label('shipped_qty'),
+        func.count().label('shipped_rows'),
+    ).select_from(
+        a
+    ).join(
+        Status, a.project_code == Status.request_number
+    ).where(
+        a.agreement_weight > 0,
+        Status.status == 'отправлено',
+        a.zip_values != None,
+        a.zip_values != '-',
+        a.zip_values != '0',
+        scope,
+    ).group_by(a.part_number))
+    return query.with_only_columns(
+        latest.part_number,
+        latest.normalized_part_number,
+        latest.cost_of_zip,
+        latest.zip_values,
+        latest.dtk_service,
+        latest.appointment,
+        latest.project_code,
+        grouped.c.shipped_qty,
+        grouped.c.shipped_rows,
+    )
+
+
+def _qty_query(scope=true()):
+    """QTY для строк, найденных в основных книгах: статус сравнивается без пробелов и регистра."""
+    a = ArchiveBook
+    grouped, latest, query = _latest_rows(select(
+        func.max(a.id).label('latest_id'),
+        func.sum(a.amount).label('qty'),
+        func.count().label('qty_rows'),
+    ).select_from(
+        a
+    ).join(
+        Status, a.project_code == Status.request_number
+    ).where(
+        func.lower(func.replace(Status.status, " ", "")) == 'отправлено',
+        scope,
+    ).group_by(a.part_number))
+    return query.with_only_columns(
+        latest.part_number,
+        latest.normalized_part_number,
+        grouped.c.qty,
+        latest.project_code,
+        grouped.c.qty_rows,
+        literal(0),
+    ).where(true())  # WHERE обязателен перед ON CONFLICT в INSERT ... SELECT
+
+
+def _key_scopes(changed_keys: Iterable[str]) -> list[tuple]:
+    """
+    Пары условий (строки Архива, строки Итогов) по пачкам изменённых ключей.
+    Группы по парт-номеру целиком лежат внутри одного нормализованного ключа, поэтому пересчёт точен.
+    Строки без нормализованного ключа в changed_keys не попадают и пересчитываются всегда.
+    """
+    keys = sorted(changed_keys)
+    scopes = [
+        (ArchiveBook.normalized_part_number.in_(keys[start:start + KEY_CHUNK]),
+         ArchiveSummary.normalized_part_number.in_(keys[start:start + KEY_CHUNK]))
+        for start in range(0, len(keys), KEY_CHUNK)
+    ]
+    scopes.append((ArchiveBook.normalized_part_number.is_(None), ArchiveSummary.normalized_part_number.is_(None)))
+    return scopes
+
+
+async def _insert_summary(conn: Union[AsyncConnection, AsyncSession], scope=true()) -> None:
+    s = ArchiveSummary
+    await conn.execute(insert(s).from_select(
+        [s.part_number, s.normalized_part_number, s.cost_of_zip, s.zip_values, s.dtk_service,
+         s.appointment, s.project_code, s.shipped_qty, s.shipped_rows],
+        _shipped_query(scope)
+    ))
+    qty_insert = insert(s).from_select(
+        [s.part_number, s.normalized_part_number, s.qty, s.qty_request_number, s.qty_rows, s.shipped_rows],
+        _qty_query(scope)
+    )
+    await conn.execute(qty_insert.on_conflict_do_update(
+        index_elements=[s.part_number],
+        set_={
+            s.qty.name: qty_insert.excluded.qty,
+            s.qty_request_number.name: qty_insert.excluded.qty_request_number,
+            s.qty_rows.name: qty_insert.excluded.qty_rows,
+        }
+    ))
+
+
+async def refresh_archive_summary(conn: Union[AsyncConnection, AsyncSession],
+                                  changed_keys: Optional[Iterable[str]] = None) -> None:
+    """
+    Пересчитывает Архив Итоги набором INSERT ... SELECT и обновляет его триграммный индекс.
+    changed_keys — нормализованные парт-номера изменённых строк Архива: пересчитываются только их группы
+    (None — все итоги, например после перезаливки Статусов или договоров).
+    """
+    s = ArchiveSummary
+    trigram_index = s.__table__.info.get('trigram_index')
+    if changed_keys is None:
+        await conn.execute(delete(s))
+        await _insert_summary(conn)
+        if trigram_index:
+            await rebuild_trigram_index(conn, s.__table__)
+        return
+
+    for source_scope, summary_scope in _key_scopes(changed_keys):
+        if trigram_index:
+            stale = (await conn.execute(select(s.id, s.normalized_part_number).where(summary_scope))).all()
+            await remove_from_trigram_index(conn, s.__table__, [tuple(row) for row in stale])
+        await conn.execute(delete(s).where(summary_scope))
+        await _insert_summary(conn, source_scope)
+        if trigram_index:
+            await add_to_trigram_index(conn, s.__table__, list(
+                (await conn.execute(select(s.id).where(summary_scope))).scalars()
+            ))
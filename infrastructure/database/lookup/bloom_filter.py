@@ -0,0 +1,87 @@
+from infrastructure.database.lookup.collision_matcher import sqlite_lower
+from typing import Iterable
+import math
+import numpy as np
+
+
+_MASK_64 = (1 << 64) - 1
+_MASK_32 = (1 << 32) - 1
+
+
+class BloomFilter:
+    """
+    Фильтр Блума по строкам: «нет» — точно нет, «да» — возможно есть.
+    Позиции битов — двойное хеширование встроенного hash(), поэтому фильтр живёт только в памяти процесса.
+    """
+
+    def __init__(self, items: list[str], false_positive_rate: float, max_bytes: int):
+        capacity = max(len(items), 1)
+        size = math.ceil(-capacity * math.log(false_positive_rate) / math.log(2) ** 2)
+        self.size = max(8, min(size, max_bytes * 8))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+
+        bits = np.zeros(self.size, dtype=bool)
+        if items:
+            hashes = np.fromiter((hash(item) & _MASK_64 for item in items), dtype=np.uint64, count=len(items))
+            first, second = hashes & np.uint64(_MASK_32), (hashes >> np.uint64(32)) | np.uint64(1)
+            for i in range(self.hash_count):
+                bits[(first + np.uint64(i) * second) % np.uint64(self.size)] = True
+        self._bits = bytearray(np.packbits(bits, bitorder='little').tobytes())
+
+    def _positions(self, item: str):
+        value = hash(item) & _MASK_64
+        first, second = value & _MASK_32, (value >> 32) | 1
+        for i in range(self.hash_count):
+            yield (first + i * second) % self.size
+
+    def add(self, item: str) -> None:
+        """Добавляет строку; размер фильтра не меняется, поэтому доля ложных «да» растёт."""
+        for position in self._positions(item):
+            self._bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item: str) -> bool:
+        bits = self._bits
+        for position in self._positions(item):
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    @property
+    def nbytes(self) -> int:
+        return len(self._bits)
+
+
+class SubstringBloomFilter:
+    """
+    Подстроки длины `max_length` нормализованных парт-номеров книги в фильтре Блума.
+    might_contain(pn) == False означает, что ни один парт-номер книги не содержит pn,
+    т.е. стадии EXACT и LIKE ничего не найдут. Регистр ASCII не различается, как в LIKE SQLite.
+    Ключи короче `max_length` фильтр не отсекает: такие подстроки есть почти в любой книге.
+    """
+
+    def __init__(self, keys: Iterable[str], max_length: int, false_positive_rate: float, max_bytes: int):
+        self.max_length = max_length
+        windows = set()
+        for key in keys:
+            key = sqlite_lower(key)
+            windows.update(key[i:i + max_length] for i in range(len(key) - max_length + 1))
+        self._filter = BloomFilter(list(windows), false_positive_rate, max_bytes)
+
+    def add(self, key: str) -> None:
+        key = sqlite_lower(key)
+        for i in range(len(key) - self.max_length + 1):
+            self._filter.add(key[i:i + self.max_length])
+
+    def might_contain(self, part_number: str) -> bool:
+        part_number = sqlite_lower(part_number)
+        if len(part_number) < self.max_length:
+            return True
+        # Ключ возможен, только если в книге встречаются все его окна длины max_length.
+        return all(
+            part_number[i:i + self.max_length] in self._filter
+            for i in range(len(part_number) - self.max_length + 1)
+        )
+
+    @property
+    def nbytes(self) -> int:
+        return self._filter.nbytes
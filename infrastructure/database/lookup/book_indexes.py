@@ -0,0 +1,131 @@
+from infrastructure.database.lookup.aho_corasick import AhoCorasick
+from infrastructure.database.lookup.prefix_index import PrefixTrie
+from infrastructure.database.lookup.collision_matcher import CollisionMatcher
+from infrastructure.database.lookup.bloom_filter import SubstringBloomFilter
+from infrastructure.database.orm.models import Collision
+from settings.config import BloomSettings
+from sqlalchemy import Table, select, inspect
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Any, Optional
+import asyncio
+
+
+class BookIndex:
+    """
+    In-process индексы одной книги, построенные по её нормализованным парт-номерам.
+    Структуры строятся при первом обращении: книге обычно нужна только одна из них.
+    """
+
+    def __init__(self, keys: list[str], bloom_settings: Optional[BloomSettings] = None):
+        self.keys = keys
+        self.bloom_settings = bloom_settings
+        self._containment: Optional[AhoCorasick] = None
+        self._prefixes: Optional[PrefixTrie] = None
+        self._substrings: Optional[SubstringBloomFilter] = None
+
+    def extend(self, keys: set[str]) -> None:
+        """Добавляет парт-номера после перезагрузки книги по разнице, в которой строки только вставлялись."""
+        new_keys = keys.difference(self.keys)
+        if not new_keys:
+            return
+        self.keys = list(self.keys) + sorted(new_keys)
+        self._containment = None
+        if self._prefixes is not None:
+            for key in new_keys:
+                self._prefixes.add(key)
+        if self._substrings is not None:
+            for key in new_keys:
+                self._substrings.add(key)
+
+    def might_contain(self, part_number: str) -> bool:
+        """False — ни один парт-номер книги не содержит part_number (стадии EXACT и LIKE пусты)."""
+        if not self.bloom_settings or not self.bloom_settings.enabled:
+            return True
+        if self._substrings is None:
+            settings = self.bloom_settings
+            self._substrings = SubstringBloomFilter(
+                self.keys, settings.substring_length, settings.false_positive_rate, settings.max_bytes
+            )
+        return self._substrings.might_contain(part_number)
+
+    def may_match(self, part_number: str) -> bool:
+        """Может ли каскад EXACT/LIKE/INSTR найти part_number в книге."""
+        return self.might_contain(part_number) or bool(self.contained_keys(part_number))
+
+    def contained_keys(self, part_number: str) -> list[str]:
+        """Сохранённые парт-номера, входящие в part_number (стадия INSTR)."""
+        if self._containment is None:
+            self._containment = AhoCorasick(self.keys)
+        return self._containment.find_all(part_number)
+
+    def prefix_keys(self, part_number: str) -> list[str]:
+        """Сохранённые значения, являющиеся префиксами part_number."""
+        if self._prefixes is None:
+            self._prefixes = PrefixTrie(self.keys)
+        return self._prefixes.prefixes_of(part_number)
+
+
+class BookIndexRegistry:
+    """
+    Индексы книг для SQL-репозиториев.
+    Строятся при первом обращении к книге и сбрасываются после update_table.
+    """
+
+    def __init__(self, bloom_settings: Optional[BloomSettings] = None):
+        self.bloom_settings = bloom_settings
+        self._indexes: dict[str, Any] = {}
+        self._generations: dict[str, int] = {}
+        self._locks: dict[str, asyncio.Lock] = {}
+
+    def invalidate(self, table_name: str, changed_keys: Optional[set[str]] = None,
+                   deleted_keys: Optional[set[str]] = None) -> None:
+        """
+        changed_keys — парт-номера, изменённые перезагрузкой по разнице: если строки только вставлялись,
+        индекс дополняется. Иначе (удаления, полная перезаливка) индекс строится заново по текущим
+        парт-номерам книги, чтобы в нём не копились удалённые ключи.
+        """
+        self._generations[table_name] = self._generations.get(table_name, 0) + 1
+        index = self._indexes.get(table_name)
+        if changed_keys is not None and not deleted_keys and isinstance(index, BookIndex):
+            index.extend(changed_keys)
+        else:
+            self._indexes.pop(table_name, None)
+
+    async def get(self, session: AsyncSession, obj_table) -> Optional[BookIndex]:
+        """Возвращает индекс книги, при необходимости загружая её парт-номера из БД."""
+        table: Table = inspect(obj_table).mapper.local_table
+        if 'normalized_part_number' not in table.c:
+            return None
+
+        async def load():
+            column = table.c.normalized_part_number
+            keys = (await session.execute(
+                select(column).where(column.isnot(None)).distinct()
+            )).scalars().all()
+            return BookIndex(keys, self.bloom_settings)
+
+        return await self._get_or_load(table.name, load)
+
+    async def collision_matcher(self, session: AsyncSession) -> CollisionMatcher:
+        """Возвращает скомпилированные правила Исключений."""
+        async def load():
+            rules = (await session.execute(
+                select(Collision.id, Collision.description_content).order_by(Collision.id)
+            )).all()
+            return CollisionMatcher(rules)
+
+        return await self._get_or_load(Collision.__tablename__, load)
+
+    async def _get_or_load(self, table_name: str, load):
+        index = self._indexes.get(table_name)
+        if index is not None:
+            return index
+        lock = self._locks.setdefault(table_name, asyncio.Lock())
+        async with lock:
+            index = self._indexes.get(table_name)
+            if index is None:
+                generation = self._generations.get(table_name, 0)
+                index = await load()
+                if generation == self._generations.get(table_name, 0):
+                    self._indexes[table_name] = index
+        return index
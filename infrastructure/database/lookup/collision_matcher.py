@@ -0,0 +1,47 @@
+from infrastructure.database.lookup.aho_corasick import AhoCorasick
+from typing import Any, Iterable, Optional
+
+
+_ASCII_LOWER = str.maketrans('ABCDEFGHIJKLMNOPQRSTUVWXYZ', 'abcdefghijklmnopqrstuvwxyz')
+
+
+def sqlite_lower(value: str) -> str:
+    """lower() как во встроенной функции SQLite: меняется регистр только ASCII-букв."""
+    return value.translate(_ASCII_LOWER)
+
+
+def rule_pattern(description: Optional[str]) -> Optional[str]:
+    """Текст правила в том виде, в котором он сравнивался в SQL: без пробелов и в нижнем регистре."""
+    if description is None:
+        return None
+    return sqlite_lower(description.replace(' ', ''))
+
+
+class CollisionMatcher:
+    """
+    Правила Исключений, скомпилированные в автомат Ахо–Корасик.
+    match находит все правила, текст которых входит в комментарий, за один проход по комментарию.
+    Пустое правило, как и instr(x, ''), совпадает с любым комментарием.
+    """
+
+    def __init__(self, rules: Iterable[tuple[Any, Optional[str]]]):
+        self._rules_by_pattern: dict[str, list[Any]] = {}
+        self._always: list[Any] = []
+        self._order: dict[Any, int] = {}
+        for rule, description in rules:
+            pattern = rule_pattern(description)
+            if pattern is None:
+                continue
+            self._order[rule] = len(self._order)
+            if pattern:
+                self._rules_by_pattern.setdefault(pattern, []).append(rule)
+            else:
+                self._always.append(rule)
+        self._automaton = AhoCorasick(self._rules_by_pattern)
+
+    def match(self, comment: str) -> list[Any]:
+        """Совпавшие правила в порядке их следования в книге."""
+        rules = list(self._always)
+        for pattern in self._automaton.find_all(sqlite_lower(comment.replace(' ', ''))):
+            rules.extend(self._rules_by_pattern[pattern])
+        return sorted(rules, key=self._order.__getitem__)
@@ -0,0 +1,116 @@
+from infrastructure.database.lookup.memory_engine import BookEntry
+from typing import Any, Optional
+import numpy as np
+
+
+_SEPARATOR = '\n'
+
+
+def _object_column(values: list) -> np.ndarray:
+    """Столбец значений как есть (без приведения типов NumPy)."""
+    column = np.empty(len(values), dtype=object)
+    column[:] = values
+    return column
+
+
+class ColumnarPartNumberBook:
+    """
+    Книга каскада EXACT → LIKE → INSTR в столбцах NumPy: нормализованный парт-номер,
+    длина исходного парт-номера и столбцы результата. Стадии и выбор ближайшего по длине
+    выполняются векторными операциями над массивами; результаты те же, что у PartNumberBook.
+    """
+
+    def __init__(self, entries: list[BookEntry]):
+        self.size = len(entries)
+        normalized = [entry.normalized for entry in entries]
+        self.lengths = np.fromiter((len(entry.part_number) for entry in entries), dtype=np.int64, count=self.size)
+        self.part_numbers = _object_column([entry.part_number for entry in entries])
+        self.zip_values = _object_column([entry.zip_value for entry in entries])
+        names = list(entries[0].payload) if entries else []
+        self.columns = {name: _object_column([entry.payload[name] for entry in entries]) for name in names}
+
+        # EXACT и INSTR: отсортированные ключи; строки с одинаковым ключом идут подряд в порядке книги.
+        keys = np.array(normalized, dtype=str)
+        self._order = np.argsort(keys, kind='stable')
+        self._sorted_keys = keys[self._order]
+
+        # LIKE: все ключи одной строкой кодов символов; начало ключа i — self._starts[i].
+        blob = _SEPARATOR.join(normalized)
+        self._codes = np.frombuffer(blob.encode('utf-32-le'), dtype=np.uint32)
+        key_lengths = np.fromiter((len(key) for key in normalized), dtype=np.int64, count=self.size)
+        self._starts = np.concatenate(([0], np.cumsum(key_lengths + 1)[:-1])) if self.size else key_lengths
+        codes, counts = np.unique(self._codes, return_counts=True)
+        self._frequency = dict(zip(codes.tolist(), counts.tolist()))
+
+    def _result(self, row: int, exact: bool = False) -> dict[str, Any]:
+        result = {name: column[row] for name, column in self.columns.items()}
+        if exact:
+            result['part_number_1'] = self.part_numbers[row]
+        result['ЗИП'] = self.zip_values[row]
+        return result
+
+    def _closest(self, rows: np.ndarray, part_number: str) -> Optional[dict[str, Any]]:
+        """Строка с наименьшей разницей длины, при равенстве — первая в книге."""
+        if not rows.size:
+            return None
+        distance = np.abs(self.lengths[rows] - len(part_number))
+        result = self._result(int(rows[np.lexsort((rows, distance))[0]]))
+        result['MATCH_TYPE'] = {'ЗИП': True}
+        return result
+
+    def _rows_with_keys(self, keys: np.ndarray) -> np.ndarray:
+        """Номера строк, нормализованный парт-номер которых равен одному из keys."""
+        left = np.searchsorted(self._sorted_keys, keys, side='left')
+        right = np.searchsorted(self._sorted_keys, keys, side='right')
+        found = right > left
+        if not found.any():
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate([self._order[start:stop] for start, stop in zip(left[found], right[found])])
+
+    def exact(self, part_number: str, main_part_number: str) -> Optional[dict[str, Any]]:
+        position = np.searchsorted(self._sorted_keys, part_number, side='left')
+        if position == self.size or self._sorted_keys[position] != part_number:
+            return None
+        result = self._result(int(self._order[position]), exact=True)
+        if part_number != main_part_number:
+            result['MATCH_TYPE'] = {'ЗИП': True}
+        return result
+
+    def like(self, part_number: str) -> Optional[dict[str, Any]]:
+        """Строки, ключ которых содержит part_number: поиск по кодам символов, начиная с самого редкого."""
+        if not part_number:
+            return self._closest(np.arange(self.size), part_number)
+        pattern = np.frombuffer(part_number.encode('utf-32-le'), dtype=np.uint32)
+        rarest = min(range(len(pattern)), key=lambda i: self._frequency.get(int(pattern[i]), 0))
+        if not self._frequency.get(int(pattern[rarest])):
+            return None
+        positions = np.flatnonzero(self._codes == pattern[rarest]) - rarest
+        positions = positions[(positions >= 0) & (positions + len(pattern) <= self._codes.size)]
+        for offset, code in enumerate(pattern):
+            if offset != rarest and positions.size:
+                positions = positions[self._codes[positions + offset] == code]
+        # Разделитель не входит в нормализованный парт-номер, поэтому совпадение не пересекает границу ключей.
+        rows = np.unique(np.searchsorted(self._starts, positions, side='right') - 1)
+        return self._closest(rows, part_number)
+
+    def instr(self, part_number: str) -> Optional[dict[str, Any]]:
+        """Строки, ключ которых входит в part_number: все подстроки ключа ищутся в отсортированных ключах."""
+        substrings = np.array(list({
+            part_number[start:stop]
+            for start in range(len(part_number))
+            for stop in range(start + 1, len(part_number) + 1)
+        }), dtype=str)
+        if not substrings.size:
+            return None
+        return self._closest(np.unique(self._rows_with_keys(substrings)), part_number)
+
+    def search(self, keys: list[str]) -> Optional[dict[str, Any]]:
+        """Аналог AbstractQuaryORM.queries."""
+        main_part_number = keys[0]
+        for part_number in keys:
+            result = (self.exact(part_number, main_part_number)
+                      or self.like(part_number)
+                      or self.instr(part_number))
+            if result:
+                return result
+        return None
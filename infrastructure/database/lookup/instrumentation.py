@@ -0,0 +1,135 @@
+from collections import Counter, deque
+from sqlalchemy import inspect
+from sqlalchemy.ext.asyncio import AsyncSession
+from settings.config import InstrumentationSettings
+from core import IRobotLogger
+from typing import Any, Optional
+import math
+
+
+def source_name(source) -> str:
+    """Имя таблицы книги по модели, алиасу или таблице."""
+    if isinstance(source, str):
+        return source
+    try:
+        return inspect(source).mapper.local_table.name
+    except Exception:
+        return getattr(source, 'name', str(source))
+
+
+def percentile(ordered: list[float], share: float) -> float:
+    """Перцентиль по методу ближайшего ранга для отсортированной выборки."""
+    if not ordered:
+        return 0.0
+    rank = max(1, math.ceil(share * len(ordered)))
+    return ordered[rank - 1]
+
+
+class StageStats:
+    """Счётчики и скользящее окно длительностей одного (книга, стадия)."""
+
+    def __init__(self, window: int):
+        self.count = 0
+        self.rows = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.samples: deque[float] = deque(maxlen=window)
+
+    def add(self, elapsed_ms: float, rows: int) -> None:
+        self.count += 1
+        self.rows += rows
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+        self.samples.append(elapsed_ms)
+
+    def as_dict(self) -> dict[str, Any]:
+        ordered = sorted(self.samples)
+        return {
+            'count': self.count,
+            'rows': self.rows,
+            'total_ms': round(self.total_ms, 3),
+            'p50_ms': round(percentile(ordered, 0.5), 3),
+            'p95_ms': round(percentile(ordered, 0.95), 3),
+            'p99_ms': round(percentile(ordered, 0.99), 3),
+            'max_ms': round(self.max_ms, 3),
+        }
+
+
+class LookupMetrics:
+    """
+    Инструментация запросов поиска: время, число строк и стадия по каждой книге,
+    скользящие перцентили и планы медленных запросов (EXPLAIN QUERY PLAN).
+    Создаётся только при включённой настройке — в выключенном состоянии поиск её не вызывает.
+    """
+
+    def __init__(self, settings: InstrumentationSettings, robot_logger: IRobotLogger):
+        self.settings = settings
+        self.robot_logger = robot_logger
+        self._stages: dict[tuple[str, str], StageStats] = {}
+        self._matches: dict[str, Counter] = {}
+        self._plans: dict[tuple[str, str], dict[str, Any]] = {}
+
+    async def record(self, session: AsyncSession, statement, params: Optional[dict[str, Any]], source, stage: str,
+                     elapsed: float, rows: int) -> None:
+        table = source_name(source)
+        elapsed_ms = elapsed * 1000
+        stats = self._stages.get((table, stage))
+        if stats is None:
+            stats = self._stages[(table, stage)] = StageStats(self.settings.window)
+        stats.add(elapsed_ms, rows)
+
+        if elapsed_ms >= self.settings.slow_query_ms:
+            plan = await self._explain(session, statement, params) if self.settings.capture_plans else None
+            slowest = self._plans.get((table, stage))
+            if slowest is None or elapsed_ms > slowest['elapsed_ms']:
+                self._plans[(table, stage)] = {'elapsed_ms': round(elapsed_ms, 3), 'plan': plan}
+            self.robot_logger.info(
+                f"Медленный запрос поиска: {table} {stage}",
+                extra={"elapsed_ms": round(elapsed_ms, 3), "rows": rows, "plan": plan}
+            )
+
+    def count_match(self, source, stage: str) -> None:
+        """Учитывает стадию, на которой книга дала результат (или MISS/SKIP)."""
+        self._matches.setdefault(source_name(source), Counter())[stage] += 1
+
+    @staticmethod
+    async def _explain(session: AsyncSession, statement, params: Optional[dict[str, Any]]) -> Optional[list[str]]:
+        """EXPLAIN QUERY PLAN для запроса с теми же значениями параметров."""
+        try:
+            connection = await session.connection()
+            bound = statement.params(**params) if params else statement
+            compiled = bound.compile(dialect=connection.dialect, compile_kwargs={'render_postcompile': True})
+            values = tuple(compiled.params[name] for name in compiled.positiontup or ())
+            rows = (await connection.exec_driver_sql(f'EXPLAIN QUERY PLAN {compiled.string}', values)).all()
+            return [row[-1] for row in rows]
+        except Exception:
+            return None
+
+    def summary(self) -> dict[str, Any]:
+        """Сводка по книгам: стадии запросов, стадии совпадений и планы самых медленных запросов."""
+        books: dict[str, dict[str, Any]] = {}
+        for (table, stage), stats in sorted(self._stages.items(), key=lambda entry: -entry[1].total_ms):
+            book = books.setdefault(table, {'total_ms': 0.0, 'stages': {}})
+            book['stages'][stage] = stats.as_dict()
+            book['total_ms'] = round(book['total_ms'] + stats.total_ms, 3)
+        for table, matches in self._matches.items():
+            books.setdefault(table, {'total_ms': 0.0, 'stages': {}})['matches'] = dict(matches)
+        for (table, stage), slowest in self._plans.items():
+            books[table].setdefault('slowest', {})[stage] = slowest
+        return books
+
+    def log_summary(self, label: str) -> None:
+        """Пишет сводку в RobotLogger и начинает накопление заново."""
+        books = self.summary()
+        if books:
+            dominant = max(books.items(), key=lambda entry: entry[1]['total_ms'])[0]
+            self.robot_logger.info(
+                f"Статистика поиска по справочникам: {label}",
+                extra={"dominant_book": dominant, "books": books}
+            )
+        self.reset()
+
+    def reset(self) -> None:
+        self._stages.clear()
+        self._matches.clear()
+        self._plans.clear()
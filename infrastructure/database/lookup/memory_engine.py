@@ -0,0 +1,454 @@
+from infrastructure.database.orm.models import (PurchaseBuy,
+                                               PurchaseWant,
+                                               MainCategory,
+                                               SecondCategory,
+                                               Collision,
+                                               CodeBook,
+                                               ArchiveBook,
+                                               ArchiveSummary,
+                                               Chassis,
+                                               Agreements,
+                                               AgreementsCollision)
+from infrastructure.database.lookup.substring_index import TrigramIndex
+from infrastructure.database.lookup.aho_corasick import AhoCorasick
+from infrastructure.database.lookup.prefix_index import PrefixTrie, SortedPrefixIndex
+from infrastructure.database.lookup.collision_matcher import CollisionMatcher
+from infrastructure.database.lookup.archive_summary import latest_category_id
+from sqlalchemy import select
+from sqlalchemy.orm import aliased
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from core import IPartNumberFilter, IRobotLogger
+from collections import namedtuple
+from typing import Callable, Optional, Any
+import asyncio
+
+
+BookEntry = namedtuple('BookEntry', ['position', 'normalized', 'part_number', 'payload', 'zip_value'])
+CategoryEntry = namedtuple('CategoryEntry', ['position', 'normalized', 'part_number', 'category'])
+
+# Ключ набора строк с id последних строк Архива с категорией (см. latest_category_id)
+LATEST_CATEGORY_IDS = 'latest_category_ids'
+
+DEFAULT_CATEGORY = {
+    'РЕМОНТ': 6001,
+    'ТРУДОЗАТРАТЫ': 4,
+    'КАТЕГОРИЯ': 'EMPTY'
+}
+
+
+def _concat(*parts: Optional[str]) -> Optional[str]:
+    """Конкатенация строк с семантикой оператора || (NULL поглощает результат)."""
+    if any(part is None for part in parts):
+        return None
+    return ''.join(parts)
+
+
+class PartNumberBook:
+    """Книга, по которой выполняется каскад EXACT → LIKE → INSTR."""
+
+    def __init__(self, entries: list[BookEntry]):
+        self.entries = entries
+        self.by_key: dict[str, list[BookEntry]] = {}
+        for entry in entries:
+            self.by_key.setdefault(entry.normalized, []).append(entry)
+        self.substring_index = TrigramIndex(self.by_key)
+        self.containment_index = AhoCorasick(self.by_key)
+
+    @staticmethod
+    def _result(entry: BookEntry, exact: bool = False) -> dict[str, Any]:
+        result = dict(entry.payload)
+        if exact:
+            result['part_number_1'] = entry.part_number
+        result['ЗИП'] = entry.zip_value
+        return result
+
+    def _closest(self, candidates: list[BookEntry], part_number: str) -> Optional[dict[str, Any]]:
+        """Выбирает кандидата с наименьшей разницей длины, как каскад AbstractQuaryORM.queries."""
+        if not candidates:
+            return None
+        input_len = len(part_number)
+        best = min(candidates, key=lambda entry: (abs(len(entry.part_number) - input_len), entry.position))
+        result = self._result(best)
+        result['MATCH_TYPE'] = {'ЗИП': True}
+        return result
+
+    def exact(self, part_number: str, main_part_number: str) -> Optional[dict[str, Any]]:
+        entries = self.by_key.get(part_number)
+        if not entries:
+            return None
+        result = self._result(entries[0], exact=True)
+        if part_number != main_part_number:
+            result['MATCH_TYPE'] = {'ЗИП': True}
+        return result
+
+    def like(self, part_number: str) -> Optional[dict[str, Any]]:
+        candidates = [entry for key in self.substring_index.find(part_number) for entry in self.by_key[key]]
+        return self._closest(candidates, part_number)
+
+    def instr(self, part_number: str) -> Optional[dict[str, Any]]:
+        candidates = [entry for key in self.containment_index.find_all(part_number) for entry in self.by_key[key]]
+        return self._closest(candidates, part_number)
+
+    def search(self, keys: list[str]) -> Optional[dict[str, Any]]:
+        """Аналог AbstractQuaryORM.queries."""
+        main_part_number = keys[0]
+        for part_number in keys:
+            result = (self.exact(part_number, main_part_number)
+                      or self.like(part_number)
+                      or self.instr(part_number))
+            if result:
+                return result
+        return None
+
+
+class BooksSnapshot:
+    """Неизменяемый набор индексов справочников, подменяемый целиком при перезагрузке."""
+
+    def __init__(self, books: dict[str, Any]):
+        self.books = books
+
+    def replace(self, books: dict[str, Any]) -> 'BooksSnapshot':
+        return BooksSnapshot({**self.books, **books})
+
+    def __getattr__(self, name: str):
+        try:
+            return self.books[name]
+        except KeyError:
+            raise AttributeError(name)
+
+
+class ReferenceBooksEngine:
+    """
+    In-memory движок поиска по справочникам.
+    Повторяет каскад ORMQuary.directory_books_query на хеш-таблицах по нормализованному парт-номеру.
+    `book_factory` строит книги каскада EXACT → LIKE → INSTR (PartNumberBook или ColumnarPartNumberBook).
+    """
+
+    # Индекс -> таблицы, от которых он зависит
+    _dependencies = {
+        'code_book': (CodeBook, Agreements, AgreementsCollision),
+        'purchase_buy': (PurchaseBuy, Agreements, AgreementsCollision),
+        'purchase_want': (PurchaseWant,),
+        'archive': (ArchiveSummary,),
+        'archive_categories': (ArchiveBook, MainCategory),
+        'collisions': (Collision, MainCategory),
+        'second_categories': (SecondCategory, MainCategory),
+        'chassis': (Chassis,),
+    }
+
+    def __init__(self, session_factory: async_sessionmaker, robot_logger: IRobotLogger, part_number_filter: IPartNumberFilter,
+                 book_factory: Callable[[list[BookEntry]], Any] = PartNumberBook):
+        self.session_factory = session_factory
+        self.book_factory = book_factory
+        self.robot_logger = robot_logger
+        self.part_number_filter = part_number_filter
+        self._snapshot: Optional[BooksSnapshot] = None
+        self._load_lock = asyncio.Lock()
+
+    @property
+    def is_loaded(self) -> bool:
+        return self._snapshot is not None
+
+    async def ensure_loaded(self) -> None:
+        """Загружает справочники при первом обращении."""
+        if self._snapshot is not None:
+            return
+        async with self._load_lock:
+            if self._snapshot is None:
+                self._snapshot = BooksSnapshot(await self._build(list(self._dependencies)))
+                self.robot_logger.success('Справочники загружены в память')
+
+    async def reload(self, table_name: str) -> None:
+        """Перестраивает индексы, зависящие от обновлённой таблицы, и атомарно подменяет снимок."""
+        if self._snapshot is None:
+            return
+        names = [name for name, models in self._dependencies.items()
+                 if any(model.__tablename__ == table_name for model in models)]
+        if not names:
+            return
+        books = await self._build(names)
+        self._snapshot = self._snapshot.replace(books)
+        self.robot_logger.success(f'Индексы {names} перестроены после обновления {table_name}')
+
+    async def _build(self, names: list[str]) -> dict[str, Any]:
+        models = {model for name in names for model in self._dependencies[name]}
+        async with self.session_factory() as session:
+            rows = {}
+            for model in models:
+                rows[model] = (await session.execute(select(model).order_by(model.id))).scalars().all()
+            if 'archive_categories' in names:
+                a = aliased(ArchiveBook)
+                rows[LATEST_CATEGORY_IDS] = set((await session.execute(
+                    select(a.id).where(a.id == latest_category_id(a))
+                )).scalars())
+        builders = {
+            'code_book': self._build_code_book,
+            'purchase_buy': self._build_purchase_buy,
+            'purchase_want': self._build_purchase_want,
+            'archive': self._build_archive,
+            'archive_categories': self._build_archive_categories,
+            'collisions': self._build_collisions,
+            'second_categories': self._build_second_categories,
+            'chassis': self._build_chassis,
+        }
+        return {name: builders[name](rows) for name in names}
+
+    @staticmethod
+    def _active_project_codes(rows: dict) -> list[str]:
+        """Коды договоров, проходящие join с AgreementsCollision по условию неравенства."""
+        collision_codes = [row.project_code_collision for row in rows[AgreementsCollision]]
+        return [row.project_code for row in rows[Agreements]
+                if any(code != row.project_code for code in collision_codes)]
+
+    @staticmethod
+    def _is_active(appointment: Optional[str], project_codes: list[str]) -> bool:
+        return appointment is not None and any(code in appointment for code in project_codes)
+
+    @staticmethod
+    def _grouped(rows: list) -> list[tuple[str, list]]:
+        """Группирует строки по сырому парт-номеру в порядке GROUP BY."""
+        groups: dict[str, list] = {}
+        for row in rows:
+            groups.setdefault(row.part_number, []).append(row)
+        return sorted(groups.items())
+
+    @staticmethod
+    def _max_row(group: list, attr: str):
+        """Строка с максимальным значением — из неё SQLite берёт «голые» столбцы при max()."""
+        best = None
+        for row in group:
+            value = getattr(row, attr)
+            if value is not None and (best is None or value > getattr(best, attr)):
+                best = row
+        return best
+
+    def _build_code_book(self, rows: dict) -> PartNumberBook:
+        project_codes = self._active_project_codes(rows)
+        eligible = [row for row in rows[CodeBook]
+                    if row.normalized_part_number and self._is_active(row.appointment, project_codes)]
+        entries = []
+        for part_number, group in self._grouped(eligible):
+            row = self._max_row(group, 'cost_price') or group[-1]
+            payload = {
+                'part_number': part_number,
+                'НАЗНАЧЕНИЕ': row.appointment,
+                'СКЛАД': row.logical_accounting,
+                '$, СТОИМОСТЬ ЗАКУПКИ ЗИП': row.cost_price,
+                'ГДЕ НАШЛИ': 'Свод',
+            }
+            entries.append(BookEntry(len(entries), row.normalized_part_number, part_number, payload, part_number))
+        return self.book_factory(entries)
+
+    def _build_purchase_buy(self, rows: dict) -> PartNumberBook:
+        project_codes = self._active_project_codes(rows)
+        entries = []
+        for row in rows[PurchaseBuy]:
+            if not row.normalized_part_number or not self._is_active(row.appointment, project_codes):
+                continue
+            payload = {
+                'part_number': row.part_number,
+                'ДТК СЕРВИС (КОММЕНТАРИИ ИНЖЕНЕРОВ)': row.client,
+                'НАЗНАЧЕНИЕ': row.appointment,
+                'ГДЕ НАШЛИ': 'Закупка Закупаем',
+            }
+            entries.append(BookEntry(len(entries), row.normalized_part_number, row.part_number, payload, row.part_number))
+        return self.book_factory(entries)
+
+    def _build_purchase_want(self, rows: dict) -> PartNumberBook:
+        eligible = [row for row in rows[PurchaseWant] if row.normalized_part_number]
+        entries = []
+        for part_number, group in self._grouped(eligible):
+            row = self._max_row(group, 'amount_of_purchase') or group[-1]
+            customer = row.buy_customized if row.buy_customized is not None else row.client
+            payload = {
+                'part_number': part_number,
+                # Метка внутри max() теряется, поэтому SQL-репозиторий отдаёт столбец как 'max'
+                'max': row.amount_of_purchase,
+                'НАЗНАЧЕНИЕ': row.shop,
+                'ГДЕ НАШЛИ': 'Закупка Хотим',
+                'ДТК СЕРВИС (КОММЕНТАРИИ ИНЖЕНЕРОВ)': _concat('Хотим купить под ', customer,
+                                                              'по цене', row.assessed_value),
+            }
+            entries.append(BookEntry(len(entries), row.normalized_part_number, part_number, payload, part_number))
+        return self.book_factory(entries)
+
+    def _build_archive(self, rows: dict) -> dict[str, Any]:
+        """Книга и QTY Архива — из строк Архив Итоги: правила агрегации и выбора строки задаёт archive_summary."""
+        summary = sorted((row for row in rows[ArchiveSummary] if row.normalized_part_number),
+                         key=lambda row: row.part_number)
+        entries = []
+        for row in summary:
+            if not row.shipped_rows:
+                continue
+            payload = {
+                'part_number': row.part_number,
+                '$, СТОИМОСТЬ ЗАКУПКИ ЗИП': row.cost_of_zip,
+                'ДТК Сервис (КОММЕНТАРИИ ИНЖЕНЕРОВ)': row.dtk_service,
+                'НАЗНАЧЕНИЕ': row.appointment,
+                '№ ЗАПРОСА': row.project_code,
+                'QTY ИЗ АРХИВОВ': row.shipped_qty,
+                'ГДЕ НАШЛИ': 'Архив',
+            }
+            entries.append(BookEntry(len(entries), row.normalized_part_number, row.part_number, payload, row.zip_values))
+
+        qty: dict[str, dict[str, Any]] = {}
+        for row in summary:
+            if row.qty_rows:
+                qty.setdefault(row.normalized_part_number, {
+                    'QTY ИЗ АРХИВОВ': row.qty,
+                    '№ ЗАПРОСА': row.qty_request_number,
+                })
+        return {'book': self.book_factory(entries), 'qty': qty}
+
+    def _build_archive_categories(self, rows: dict) -> dict[str, Any]:
+        categories = self._main_categories(rows)
+        latest_ids = rows[LATEST_CATEGORY_IDS]
+        category_entries = []
+        latest_entries = []
+        for row in rows[ArchiveBook]:
+            if row.normalized_part_number and row.category is not None and row.category in categories:
+                entry = CategoryEntry(len(category_entries), row.normalized_part_number,
+                                      row.part_number, categories[row.category])
+                category_entries.append(entry)
+                if row.id in latest_ids:
+                    latest_entries.append(entry)
+        exact_categories: dict[str, CategoryEntry] = {}
+        for entry in sorted(latest_entries, key=lambda entry: entry.part_number):
+            exact_categories.setdefault(entry.normalized, entry)
+        category_by_key: dict[str, list[CategoryEntry]] = {}
+        for entry in category_entries:
+            category_by_key.setdefault(entry.normalized, []).append(entry)
+
+        return {
+            'exact': exact_categories,
+            'by_key': category_by_key,
+            'index': TrigramIndex(category_by_key),
+        }
+
+    @staticmethod
+    def _main_categories(rows: dict) -> dict[str, MainCategory]:
+        """Основные категории; при дублях join возвращает первую строку."""
+        categories = {}
+        for row in rows[MainCategory]:
+            categories.setdefault(row.category, row)
+        return categories
+
+    def _build_collisions(self, rows: dict) -> tuple[CollisionMatcher, dict[int, Any]]:
+        categories = self._main_categories(rows)
+        rules = {position: row for position, row in enumerate(rows[Collision]) if row.category in categories}
+        matcher = CollisionMatcher((position, row.description_content) for position, row in rules.items())
+        return matcher, {position: categories[row.category] for position, row in rules.items()}
+
+    def _build_second_categories(self, rows: dict) -> dict[str, Any]:
+        categories = self._main_categories(rows)
+        prefixes: dict[str, tuple[int, int, Any]] = {}
+        for position, row in enumerate(rows[SecondCategory]):
+            if not row.normalized_part_number or row.category not in categories:
+                continue
+            current = prefixes.get(row.normalized_part_number)
+            if current is None or len(row.letters) > current[0]:
+                prefixes[row.normalized_part_number] = (len(row.letters), -position, categories[row.category])
+        return {'by_prefix': prefixes, 'trie': PrefixTrie(prefixes)}
+
+    @staticmethod
+    def _build_chassis(rows: dict) -> SortedPrefixIndex:
+        return SortedPrefixIndex(
+            (row.normalized_part_number,
+             f"Шасси! БП - {row.power_unit}, FAN - {row.fan_unit}, Комментарий - {row.comment}")
+            for row in rows[Chassis] if row.normalized_part_number
+        )
+
+    @staticmethod
+    def _category_result(category: MainCategory) -> dict[str, Any]:
+        return {
+            'КАТЕГОРИЯ': category.category,
+            'РЕМОНТ': category.repair,
+            'ТРУДОЗАТРАТЫ': category.time,
+        }
+
+    def _find_primary(self, snapshot: BooksSnapshot, keys: list[str]) -> Optional[dict[str, Any]]:
+        for book in (snapshot.code_book, snapshot.purchase_buy, snapshot.purchase_want):
+            result = book.search(keys)
+            if result:
+                return result
+        return None
+
+    @staticmethod
+    def _find_archive(snapshot: BooksSnapshot, keys: list[str], primary_result: bool) -> Optional[dict[str, Any]]:
+        if not primary_result:
+            return snapshot.archive['book'].search(keys)
+        qty = snapshot.archive['qty'].get(keys[0])
+        return dict(qty) if qty else None
+
+    def _find_category_partial(self, snapshot: BooksSnapshot, key: str) -> Optional[dict[str, Any]]:
+        key_length = len(key)
+        min_length = int(key_length * 0.8)
+        max_length = int(key_length * 1.2)
+        category_by_key = snapshot.archive_categories['by_key']
+        candidates = [
+            entry for normalized in snapshot.archive_categories['index'].find(key)
+            if min_length <= len(normalized) <= max_length
+            for entry in category_by_key[normalized]
+        ]
+        candidates.sort(key=lambda entry: (abs(len(entry.part_number) - key_length), entry.position))
+        best_match = None
+        best_score = 0
+        for entry in candidates[:10]:
+            score = self.part_number_filter.calculate_similarity_score(key, entry.part_number)
+            if score > best_score:
+                best_score = score
+                best_match = entry
+        if best_match and best_score >= 70:
+            result = self._category_result(best_match.category)
+            result['part_number'] = best_match.part_number
+            result['part_length'] = len(best_match.part_number)
+            return result
+        return None
+
+    def _find_category(self, snapshot: BooksSnapshot, keys: list[str], normalized_comment: str) -> dict[str, Any]:
+        for key in keys:
+            entry = snapshot.archive_categories['exact'].get(key)
+            if entry:
+                return self._category_result(entry.category)
+
+        for key in keys:
+            result = self._find_category_partial(snapshot, key)
+            if result:
+                return result
+
+        if normalized_comment:
+            matcher, categories = snapshot.collisions
+            rules = matcher.match(normalized_comment)
+            if rules:
+                return self._category_result(categories[rules[0]])
+
+        best = None
+        for prefix in snapshot.second_categories['trie'].prefixes_of(keys[0]):
+            candidate = snapshot.second_categories['by_prefix'][prefix]
+            if best is None or candidate[:2] > best[:2]:
+                best = candidate
+        if best:
+            result = self._category_result(best[2])
+            result['MATCH_TYPE'] = {'КАТЕГОРИЯ': True}
+            return result
+
+        return dict(DEFAULT_CATEGORY)
+
+    @staticmethod
+    def _find_chassis(snapshot: BooksSnapshot, key: str) -> Optional[dict[str, Any]]:
+        description = snapshot.chassis.first_starting_with(key)
+        if description is not None:
+            return {'ШАССИ': description}
+        return None
+
+    def directory_books_query(self, keys: list[str], normalized_comment: str) -> list[dict[str, Any]]:
+        """
+        Выполняет каскад поиска по снимку справочников.
+        Возвращает найденные результаты в порядке их применения к item.
+        """
+        snapshot = self._snapshot
+        primary_result = self._find_primary(snapshot, keys)
+        archive_result = self._find_archive(snapshot, keys, bool(primary_result))
+        category_result = self._find_category(snapshot, keys, normalized_comment)
+        chassis_result = self._find_chassis(snapshot, keys[0])
+        return [result for result in (primary_result, archive_result, category_result, chassis_result) if result]
@@ -0,0 +1,68 @@
+from bisect import bisect_left
+from sqlalchemy import and_
+from typing import Any, Iterable, Optional
+
+
+PREFIX_UPPER_BOUND = '\U0010ffff'
+
+
+def starts_with(column, prefix):
+    """
+    Условие «column начинается с prefix» в виде диапазона [prefix, prefix + U+10FFFF).
+    Сравнение BINARY, поэтому SQLite выполняет его поиском по индексу столбца.
+    prefix — строка или столбец (пакетный поиск).
+    """
+    return and_(column >= prefix, column < prefix + PREFIX_UPPER_BOUND)
+
+
+class PrefixTrie:
+    """Префиксное дерево: находит сохранённые строки, которые являются префиксами запроса."""
+
+    def __init__(self, keys: Iterable[str]):
+        self._children: list[dict[str, int]] = [{}]
+        self._terminal: list[Optional[str]] = [None]
+        for key in keys:
+            self.add(key)
+
+    def add(self, key: str) -> None:
+        node = 0
+        for char in key:
+            child = self._children[node].get(char)
+            if child is None:
+                child = len(self._children)
+                self._children.append({})
+                self._terminal.append(None)
+                self._children[node][char] = child
+            node = child
+        self._terminal[node] = key
+
+    def prefixes_of(self, text: str) -> list[str]:
+        """Сохранённые строки, являющиеся префиксами text, от коротких к длинным."""
+        found = []
+        node = 0
+        if self._terminal[node] is not None:
+            found.append(self._terminal[node])
+        for char in text:
+            node = self._children[node].get(char)
+            if node is None:
+                break
+            if self._terminal[node] is not None:
+                found.append(self._terminal[node])
+        return found
+
+
+class SortedPrefixIndex:
+    """Отсортированные ключи: строки с заданным префиксом образуют непрерывный диапазон."""
+
+    def __init__(self, items: Iterable[tuple[str, Any]]):
+        entries = sorted((key, position, value) for position, (key, value) in enumerate(items))
+        self._keys = [key for key, _, _ in entries]
+        self._entries = entries
+
+    def first_starting_with(self, prefix: str) -> Optional[Any]:
+        """Значение первой по порядку добавления строки, начинающейся с prefix."""
+        start = bisect_left(self._keys, prefix)
+        end = bisect_left(self._keys, prefix + PREFIX_UPPER_BOUND, start)
+        if start == end:
+            return None
+        return min(self._entries[start:end], key=lambda entry: entry[1])[2]
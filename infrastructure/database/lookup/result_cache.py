@@ -0,0 +1,127 @@
+from infrastructure.database.orm.models import (Status,
+                                                PurchaseBuy,
+                                                PurchaseWant,
+                                                MainCategory,
+                                                SecondCategory,
+                                                Collision,
+                                                CodeBook,
+                                                ArchiveBook,
+                                                ArchiveSummary,
+                                                Chassis,
+                                                Agreements,
+                                                AgreementsCollision)
+from core import IRobotLogger
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+import copy
+
+
+# Сколько изменённых парт-номеров ещё проверяются по записям; при большем числе устаревает вся таблица.
+MAX_CHANGED_KEYS = 1000
+
+_AGREEMENTS = {Agreements.__tablename__, AgreementsCollision.__tablename__}
+
+# Основные книги в порядке каскада: результат зависит от книги, где он найден, и от всех предыдущих.
+PRIMARY_DEPENDENCIES = [
+    (CodeBook.__tablename__, {CodeBook.__tablename__} | _AGREEMENTS),
+    (PurchaseBuy.__tablename__, {PurchaseBuy.__tablename__} | _AGREEMENTS),
+    (PurchaseWant.__tablename__, {PurchaseWant.__tablename__}),
+]
+
+COMMON_DEPENDENCIES = {
+    ArchiveSummary.__tablename__,
+    ArchiveBook.__tablename__,
+    Status.__tablename__,
+    MainCategory.__tablename__,
+    Collision.__tablename__,
+    SecondCategory.__tablename__,
+    Chassis.__tablename__,
+} | _AGREEMENTS
+
+
+def result_dependencies(results: list[dict[str, Any]]) -> set[str]:
+    """Таблицы, от которых зависит результат поиска по одной строке."""
+    sources = {result.get('ГДЕ НАШЛИ') for result in results}
+    dependencies = set(COMMON_DEPENDENCIES)
+    for book, tables in PRIMARY_DEPENDENCIES:
+        dependencies |= tables
+        if book in sources:
+            break
+    return dependencies
+
+
+class LookupResultCache:
+    """
+    Ограниченный LRU-кэш результатов directory_books_query по (ключи, комментарий).
+    Запись хранит поколения таблиц, от которых зависит; после перезаливки книги
+    устаревают только записи, зависящие от неё.
+    """
+
+    def __init__(self, max_size: int, robot_logger: IRobotLogger):
+        self.max_size = max_size
+        self.robot_logger = robot_logger
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[Hashable, tuple[dict[str, int], list[dict[str, Any]]]] = OrderedDict()
+        self._generations: dict[str, int] = {}
+
+    @staticmethod
+    def make_key(keys: list[str], normalized_comment: str) -> Hashable:
+        return tuple(keys), normalized_comment
+
+    def snapshot(self) -> dict[str, int]:
+        """Поколения таблиц на момент начала поиска."""
+        return dict(self._generations)
+
+    def invalidate(self, table_name: str, changed_keys: Optional[set[str]] = None) -> None:
+        """
+        changed_keys — нормализованные парт-номера строк, изменённых перезагрузкой по разнице.
+        Тогда из зависящих от таблицы записей удаляются только те, ключ которых входит в изменённый
+        парт-номер или содержит его (стадии EXACT/LIKE/INSTR), остальные переходят в новое поколение.
+        Поиск, начатый до перезагрузки, всё равно запишет результат со старым поколением.
+        """
+        previous = self._generations.get(table_name, 0)
+        self._generations[table_name] = previous + 1
+        if changed_keys is None or len(changed_keys) > MAX_CHANGED_KEYS:
+            return
+        changed_keys = {key.lower() for key in changed_keys}
+        for key, (generations, _) in list(self._entries.items()):
+            if generations.get(table_name) != previous:
+                continue
+            part_numbers = [part_number.lower() for part_number in key[0]]
+            if any(part_number in changed or changed in part_number
+                   for part_number in part_numbers for changed in changed_keys):
+                del self._entries[key]
+            else:
+                generations[table_name] = previous + 1
+
+    def get(self, key: Hashable) -> Optional[list[dict[str, Any]]]:
+        entry = self._entries.get(key)
+        if entry is not None:
+            generations, results = entry
+            if all(self._generations.get(table, 0) == generation for table, generation in generations.items()):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return copy.deepcopy(results)
+            del self._entries[key]
+        self.misses += 1
+        return None
+
+    def put(self, key: Hashable, results: list[dict[str, Any]], snapshot: dict[str, int]) -> None:
+        generations = {table: snapshot.get(table, 0) for table in result_dependencies(results)}
+        self._entries[key] = (generations, copy.deepcopy(results))
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def log_stats(self) -> None:
+        total = self.hits + self.misses
+        self.robot_logger.info(
+            "Кэш результатов поиска",
+            extra={
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 3) if total else 0,
+                "size": len(self._entries),
+            }
+        )
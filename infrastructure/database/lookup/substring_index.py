@@ -0,0 +1,114 @@
+from sqlalchemy import Table, bindparam, inspect, select, text, table as sql_table, column as sql_column
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession
+from typing import Iterable, Optional, Union
+
+
+MIN_TRIGRAM_LENGTH = 3
+
+
+def trigram_table_name(table: Table) -> str:
+    """Имя FTS5-таблицы с триграммным индексом для книги."""
+    return f'{table.name}_trigram'
+
+
+def has_substring_index(table: Table) -> bool:
+    """Нужен ли книге триграммный индекс по нормализованному парт-номеру."""
+    return any(column.info.get('substring_index') for column in table.columns)
+
+
+async def create_trigram_index(conn: Union[AsyncConnection, AsyncSession], table: Table) -> None:
+    """
+    Создаёт FTS5-таблицу (tokenize=trigram) поверх нормализованного столбца книги и заполняет её.
+    Таблица external-content: хранит только индекс, значения читает из самой книги.
+    """
+    name = trigram_table_name(table)
+    await conn.execute(text(
+        f'CREATE VIRTUAL TABLE IF NOT EXISTS "{name}" USING fts5('
+        f'normalized_part_number, content=\'{table.name}\', content_rowid=\'id\', tokenize=\'trigram\')'
+    ))
+    await rebuild_trigram_index(conn, table)
+
+
+async def rebuild_trigram_index(conn: Union[AsyncConnection, AsyncSession], table: Table) -> None:
+    """Перестраивает триграммный индекс после перезаливки книги."""
+    name = trigram_table_name(table)
+    await conn.execute(text(f'INSERT INTO "{name}"("{name}") VALUES(\'rebuild\')'))
+    table.info['trigram_index'] = True
+
+
+async def remove_from_trigram_index(conn: Union[AsyncConnection, AsyncSession], table: Table,
+                                    rows: list[tuple[int, Optional[str]]]) -> None:
+    """Удаляет из индекса строки (id, нормализованный парт-номер) до их удаления из книги."""
+    if not rows:
+        return
+    name = trigram_table_name(table)
+    await conn.execute(
+        text(f'INSERT INTO "{name}"("{name}", rowid, normalized_part_number) VALUES(\'delete\', :id, :value)'),
+        [{'id': row_id, 'value': value} for row_id, value in rows]
+    )
+
+
+async def add_to_trigram_index(conn: Union[AsyncConnection, AsyncSession], table: Table, ids: list[int]) -> None:
+    """Добавляет в индекс вставленные строки книги."""
+    if not ids:
+        return
+    name = trigram_table_name(table)
+    await conn.execute(
+        text(f'INSERT INTO "{name}"(rowid, normalized_part_number) '
+             f'SELECT id, normalized_part_number FROM "{table.name}" WHERE id IN :ids').bindparams(
+            bindparam('ids', expanding=True)
+        ),
+        {'ids': ids}
+    )
+
+
+def substring_index_usable(obj_table, part_number) -> bool:
+    """Можно ли сузить LIKE '%pn%' триграммным индексом: индекс построен и ключ не короче триграммы."""
+    table = inspect(obj_table).mapper.local_table
+    if not table.info.get('trigram_index'):
+        return False
+    return not (isinstance(part_number, str) and len(part_number) < MIN_TRIGRAM_LENGTH)
+
+
+def substring_candidates(obj_table, part_number):
+    """
+    Условие `id IN (...)` с кандидатами из триграммного индекса для LIKE '%pn%'.
+    part_number — строка, bindparam или столбец (коррелированный подзапрос для пакетного поиска).
+    Возвращает None, если индекс не построен или ключ короче триграммы —
+    тогда запрос выполняется обычным сканированием.
+    """
+    if not substring_index_usable(obj_table, part_number):
+        return None
+    table = inspect(obj_table).mapper.local_table
+    fts = sql_table(trigram_table_name(table), sql_column('rowid'), sql_column('normalized_part_number'))
+    return obj_table.id.in_(
+        select(fts.c.rowid).where(fts.c.normalized_part_number.like('%' + part_number + '%'))
+    )
+
+
+class TrigramIndex:
+    """In-memory триграммный индекс: находит ключи, содержащие подстроку."""
+
+    def __init__(self, keys: Iterable[str]):
+        self.keys = list(dict.fromkeys(keys))
+        self._postings: dict[str, list[int]] = {}
+        for position, key in enumerate(self.keys):
+            for trigram in set(self._trigrams(key)):
+                self._postings.setdefault(trigram, []).append(position)
+
+    @staticmethod
+    def _trigrams(value: str) -> list[str]:
+        return [value[i:i + MIN_TRIGRAM_LENGTH] for i in range(len(value) - MIN_TRIGRAM_LENGTH + 1)]
+
+    def find(self, part_number: str) -> list[str]:
+        """Ключи, содержащие part_number, в порядке их добавления."""
+        if len(part_number) < MIN_TRIGRAM_LENGTH:
+            return [key for key in self.keys if part_number in key]
+        postings: Optional[list[int]] = None
+        for trigram in set(self._trigrams(part_number)):
+            current = self._postings.get(trigram)
+            if current is None:
+                return []
+            if postings is None or len(current) < len(postings):
+                postings = current
+        return [self.keys[position] for position in postings if part_number in self.keys[position]]
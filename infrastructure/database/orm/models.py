@@ -1,5 +1,6 @@
-from typing import Annotated, Optional, Union
+from typing import Annotated, Any, Optional, Union
 from sqlalchemy.orm import as_declarative, mapped_column, declared_attr, Mapped
+from sqlalchemy.types import UserDefinedType
 from datetime import datetime
 from sqlalchemy import Boolean
 
@@ -7,6 +8,42 @@ from sqlalchemy import Boolean
 intpk = Annotated[int, mapped_column(autoincrement=True, primary_key=True)]
 
 
+def normalized_column(source: str, substring_index: bool = False):
+    """
+    Служебный столбец с нормализованным значением атрибута `source`.
+    Заполняется при загрузке книги и не ожидается в заголовке Excel.
+    `substring_index` включает триграммный индекс для поиска LIKE '%pn%'.
+    """
+    return mapped_column(name='normalized_part_number', index=True,
+                         info={'derived': True, 'normalized_from': source, 'substring_index': substring_index})
+
+
+def agreement_weight_column(agreement_filter: str):
+    """
+    Служебный столбец проекции действующих договоров: сколько сочетаний строк
+    Договора/Договора Исключения проходит строка книги (0 — строка в поиске не участвует).
+    `agreement_filter`: 'agreements' — назначение содержит код договора, не попавший в исключения;
+    'collisions' — назначение не содержит кода исключения.
+    """
+    return mapped_column(name='agreement_weight', info={'derived': True, 'agreement_filter': agreement_filter})
+
+
+def row_hash_column():
+    """
+    Служебный хеш содержимого строки книги. По нему перезагрузка находит
+    изменённые строки и применяет только их вставку и удаление.
+    """
+    return mapped_column(name='row_hash', info={'derived': True})
+
+
+class SQLiteValue(UserDefinedType):
+    """Столбец без приведения типа (affinity BLOB): значение хранится так, как его вычислил SQLite."""
+    cache_ok = True
+
+    def get_col_spec(self, **kw) -> str:
+        return 'BLOB'
+
+
 @as_declarative()
 class AbstractTable:
 
@@ -26,10 +63,12 @@ class FileMetadata(AbstractTable):
     file_path: Mapped[str] = mapped_column(name='file_path')
     last_modified: Mapped[datetime] = mapped_column(name='last_modified')
     status: Mapped[str] = mapped_column(name='status')
+    content_hash: Mapped[Optional[str]] = mapped_column(name='content_hash')
+    size: Mapped[Optional[int]] = mapped_column(name='size')
 
     def __repr__(self) -> str:
         return (f'FileMetadata(filename={self.filename}, file_path={self.file_path}, '
-                f'last_modified={self.last_modified}, status={self.status})')
+                f'last_modified={self.last_modified}, status={self.status}, size={self.size})')
 
 
 class Status(AbstractTable):
@@ -43,6 +82,9 @@ class PurchaseBuy(AbstractTable):
     part_number: Mapped[str] = mapped_column(name='АРТИКУЛ')
     client: Mapped[Optional[str]] = mapped_column(name='КЛИЕНТ')
     appointment: Mapped[Optional[str]] = mapped_column(name='НАЗНАЧЕНИЕ')
+    normalized_part_number: Mapped[Optional[str]] = normalized_column('part_number', substring_index=True)
+    agreement_weight: Mapped[Optional[int]] = agreement_weight_column('agreements')
+    row_hash: Mapped[Optional[str]] = row_hash_column()
 
     def __repr__(self) -> str:
         return (f'PurchaseBuy(part_number={self.part_number}, client={self.client}, '
@@ -57,6 +99,8 @@ class PurchaseWant(AbstractTable):
     amount_of_purchase: Mapped[Optional[str]] = mapped_column(name='СУММА СОВМЕСТНОЙ ЗАКУПКИ')
     shop: Mapped[Optional[str]] = mapped_column(name='МАГАЗИН')
     assessed_value: Mapped[Optional[str]] = mapped_column(name='ОЦЕНОЧНАЯ СТОИМОСТЬ')
+    normalized_part_number: Mapped[Optional[str]] = normalized_column('part_number', substring_index=True)
+    row_hash: Mapped[Optional[str]] = row_hash_column()
 
     def __repr__(self) -> str:
         return (f'PurchaseWant(part_number={self.part_number}, client={self.client}, '
@@ -78,6 +122,8 @@ class SecondCategory(AbstractTable):
     """Запасные Категории"""
     letters: Mapped[str] = mapped_column(name='МОДЕЛЬ НАЧИНАЕТСЯ С…')
     category: Mapped[Optional[str]] = mapped_column(name='КАТЕГОРИЯ СЛОЖНОСТИ ТЗ')
+    normalized_part_number: Mapped[Optional[str]] = normalized_column('letters')
+    row_hash: Mapped[Optional[str]] = row_hash_column()
 
     def __repr__(self) -> str:
         return (f'SecondCategory(letters={self.letters})')
@@ -98,6 +144,9 @@ class CodeBook(AbstractTable):
     appointment: Mapped[Optional[str]] = mapped_column(name='НАЗНАЧЕНИЕ')
     logical_accounting: Mapped[Optional[str]] = mapped_column(name='ЛОГИЧЕСКИЙ УЧЕТ')
     cost_price: Mapped[Optional[str]] = mapped_column(name='CЕБЕСТОИМОСТЬ ЕДИНИЦЫ БЕЗ НДС')
+    normalized_part_number: Mapped[Optional[str]] = normalized_column('part_number', substring_index=True)
+    agreement_weight: Mapped[Optional[int]] = agreement_weight_column('agreements')
+    row_hash: Mapped[Optional[str]] = row_hash_column()
 
     def __repr__(self) -> str:
         return (f'CodeBook(part_number={self.part_number}, appointment={self.appointment}, '
@@ -114,6 +163,9 @@ class ArchiveBook(AbstractTable):
     amount: Mapped[Optional[str]] = mapped_column(name='КОЛ-ВО')
     project_code: Mapped[Optional[str]] = mapped_column(name='№ ЗАПРОСА')
     category: Mapped[Optional[str]] = mapped_column(name='КАТЕГОРИЯ')
+    normalized_part_number: Mapped[Optional[str]] = normalized_column('part_number', substring_index=True)
+    agreement_weight: Mapped[Optional[int]] = agreement_weight_column('collisions')
+    row_hash: Mapped[Optional[str]] = row_hash_column()
 
     def __repr__(self) -> str:
         return (f'ArchiveBook(part_number={self.part_number}, cost_of_zip={self.cost_of_zip}, '
@@ -122,12 +174,36 @@ class ArchiveBook(AbstractTable):
                 f'category={self.category}')
 
 
+class ArchiveSummary(AbstractTable):
+    """Архив Итоги"""
+    __table_args__ = {'info': {'derived': True}}
+
+    part_number: Mapped[str] = mapped_column(unique=True)
+    normalized_part_number: Mapped[Optional[str]] = mapped_column(index=True, info={'substring_index': True})
+    cost_of_zip: Mapped[Optional[str]] = mapped_column()
+    zip_values: Mapped[Optional[str]] = mapped_column()
+    dtk_service: Mapped[Optional[str]] = mapped_column()
+    appointment: Mapped[Optional[str]] = mapped_column()
+    project_code: Mapped[Optional[str]] = mapped_column()
+    shipped_qty: Mapped[Optional[Any]] = mapped_column(SQLiteValue())
+    shipped_rows: Mapped[int] = mapped_column(default=0)
+    qty: Mapped[Optional[Any]] = mapped_column(SQLiteValue())
+    qty_request_number: Mapped[Optional[str]] = mapped_column()
+    qty_rows: Mapped[int] = mapped_column(default=0)
+
+    def __repr__(self) -> str:
+        return (f'ArchiveSummary(part_number={self.part_number}, shipped_qty={self.shipped_qty}, '
+                f'qty={self.qty}, qty_request_number={self.qty_request_number})')
+
+
 class Chassis(AbstractTable):
     """Шасси"""
     part_number: Mapped[str] = mapped_column(name='P/N', key='part_number')
     power_unit: Mapped[Optional[str]] = mapped_column(name='БП')
     fan_unit: Mapped[Optional[str]] = mapped_column(name='FAN')
     comment: Mapped[Optional[str]] = mapped_column(name='КОММЕНТАРИИ')
+    normalized_part_number: Mapped[Optional[str]] = normalized_column('part_number')
+    row_hash: Mapped[Optional[str]] = row_hash_column()
 
     def __repr__(self) -> str:
         return (f'Сhassis(part_number={self.part_number}, power_unit={self.power_unit}, '
@@ -1,5 +1,6 @@
-from sqlalchemy import select, func, case, literal
+from sqlalchemy import Table, Column, Integer, String, MetaData, select, func, case, literal, cast, delete, insert, bindparam, union_all
 from sqlalchemy.orm import aliased, Session, Query
+from sqlalchemy.engine import Row
 from .models import (Status,
                     PurchaseBuy,
                     PurchaseWant,
@@ -8,19 +9,75 @@ from .models import (Status,
                     Collision,
                     CodeBook,
                     ArchiveBook,
-                    Chassis,
-                    Agreements,
-                    AgreementsCollision)
+                    ArchiveSummary,
+                    Chassis)
 
 from sqlalchemy.ext.declarative import DeclarativeMeta
 from infrastructure.database.settings.db_settings import SQLAlchemySettings
+from infrastructure.database.lookup.memory_engine import ReferenceBooksEngine, PartNumberBook, DEFAULT_CATEGORY
+from infrastructure.database.lookup.columnar_book import ColumnarPartNumberBook
+from infrastructure.database.lookup.substring_index import substring_candidates, substring_index_usable
+from infrastructure.database.lookup.archive_summary import latest_category_id
+from infrastructure.database.lookup.book_indexes import BookIndexRegistry
+from infrastructure.database.lookup.prefix_index import starts_with
+from infrastructure.database.lookup.result_cache import LookupResultCache
+from infrastructure.database.lookup.instrumentation import LookupMetrics
+from settings.config import LookupSettings
 from sqlalchemy.ext.asyncio import AsyncSession
 from core import IORMQuary, IPartNumberFilter, IRobotLogger
-from typing import Optional, Any
+from typing import Optional, Any, Callable, Hashable
+import asyncio
 import json
+import time
+
+
+KEY_RANK = 'lookup_key_rank'
+MATCH_RANK = 'lookup_match_rank'
+MATCH_DISTANCE = 'lookup_match_distance'
+ROW_ORDER = 'lookup_row_order'
+EXACT_PART_NUMBER = 'part_number_1'
+MATCH_STAGES = ('EXACT', 'LIKE', 'INSTR')
 
 
 class AbstractQuaryORM:
+    _prepared: dict[Hashable, tuple[Any, str]] = {}
+    _bases: dict[Any, tuple[Any, Any]] = {}
+    metrics: Optional[LookupMetrics] = None
+
+    @staticmethod
+    async def fetch(session: AsyncSession, statement, params: Optional[dict[str, Any]], source, stage: str) -> list[Row]:
+        """
+        Выполняет запрос репозитория. При включённой инструментации замеряет время,
+        число строк и стадию по книге source; без неё — обычный session.execute.
+        """
+        metrics = AbstractQuaryORM.metrics
+        if metrics is None:
+            return (await session.execute(statement, params)).all()
+        started = time.perf_counter()
+        rows = (await session.execute(statement, params)).all()
+        await metrics.record(session, statement, params, source, stage, time.perf_counter() - started, len(rows))
+        return rows
+
+    @staticmethod
+    def prepared(key: Hashable, build: Callable[[], Any]) -> tuple[Any, str]:
+        """
+        Запрос, собранный один раз при первом обращении, и его SQL для логов.
+        Значения передаются через bindparam, поэтому SQLAlchemy берёт компиляцию из своего кэша.
+        """
+        prepared = AbstractQuaryORM._prepared.get(key)
+        if prepared is None:
+            statement = build()
+            prepared = AbstractQuaryORM._prepared[key] = (statement, str(statement))
+        return prepared
+
+    @staticmethod
+    def base_query(repository) -> tuple[Any, Any]:
+        """Результат repository.build_query(), общий для всех подготовленных запросов репозитория."""
+        base = AbstractQuaryORM._bases.get(repository)
+        if base is None:
+            base = AbstractQuaryORM._bases[repository] = repository.build_query()
+        return base
+
     @staticmethod
     def _build_zip_case(obj_table: DeclarativeMeta, condition) -> case:
         """Создаёт case-выражение для столбца ЗИП."""
@@ -28,7 +85,7 @@ class AbstractQuaryORM:
             (
                 condition,
                 case(
-                    (obj_table._aliased_insp.mapper.class_ is ArchiveBook, getattr(obj_table, 'zip_values', None)),
+                    (obj_table._aliased_insp.mapper.class_ in (ArchiveBook, ArchiveSummary), getattr(obj_table, 'zip_values', None)),
                     else_=obj_table.part_number
                 )
             ),
@@ -36,13 +93,15 @@ class AbstractQuaryORM:
         ).label('ЗИП')
 
     @staticmethod
-    async def _execute_query(query, part_number: str, match_type: str, session: AsyncSession, logger: IRobotLogger) -> list[dict[str, Any]]:
-        """Выполняет запрос и логирует его."""
+    async def _execute_query(prepared: tuple[Any, str], params: dict[str, Any], part_number: str, match_type: str,
+                             session: AsyncSession, logger: IRobotLogger, source) -> list[dict[str, Any]]:
+        """Выполняет подготовленный запрос и логирует его."""
+        query, sql = prepared
         logger.debug(
             f"Выполнение запроса {match_type}",
-            extra={"part_number": part_number, "sql": str(query)}
+            extra={"part_number": part_number, "sql": sql}
         )
-        results = (await session.execute(query)).all()
+        results = await AbstractQuaryORM.fetch(session, query, params, source, match_type)
         result_dicts = [r._asdict() for r in results] if results else []
         logger.info(
             f"Результаты {match_type}",
@@ -55,131 +114,157 @@ class AbstractQuaryORM:
         return result_dicts
 
     @staticmethod
-    async def _search_exact_match(query, obj_table: DeclarativeMeta, part_number: str, session: AsyncSession, logger: IRobotLogger, main_part_number: str) -> Optional[dict[str, Any]]:
-        """Поиск по точному совпадению."""
-        normalized_column = func.upper(func.regexp_replace(obj_table.part_number, r'[^A-Za-zА-Яа-я0-9]', ''))
-        query_exact = query.filter(part_number == normalized_column).add_columns(
-            obj_table.part_number,
-            AbstractQuaryORM._build_zip_case(obj_table, part_number == normalized_column)
-        )
-        results = await AbstractQuaryORM._execute_query(query_exact, part_number, "EXACT", session, logger)
-        if results:
-            if part_number != main_part_number:
-                results[0]['MATCH_TYPE'] = {'ЗИП': True}
-            return results[0]
-        return None
+    def _ranked_keys(keys: list[str]) -> list[str]:
+        """Ключи без повторов в исходном порядке: повтор не меняет результат каскада."""
+        return list(dict.fromkeys(keys))
 
     @staticmethod
-    async def _search_like_match(query, obj_table: DeclarativeMeta, part_number: str, session: AsyncSession, logger: IRobotLogger) -> Optional[dict[str, Any]]:
-        """Поиск по частичному вхождению (LIKE)."""
-        normalized_column = func.upper(func.regexp_replace(obj_table.part_number, r'[^A-Za-zА-Яа-я0-9]', ''))
-        query_in = query.filter(normalized_column.like(f"%{part_number}%"))
-        query_in = query_in.add_columns(
-            AbstractQuaryORM._build_zip_case(obj_table, normalized_column.like(f"%{part_number}%"))
-        )
-        results = await AbstractQuaryORM._execute_query(query_in, part_number, "LIKE", session, logger)
-        if results:
-            input_len = len(part_number)
-            best_result = min(
-                results,
-                key=lambda x: abs(len(x['part_number']) - input_len)
-            )
-            best_result['MATCH_TYPE'] = {'ЗИП': True}
-            logger.info(
-                f"Выбран лучший результат LIKE",
-                extra={
-                    "part_number": part_number,
-                    "length_diff": abs(len(best_result['part_number']) - input_len),
-                    "result_data": best_result
-                }
-            )
-            return best_result
-        return None
+    def _cascade_branches(repository, rank: int, substring_index: bool, instr_index: Optional[bool]) -> list:
+        """
+        Ветки каскада для ключа с позицией rank: EXACT, LIKE и INSTR (если есть кандидаты).
+        Каждая строка помечена позицией ключа, стадией, разницей длин и порядком строк исходного запроса.
+        """
+        query, obj_table = AbstractQuaryORM.base_query(repository)
+        query = query.order_by(None)
+        part_number = bindparam(f'part_number_{rank}', type_=String)
+        normalized_column = obj_table.normalized_part_number
+        distance = func.abs(func.length(obj_table.part_number) - func.length(part_number))
+        row_order = getattr(obj_table, repository.order_column)
 
-    @staticmethod
-    async def _search_instr_match(query, obj_table: DeclarativeMeta, part_number: str, session: AsyncSession, logger: IRobotLogger) -> Optional[dict[str, Any]]:
-        """Поиск по обратному вхождению (INSTR)."""
-        normalized_column = func.upper(func.regexp_replace(obj_table.part_number, r'[^A-Za-zА-Яа-я0-9]', ''))
-        query_out = query.filter(func.instr(part_number, normalized_column))
-        query_out = query_out.add_columns(
-            AbstractQuaryORM._build_zip_case(obj_table, func.instr(part_number, normalized_column) > 0)
-        )
-        results = await AbstractQuaryORM._execute_query(query_out, part_number, "INSTR", session, logger)
-        if results:
-            input_len = len(part_number)
-            best_result = min(
-                results,
-                key=lambda x: abs(len(x['part_number']) - input_len)
+        def ranked(branch, match_rank: int, branch_distance):
+            return branch.add_columns(
+                literal(rank).label(KEY_RANK),
+                literal(match_rank).label(MATCH_RANK),
+                branch_distance.label(MATCH_DISTANCE),
+                row_order.label(ROW_ORDER),
             )
-            best_result['MATCH_TYPE'] = {'ЗИП': True}
-            logger.info(
-                f"Выбран лучший результат INSTR",
-                extra={
-                    "part_number": part_number,
-                    "length_diff": abs(len(best_result['part_number']) - input_len),
-                    "result_data": best_result
-                }
-            )
-            return best_result
-        return None
 
-    @staticmethod
-    async def search_by_part_number(query, obj_table: DeclarativeMeta, part_number: str,
-                                   session: AsyncSession, part_number_filter: IPartNumberFilter, logger: IRobotLogger, main_part_number: str) -> Optional[dict[str, Any]]:
-        """Основной метод поиска по part_number с логированием."""
         # 1. Точное совпадение
-        result = await AbstractQuaryORM._search_exact_match(query, obj_table, part_number, session, logger, main_part_number)
-        if result:
-            return result
+        exact = query.filter(part_number == normalized_column).add_columns(
+            obj_table.part_number.label(EXACT_PART_NUMBER),
+            AbstractQuaryORM._build_zip_case(obj_table, part_number == normalized_column)
+        )
+        branches = [ranked(exact, 0, literal(0))]
 
         # 2. Частичное вхождение (LIKE)
-        result = await AbstractQuaryORM._search_like_match(query, obj_table, part_number, session, logger)
-        if result:
-            return result
+        like_condition = normalized_column.like(bindparam(f'pattern_{rank}', type_=String))
+        like = query.filter(like_condition)
+        if substring_index:
+            like = like.filter(substring_candidates(obj_table, part_number))
+        like = like.add_columns(
+            literal(None, String).label(EXACT_PART_NUMBER),
+            AbstractQuaryORM._build_zip_case(obj_table, like_condition)
+        )
+        branches.append(ranked(like, 1, distance))
 
         # 3. Обратное вхождение (INSTR)
-        result = await AbstractQuaryORM._search_instr_match(query, obj_table, part_number, session, logger)
-        if result:
-            return result
+        if instr_index is not None:
+            if instr_index:
+                instr = query.filter(normalized_column.in_(bindparam(f'contained_keys_{rank}', expanding=True)))
+            else:
+                instr = query.filter(func.instr(part_number, normalized_column))
+            instr = instr.add_columns(
+                literal(None, String).label(EXACT_PART_NUMBER),
+                AbstractQuaryORM._build_zip_case(obj_table, func.instr(part_number, normalized_column) > 0)
+            )
+            branches.append(ranked(instr, 2, distance))
+        return branches
 
-        logger.debug(
-            f"Результатов не найдено",
-            extra={"part_number": part_number}
-        )
-        return None
+    @staticmethod
+    def _build_cascade_query(repository, variants: tuple[tuple[bool, Optional[bool]], ...]):
+        """
+        Один запрос на книгу: UNION ALL веток всех ключей, победитель — первая строка по
+        (позиция ключа, EXACT > LIKE > INSTR, разница длин, порядок строк исходного запроса).
+        """
+        branches = [
+            branch
+            for rank, (substring_index, instr_index) in enumerate(variants)
+            for branch in AbstractQuaryORM._cascade_branches(repository, rank, substring_index, instr_index)
+        ]
+        # Имена столбцов UNION берутся из SQL, поэтому возвращаем ключи, как у обычного запроса к книге.
+        cascade = union_all(*branches).subquery()
+        columns = {
+            key: column.label(key)
+            for key, column in zip(branches[0].selected_columns.keys(), cascade.c)
+        }
+        return select(*columns.values()).order_by(
+            columns[KEY_RANK], columns[MATCH_RANK], columns[MATCH_DISTANCE], columns[ROW_ORDER]
+        ).limit(1)
 
     @staticmethod
-    async def queries(query, obj_table: DeclarativeMeta, keys: list[str], session: AsyncSession, part_number_filter: IPartNumberFilter, logger: IRobotLogger) -> Optional[dict[str, Any]]:
-        """Обработка списка ключей с логированием."""
+    async def queries(repository, keys: list[str], session: AsyncSession, part_number_filter: IPartNumberFilter, logger: IRobotLogger,
+                      book_indexes: Optional[BookIndexRegistry] = None) -> Optional[dict[str, Any]]:
+        """Каскад EXACT, LIKE и INSTR по всем ключам одним запросом к книге."""
         logger.debug(
             f"Обработка ключей",
             extra={"keys": keys}
         )
         main_part_number = keys[0]
+        ranked_keys = AbstractQuaryORM._ranked_keys(keys)
 
-        for part_number in keys:
-            result = await AbstractQuaryORM.search_by_part_number(
-                query, obj_table, part_number, session, part_number_filter, logger, main_part_number
+        _, obj_table = AbstractQuaryORM.base_query(repository)
+        book_index = await book_indexes.get(session, obj_table) if book_indexes else None
+        if book_index and not any(book_index.may_match(part_number) for part_number in ranked_keys):
+            if AbstractQuaryORM.metrics:
+                AbstractQuaryORM.metrics.count_match(obj_table, 'SKIP')
+            logger.debug(
+                f"Книга не может содержать ключи, запрос пропущен",
+                extra={"keys": keys}
             )
-            if result:
-                logger.info(
-                    f"Найден результат для ключа",
-                    extra={"part_number": part_number, "result_data": result}
-                )
-                return result
-        logger.debug(
-            f"Ни один ключ не дал результата",
-            extra={"keys": keys}
+            return None
+        params = {}
+        variants = []
+        for rank, part_number in enumerate(ranked_keys):
+            params[f'part_number_{rank}'] = part_number
+            params[f'pattern_{rank}'] = f"%{part_number}%"
+            instr_index = False
+            if book_index:
+                contained_keys = book_index.contained_keys(part_number)
+                instr_index = True if contained_keys else None
+                if contained_keys:
+                    params[f'contained_keys_{rank}'] = contained_keys
+            variants.append((substring_index_usable(obj_table, part_number), instr_index))
+
+        variants = tuple(variants)
+        prepared = AbstractQuaryORM.prepared(
+            (repository, 'CASCADE', variants), lambda: AbstractQuaryORM._build_cascade_query(repository, variants)
         )
-        return None
+        results = await AbstractQuaryORM._execute_query(
+            prepared, params, main_part_number, "CASCADE", session, logger, obj_table
+        )
+        if AbstractQuaryORM.metrics:
+            AbstractQuaryORM.metrics.count_match(obj_table, MATCH_STAGES[results[0][MATCH_RANK]] if results else 'MISS')
+        if not results:
+            logger.debug(
+                f"Ни один ключ не дал результата",
+                extra={"keys": keys}
+            )
+            return None
+
+        result = results[0]
+        part_number = ranked_keys[result.pop(KEY_RANK)]
+        match_rank = result.pop(MATCH_RANK)
+        result.pop(MATCH_DISTANCE)
+        result.pop(ROW_ORDER)
+        if match_rank:
+            del result[EXACT_PART_NUMBER]
+        if match_rank or part_number != main_part_number:
+            result['MATCH_TYPE'] = {'ЗИП': True}
+        logger.info(
+            f"Найден результат для ключа",
+            extra={"part_number": part_number, "result_data": result}
+        )
+        return result
 
 
 class CodeBookRepository(AbstractQuaryORM):
+    grouped = True
+    order_column = 'part_number'
+
     @staticmethod
-    async def get_items_by_keys(session: AsyncSession, keys: list[str], part_number_filter: IPartNumberFilter, robot_logger: IRobotLogger):
+    def build_query():
+        """Базовый запрос к Своду без условия по парт-номеру."""
         c = aliased(CodeBook)
-        a = aliased(Agreements)
-        ac = aliased(AgreementsCollision)
         query = select(
             c.part_number,
             c.appointment.label('НАЗНАЧЕНИЕ'),
@@ -188,22 +273,26 @@ class CodeBookRepository(AbstractQuaryORM):
             literal('Свод').label('ГДЕ НАШЛИ'),
         ).select_from(
             c
-        ).join(
-            a, func.instr(c.appointment, a.project_code) > 0
-        ).join(
-            ac, a.project_code != ac.project_code_collision
         ).group_by(
             c.part_number
         ).filter(
-            func.instr(c.appointment, a.project_code) > 0,
-            a.project_code != ac.project_code_collision
+            c.agreement_weight > 0
         )
-        return await AbstractQuaryORM.queries(query, c, keys, session, part_number_filter, robot_logger)
+        return query, c
+
+    @staticmethod
+    async def get_items_by_keys(session: AsyncSession, keys: list[str], part_number_filter: IPartNumberFilter, robot_logger: IRobotLogger,
+                                book_indexes: Optional[BookIndexRegistry] = None):
+        return await AbstractQuaryORM.queries(CodeBookRepository, keys, session, part_number_filter, robot_logger, book_indexes)
 
 
 class PurchaseWantRepository(AbstractQuaryORM):
+    grouped = True
+    order_column = 'part_number'
+
     @staticmethod
-    async def get_items_by_keys(session: AsyncSession, keys: list[str], part_number_filter: IPartNumberFilter, robot_logger: IRobotLogger):
+    def build_query():
+        """Базовый запрос к закупке «Хотим» без условия по парт-номеру."""
         p = aliased(PurchaseWant)
         engineer_comments = case(
             (
@@ -222,15 +311,22 @@ class PurchaseWantRepository(AbstractQuaryORM):
         ).select_from(
             p
         ).group_by(p.part_number)
-        return await AbstractQuaryORM.queries(quary, p, keys, session, part_number_filter, robot_logger)
+        return quary, p
+
+    @staticmethod
+    async def get_items_by_keys(session: AsyncSession, keys: list[str], part_number_filter: IPartNumberFilter, robot_logger: IRobotLogger,
+                                book_indexes: Optional[BookIndexRegistry] = None):
+        return await AbstractQuaryORM.queries(PurchaseWantRepository, keys, session, part_number_filter, robot_logger, book_indexes)
 
 
 class PurchaseBuyRepository(AbstractQuaryORM):
+    grouped = False
+    order_column = 'id'
+
     @staticmethod
-    async def get_items_by_keys(session: AsyncSession, keys: list[str], part_number_filter: IPartNumberFilter, robot_logger: IRobotLogger):
+    def build_query():
+        """Базовый запрос к закупке «Закупаем» без условия по парт-номеру."""
         p = aliased(PurchaseBuy)
-        a = aliased(Agreements)
-        ac = aliased(AgreementsCollision)
         quary = select(
             p.part_number,
             p.client.label('ДТК СЕРВИС (КОММЕНТАРИИ ИНЖЕНЕРОВ)'),
@@ -238,73 +334,78 @@ class PurchaseBuyRepository(AbstractQuaryORM):
             literal('Закупка Закупаем').label('ГДЕ НАШЛИ')
         ).select_from(
             p
-        ).join(
-            a, func.instr(p.appointment, a.project_code) > 0
-        ).join(
-            ac, a.project_code != ac.project_code_collision
         ).filter(
-            func.instr(p.appointment, a.project_code) > 0,
-            a.project_code != ac.project_code_collision
-        )
-        return await AbstractQuaryORM.queries(quary, p, keys, session, part_number_filter, robot_logger)
+            p.agreement_weight > 0
+        ).order_by(p.id)
+        return quary, p
+
+    @staticmethod
+    async def get_items_by_keys(session: AsyncSession, keys: list[str], part_number_filter: IPartNumberFilter, robot_logger: IRobotLogger,
+                                book_indexes: Optional[BookIndexRegistry] = None):
+        return await AbstractQuaryORM.queries(PurchaseBuyRepository, keys, session, part_number_filter, robot_logger, book_indexes)
 
 
 class ArchiveBookRepository(AbstractQuaryORM):
+    grouped = False
+    order_column = 'part_number'
+
     @staticmethod
-    async def get_items_by_keys(session: AsyncSession, keys: list[str], part_number_filter: IPartNumberFilter, robot_logger: IRobotLogger):
-        a = aliased(ArchiveBook)
-        s = aliased(Status)
-        ac = aliased(AgreementsCollision)
+    def build_query():
+        """Базовый запрос к агрегатам Архива (отправленные позиции) без условия по парт-номеру."""
+        a = aliased(ArchiveSummary)
         quary = select(
             a.part_number,
             a.cost_of_zip.label('$, СТОИМОСТЬ ЗАКУПКИ ЗИП'),
             a.dtk_service.label('ДТК Сервис (КОММЕНТАРИИ ИНЖЕНЕРОВ)'),
             a.appointment.label('НАЗНАЧЕНИЕ'),
             a.project_code.label('№ ЗАПРОСА'),
-            func.sum(a.amount).label('QTY ИЗ АРХИВОВ'),
+            a.shipped_qty.label('QTY ИЗ АРХИВОВ'),
             literal('Архив').label('ГДЕ НАШЛИ'),
         ).select_from(
             a
-        ).join(
-            s, a.project_code == s.request_number
-        ).join(
-            ac, func.instr(a.appointment, ac.project_code_collision) == 0
         ).filter(
-            func.instr(a.appointment, ac.project_code_collision) == 0,
-            s.status == 'отправлено',
-            a.zip_values != None,
-            a.zip_values != '-',
-            a.zip_values != '0',
-        ).group_by(a.part_number)
-        return await AbstractQuaryORM.queries(quary, a, keys, session, part_number_filter, robot_logger)
+            a.shipped_rows > 0
+        ).order_by(a.part_number)
+        return quary, a
 
     @staticmethod
-    async def select_qty(session: AsyncSession, key: str):
-        a = aliased(ArchiveBook)
-        s = aliased(Status)
+    async def get_items_by_keys(session: AsyncSession, keys: list[str], part_number_filter: IPartNumberFilter, robot_logger: IRobotLogger,
+                                book_indexes: Optional[BookIndexRegistry] = None):
+        return await AbstractQuaryORM.queries(ArchiveBookRepository, keys, session, part_number_filter, robot_logger, book_indexes)
+
+    @staticmethod
+    def build_qty_query():
+        a = aliased(ArchiveSummary)
         quary = select(
-            func.sum(a.amount).label('QTY ИЗ АРХИВОВ'),
-            a.project_code.label('№ ЗАПРОСА'),
+            a.qty.label('QTY ИЗ АРХИВОВ'),
+            a.qty_request_number.label('№ ЗАПРОСА'),
         ).select_from(
             a
-        ).join(
-            s, a.project_code == s.request_number
         ).filter(
-            func.lower(func.replace(s.status, " ", "")) == 'отправлено'
-        ).group_by(a.part_number)
+            a.qty_rows > 0
+        ).order_by(a.part_number)
+        return quary, a
+
+    @staticmethod
+    def _build_qty_key_query():
+        quary, a = ArchiveBookRepository.build_qty_query()
+        return quary.filter(a.normalized_part_number == bindparam('key', type_=String))
 
-        quarys = quary.filter(key == a.part_number)
-        result = (await session.execute(quarys)).first()
+    @staticmethod
+    async def select_qty(session: AsyncSession, key: str):
+        quary, _ = AbstractQuaryORM.prepared((ArchiveBookRepository, 'QTY'), ArchiveBookRepository._build_qty_key_query)
+        result = next(iter(await AbstractQuaryORM.fetch(session, quary, {'key': key}, ArchiveSummary, 'QTY')), None)
         if result:
             return result._asdict()
 
     @staticmethod
-    async def select_category(session: AsyncSession, key: str):
+    def build_category_query():
+        """
+        Категория парт-номера из Архива — из последней по id строки с известной категорией
+        (latest_category_id), а не из строки, которую вернул бы план GROUP BY.
+        """
         m = aliased(MainCategory)
         a = aliased(ArchiveBook)
-        normalized_column = func.upper(
-            func.regexp_replace(a.part_number, r'[^A-Za-zА-Яа-я0-9]', '')
-        )
         quary = select(
             a.category.label('КАТЕГОРИЯ'),
             m.time.label('ТРУДОЗАТРАТЫ'),
@@ -315,27 +416,42 @@ class ArchiveBookRepository(AbstractQuaryORM):
             m, a.category == m.category
         ).filter(
             a.category == m.category,
-            normalized_column == key
+            a.id == latest_category_id(a),
         ).group_by(a.part_number)
+        return quary, a
+
+    @staticmethod
+    def _build_category_key_query():
+        quary, a = ArchiveBookRepository.build_category_query()
+        return quary.filter(a.normalized_part_number == bindparam('key', type_=String))
 
-        result = (await session.execute(quary)).first()
+    @staticmethod
+    async def select_category(session: AsyncSession, key: str):
+        quary, _ = AbstractQuaryORM.prepared(
+            (ArchiveBookRepository, 'CATEGORY'), ArchiveBookRepository._build_category_key_query
+        )
+        result = next(iter(await AbstractQuaryORM.fetch(session, quary, {'key': key}, ArchiveBook, 'CATEGORY EXACT')), None)
         if result:
             return result._asdict()
 
     @staticmethod
-    async def select_category_partial(session: AsyncSession, key: str, part_number_filter: IPartNumberFilter):
+    def build_category_partial_query(key, substring_index: bool = True):
         """
-        Ищет категорию по неполному совпадению парт-номера с фильтром по длине и ранжированием.
+        Запрос категорий по неполному совпадению с фильтром по длине.
+        key — строка, столбец или bindparam; возвращает запрос, алиас Архива и выражение для ранжирования.
         """
         a = aliased(ArchiveBook)
         m = aliased(MainCategory)
 
-        key_length = len(key)
-        min_length = int(key_length * 0.8)
-        max_length = int(key_length * 1.2)
-        normalized_column = func.upper(
-            func.regexp_replace(a.part_number, r'[^A-Za-zА-Яа-я0-9]', '')
-        )
+        if isinstance(key, str):
+            key_length = len(key)
+            min_length = int(key_length * 0.8)
+            max_length = int(key_length * 1.2)
+        else:
+            key_length = func.length(key)
+            min_length = cast(key_length * 0.8, Integer)
+            max_length = cast(key_length * 1.2, Integer)
+        normalized_column = a.normalized_part_number
 
         partial_query = select(
             a.category.label('КАТЕГОРИЯ'),
@@ -346,32 +462,60 @@ class ArchiveBookRepository(AbstractQuaryORM):
         ).select_from(a).join(
             m, a.category == m.category
         ).filter(
-            normalized_column.like(f'%{key}%'),
+            normalized_column.like('%' + key + '%'),
             func.length(normalized_column).between(min_length, max_length),
             a.category == m.category
-        ).order_by(
-            func.abs(func.length(a.part_number) - key_length)
-        ).limit(10)
+        )
+        candidates = substring_candidates(a, key) if substring_index else None
+        if candidates is not None:
+            partial_query = partial_query.filter(candidates)
+        return partial_query, a, func.abs(func.length(a.part_number) - key_length)
+
+    @staticmethod
+    def best_partial_category(key: str, results: list[dict[str, Any]], part_number_filter: IPartNumberFilter) -> Optional[dict[str, Any]]:
+        """Выбирает кандидата с наибольшей похожестью (не ниже 70)."""
+        best_match = None
+        best_score = 0
+        for result_dict in results:
+            score = part_number_filter.calculate_similarity_score(key, result_dict['part_number'])
+            if score > best_score:
+                best_score = score
+                best_match = result_dict
+        if best_match and best_score >= 70:
+            return best_match
+        return None
 
-        partial_results = (await session.execute(partial_query)).fetchall()
+    @staticmethod
+    def _build_category_partial_key_query(substring_index: bool):
+        partial_query, _, distance = ArchiveBookRepository.build_category_partial_query(
+            bindparam('key', type_=String), substring_index
+        )
+        return partial_query.order_by(distance).limit(10)
+
+    @staticmethod
+    async def select_category_partial(session: AsyncSession, key: str, part_number_filter: IPartNumberFilter):
+        """
+        Ищет категорию по неполному совпадению парт-номера с фильтром по длине и ранжированием.
+        """
+        substring_index = substring_index_usable(ArchiveBook, key)
+        partial_query, _ = AbstractQuaryORM.prepared(
+            (ArchiveBookRepository, 'CATEGORY_PARTIAL', substring_index),
+            lambda: ArchiveBookRepository._build_category_partial_key_query(substring_index)
+        )
+
+        partial_results = await AbstractQuaryORM.fetch(session, partial_query, {'key': key}, ArchiveBook, 'CATEGORY PARTIAL')
         if partial_results:
-            best_match = None
-            best_score = 0
-            for result in partial_results:
-                result_dict = result._asdict()
-                score = part_number_filter.calculate_similarity_score(key, result_dict['part_number'])
-                if score > best_score:
-                    best_score = score
-                    best_match = result_dict
-            if best_match and best_score >= 70:
-                return best_match
+            return ArchiveBookRepository.best_partial_category(
+                key, [result._asdict() for result in partial_results], part_number_filter
+            )
 
         return None
 
 
 class CollisionRepository:
     @staticmethod
-    async def get_items_by_keys(session: AsyncSession, comment: str):
+    def build_query():
+        """Запрос категорий по правилам Исключений: первое по порядку правило, первая основная категория."""
         c = aliased(Collision)
         m = aliased(MainCategory)
         query = select(
@@ -379,45 +523,95 @@ class CollisionRepository:
             m.repair.label('РЕМОНТ'),
             m.time.label('ТРУДОЗАТРАТЫ')
         ).join(
-            c, func.instr(func.lower(comment.replace(' ', '')),
-                          func.lower(func.replace(c.description_content, " ", ""))) > 0
-        ).filter(
-            m.category == c.category,
-        ).limit(1)
-        result = (await session.execute(query)).first()
+            c, m.category == c.category
+        ).order_by(c.id, m.id)
+        return query, c
+
+    @staticmethod
+    def comment_condition(c, comment):
+        """Условие вхождения правила в комментарий без автомата; comment — строка или столбец."""
+        if isinstance(comment, str):
+            comment = comment.replace(' ', '')
+        else:
+            comment = func.replace(comment, ' ', '')
+        return func.instr(func.lower(comment), func.lower(func.replace(c.description_content, " ", ""))) > 0
+
+    @staticmethod
+    def _build_comment_query(matcher: bool):
+        query, c = CollisionRepository.build_query()
+        if matcher:
+            query = query.filter(c.id.in_(bindparam('rule_ids', expanding=True)))
+        else:
+            query = query.filter(CollisionRepository.comment_condition(c, bindparam('comment', type_=String)))
+        return query.limit(1)
+
+    @staticmethod
+    async def get_items_by_keys(session: AsyncSession, comment: str, book_indexes: Optional[BookIndexRegistry] = None):
+        if book_indexes:
+            rule_ids = (await book_indexes.collision_matcher(session)).match(comment)
+            if not rule_ids:
+                return None
+            params = {'rule_ids': rule_ids}
+        else:
+            params = {'comment': comment}
+        use_matcher = book_indexes is not None
+        query, _ = AbstractQuaryORM.prepared(
+            (CollisionRepository, use_matcher), lambda: CollisionRepository._build_comment_query(use_matcher)
+        )
+        result = next(iter(await AbstractQuaryORM.fetch(session, query, params, Collision, 'COLLISION')), None)
         if result:
             return result._asdict()
 
 
 class CategoryRepository:
     @staticmethod
-    async def get_items_by_keys(session: AsyncSession, key: str):
+    def build_query():
+        """Запрос запасных категорий без условия по префиксу."""
         m = aliased(MainCategory)
         s = aliased(SecondCategory)
-        normalized_column = func.upper(
-            func.regexp_replace(s.letters, r'[^A-Za-zА-Яа-я0-9]', '')
-        )
         quary = select(
             m.category.label('КАТЕГОРИЯ'),
             m.repair.label('РЕМОНТ'),
             m.time.label('ТРУДОЗАТРАТЫ'),
         ).join(
             s, m.category == s.category
-        ).filter(
-            func.instr(key, normalized_column) == 1,
-        ).order_by(func.length(s.letters).desc()).limit(1)
-        result = (await session.execute(quary)).first()
+        ).order_by(func.length(s.letters).desc(), s.id)
+        return quary, s
+
+    @staticmethod
+    def _build_key_query(book_index: bool):
+        quary, s = AbstractQuaryORM.base_query(CategoryRepository)
+        if book_index:
+            quary = quary.filter(s.normalized_part_number.in_(bindparam('prefixes', expanding=True)))
+        else:
+            quary = quary.filter(func.instr(bindparam('key', type_=String), s.normalized_part_number) == 1)
+        return quary.limit(1)
+
+    @staticmethod
+    async def get_items_by_keys(session: AsyncSession, key: str, book_indexes: Optional[BookIndexRegistry] = None):
+        _, s = AbstractQuaryORM.base_query(CategoryRepository)
+        book_index = await book_indexes.get(session, s) if book_indexes else None
+        if book_index:
+            prefixes = book_index.prefix_keys(key)
+            if not prefixes:
+                return None
+            params = {'prefixes': prefixes}
+        else:
+            params = {'key': key}
+        use_index = book_index is not None
+        quary, _ = AbstractQuaryORM.prepared(
+            (CategoryRepository, use_index), lambda: CategoryRepository._build_key_query(use_index)
+        )
+        result = next(iter(await AbstractQuaryORM.fetch(session, quary, params, SecondCategory, 'SECOND CATEGORY')), None)
         if result:
             return result._asdict()
 
 
 class ChassisRepository:
     @staticmethod
-    async def get_items_by_keys(session: AsyncSession, key: str):
+    def build_query():
+        """Запрос шасси без условия по парт-номеру."""
         c = aliased(Chassis)
-        normalized_column = func.upper(
-            func.regexp_replace(c.part_number, r'[^A-Za-zА-Яа-я0-9]', '')
-        )
         quary = select(
             c.part_number,
             c.power_unit,
@@ -425,29 +619,438 @@ class ChassisRepository:
             c.comment
         ).select_from(
             c
-        ).filter(func.instr(normalized_column, key) == 1)
-        result = (await session.execute(quary)).first()
+        )
+        return quary, c
+
+    @staticmethod
+    def format_result(result) -> dict[str, str]:
+        return {
+            'ШАССИ': f"Шасси! БП - {result.power_unit}, FAN - {result.fan_unit}, Комментарий - {result.comment}"
+        }
+
+    @staticmethod
+    def _build_key_query():
+        quary, c = ChassisRepository.build_query()
+        return quary.filter(starts_with(c.normalized_part_number, bindparam('key', type_=String))).order_by(c.id)
+
+    @staticmethod
+    async def get_items_by_keys(session: AsyncSession, key: str):
+        quary, _ = AbstractQuaryORM.prepared((ChassisRepository, 'KEY'), ChassisRepository._build_key_query)
+        result = next(iter(await AbstractQuaryORM.fetch(session, quary, {'key': key}, Chassis, 'CHASSIS')), None)
         if result:
-            part_bp = result.power_unit
-            part_fan = result.fan_unit
-            comment = result.comment
+            return ChassisRepository.format_result(result)
+
 
-            return {
-                'ШАССИ': f"Шасси! БП - {part_bp}, FAN - {part_fan}, Комментарий - {comment}"
+_metadata = MetaData()
+
+lookup_keys = Table(
+    'lookup_keys', _metadata,
+    Column('item_id', Integer),
+    Column('key_rank', Integer),
+    Column('key', String),
+    prefixes=['TEMPORARY']
+)
+
+lookup_hits = Table(
+    'lookup_hits', _metadata,
+    Column('item_id', Integer),
+    Column('key_rank', Integer),
+    Column('key', String),
+    Column('stored_key', String),
+    prefixes=['TEMPORARY']
+)
+
+lookup_comments = Table(
+    'lookup_comments', _metadata,
+    Column('item_id', Integer),
+    Column('comment', String),
+    prefixes=['TEMPORARY']
+)
+
+lookup_rules = Table(
+    'lookup_rules', _metadata,
+    Column('item_id', Integer),
+    Column('rule_id', Integer),
+    prefixes=['TEMPORARY']
+)
+
+ITEM_ID = 'lookup_item_id'
+
+
+class BatchLookup:
+    """
+    Пакетный поиск по справочникам для всех строк листа.
+    Ключи строк кладутся во временные таблицы, каждая стадия поиска — один запрос с JOIN,
+    приоритеты (порядок ключей, EXACT > LIKE > INSTR, ближайшая длина) разрешаются как в ORMQuary.directory_books_query.
+    Все запросы идут через одну сессию: временные таблицы видны только её соединению.
+    """
+
+    def __init__(self, session: AsyncSession, part_number_filter: IPartNumberFilter, robot_logger: IRobotLogger,
+                 book_indexes: Optional[BookIndexRegistry] = None):
+        self.session = session
+        self.part_number_filter = part_number_filter
+        self.robot_logger = robot_logger
+        self.book_indexes = book_indexes
+
+    async def prepare(self) -> None:
+        connection = await self.session.connection()
+        for table in (lookup_keys, lookup_hits, lookup_comments, lookup_rules):
+            await connection.run_sync(table.create, checkfirst=True)
+
+    @staticmethod
+    def _ranked_keys(keys: list[str]) -> list[tuple[int, str]]:
+        """Ключи строки с их позицией; повторы отбрасываются — они не меняют результат."""
+        seen = set()
+        ranked = []
+        for rank, key in enumerate(keys):
+            if key not in seen:
+                seen.add(key)
+                ranked.append((rank, key))
+        return ranked
+
+    async def _fill(self, table: Table, rows: list[dict[str, Any]]) -> None:
+        await self.session.execute(delete(table))
+        if rows:
+            await self.session.execute(insert(table), rows)
+
+    async def _fill_keys(self, ranked_by_item: dict[int, list[tuple[int, str]]]) -> None:
+        await self._fill(lookup_keys, [
+            {'item_id': item_id, 'key_rank': rank, 'key': key}
+            for item_id, ranked in ranked_by_item.items()
+            for rank, key in ranked
+        ])
+
+    async def _execute(self, query, source, stage: str) -> list[dict[str, Any]]:
+        self.robot_logger.debug(f"Выполнение пакетного запроса {stage}", extra={"sql": str(query)})
+        results = [row._asdict() for row in await AbstractQuaryORM.fetch(self.session, query, None, source, f"BATCH {stage}")]
+        self.robot_logger.debug(f"Результаты пакетного запроса {stage}", extra={"result_count": len(results)})
+        return results
+
+    @staticmethod
+    def _group_rows(rows: list[dict[str, Any]]) -> dict[tuple[int, int], list[dict[str, Any]]]:
+        """Раскладывает строки результата по (строка листа, позиция ключа), сохраняя порядок."""
+        grouped = {}
+        for row in rows:
+            item_id = row.pop(ITEM_ID)
+            rank = row.pop(KEY_RANK, 0)
+            grouped.setdefault((item_id, rank), []).append(row)
+        return grouped
+
+    @staticmethod
+    def _first_by_item(rows: list[dict[str, Any]]) -> dict[int, dict[str, Any]]:
+        first = {}
+        for row in rows:
+            item_id = row.pop(ITEM_ID)
+            row.pop(KEY_RANK, None)
+            first.setdefault(item_id, row)
+        return first
+
+    @staticmethod
+    def _with_keys(query, repository, obj_table, item_column, rank_column):
+        query = query.add_columns(item_column.label(ITEM_ID), rank_column.label(KEY_RANK))
+        if repository.grouped:
+            query = query.group_by(item_column, rank_column).order_by(obj_table.part_number)
+        return query
+
+    @staticmethod
+    def _pending(ranked_by_item: dict[int, list[tuple[int, str]]], limits: dict[int, int]) -> dict[int, list[tuple[int, str]]]:
+        """Оставляет ключи, стоящие раньше уже найденного совпадения."""
+        pending = {}
+        for item_id, ranked in ranked_by_item.items():
+            limit = limits.get(item_id)
+            keys = [(rank, key) for rank, key in ranked if limit is None or rank < limit]
+            if keys:
+                pending[item_id] = keys
+        return pending
+
+    async def search_book(self, repository, keys_by_item: dict[int, list[str]]) -> dict[int, dict[str, Any]]:
+        """
+        Стадии EXACT, LIKE и INSTR для одной книги по всем строкам сразу.
+        Возвращает лучший результат для каждой строки, где он найден.
+        """
+        if not keys_by_item:
+            return {}
+        ranked_by_item = {item_id: self._ranked_keys(keys) for item_id, keys in keys_by_item.items()}
+        query, obj_table = repository.build_query()
+        book_index = await self.book_indexes.get(self.session, obj_table) if self.book_indexes else None
+        if book_index:
+            # Строки, ни один ключ которых не может совпасть с книгой, в запросы не попадают.
+            ranked_by_item = {
+                item_id: ranked for item_id, ranked in ranked_by_item.items()
+                if any(book_index.may_match(key) for _, key in ranked)
             }
+            if not ranked_by_item:
+                return {}
+        normalized_column = obj_table.normalized_part_number
+        k = lookup_keys.c
+
+        # 1. Точное совпадение
+        await self._fill_keys(ranked_by_item)
+        exact_query = self._with_keys(
+            query.join(lookup_keys, normalized_column == k.key), repository, obj_table, k.item_id, k.key_rank
+        ).add_columns(
+            obj_table.part_number,
+            AbstractQuaryORM._build_zip_case(obj_table, normalized_column == k.key)
+        )
+        exact = self._group_rows(await self._execute(exact_query, obj_table, "EXACT"))
+        limits = {}
+        for item_id, rank in exact:
+            limits[item_id] = min(rank, limits.get(item_id, rank))
+
+        # 2. Частичное вхождение (LIKE)
+        like = {}
+        pending = self._pending(ranked_by_item, limits)
+        if pending:
+            await self._fill_keys(pending)
+            like_condition = normalized_column.like('%' + k.key + '%')
+            like_query = query.join(lookup_keys, like_condition)
+            candidates = substring_candidates(obj_table, k.key)
+            if candidates is not None:
+                like_query = like_query.filter(candidates)
+            like_query = self._with_keys(
+                like_query, repository, obj_table, k.item_id, k.key_rank
+            ).add_columns(
+                AbstractQuaryORM._build_zip_case(obj_table, like_condition)
+            )
+            like = self._group_rows(await self._execute(like_query, obj_table, "LIKE"))
+            for item_id, rank in like:
+                limits[item_id] = min(rank, limits.get(item_id, rank))
+
+        # 3. Обратное вхождение (INSTR)
+        instr = {}
+        pending = self._pending(ranked_by_item, limits)
+        if pending:
+            instr = await self._search_instr(query, repository, obj_table, pending)
+
+        results = {}
+        for item_id, ranked in ranked_by_item.items():
+            main_part_number = keys_by_item[item_id][0]
+            for rank, key in ranked:
+                exact_rows = exact.get((item_id, rank))
+                if exact_rows:
+                    result = exact_rows[0]
+                    if key != main_part_number:
+                        result['MATCH_TYPE'] = {'ЗИП': True}
+                    results[item_id] = result
+                    break
+                candidates = like.get((item_id, rank)) or instr.get((item_id, rank))
+                if candidates:
+                    result = min(candidates, key=lambda x: abs(len(x['part_number']) - len(key)))
+                    result['MATCH_TYPE'] = {'ЗИП': True}
+                    results[item_id] = result
+                    break
+        return results
+
+    async def _search_instr(self, query, repository, obj_table, pending: dict[int, list[tuple[int, str]]]):
+        normalized_column = obj_table.normalized_part_number
+        book_index = await self.book_indexes.get(self.session, obj_table) if self.book_indexes else None
+        if book_index:
+            rows = [
+                {'item_id': item_id, 'key_rank': rank, 'key': key, 'stored_key': stored_key}
+                for item_id, ranked in pending.items()
+                for rank, key in ranked
+                for stored_key in book_index.contained_keys(key)
+            ]
+            if not rows:
+                return {}
+            await self._fill(lookup_hits, rows)
+            h = lookup_hits.c
+            instr_query = query.join(lookup_hits, normalized_column == h.stored_key)
+            key_column, item_column, rank_column = h.key, h.item_id, h.key_rank
+        else:
+            await self._fill_keys(pending)
+            k = lookup_keys.c
+            instr_query = query.join(lookup_keys, func.instr(k.key, normalized_column) > 0)
+            key_column, item_column, rank_column = k.key, k.item_id, k.key_rank
+        instr_query = self._with_keys(
+            instr_query, repository, obj_table, item_column, rank_column
+        ).add_columns(
+            AbstractQuaryORM._build_zip_case(obj_table, func.instr(key_column, normalized_column) > 0)
+        )
+        return self._group_rows(await self._execute(instr_query, obj_table, "INSTR"))
+
+    async def select_qty(self, keys_by_item: dict[int, list[str]]) -> dict[int, dict[str, Any]]:
+        """QTY из Архива по основному ключу для строк, найденных в основных книгах."""
+        if not keys_by_item:
+            return {}
+        await self._fill_keys({item_id: [(0, keys[0])] for item_id, keys in keys_by_item.items()})
+        query, a = ArchiveBookRepository.build_qty_query()
+        k = lookup_keys.c
+        query = query.join(
+            lookup_keys, a.normalized_part_number == k.key
+        ).add_columns(
+            k.item_id.label(ITEM_ID)
+        )
+        return self._first_by_item(await self._execute(query, a, "QTY"))
+
+    async def find_categories(self, keys_by_item: dict[int, list[str]], comments: dict[int, str]) -> dict[int, dict[str, Any]]:
+        """
+        Категория для каждой строки: точное и частичное совпадение в Архиве,
+        затем правила по комментарию, запасные категории и значение по умолчанию.
+        """
+        results = {}
+        ranked_by_item = {item_id: self._ranked_keys(keys) for item_id, keys in keys_by_item.items()}
+        k = lookup_keys.c
+
+        await self._fill_keys(ranked_by_item)
+        query, a = ArchiveBookRepository.build_category_query()
+        query = query.join(
+            lookup_keys, a.normalized_part_number == k.key
+        ).add_columns(
+            k.item_id.label(ITEM_ID), k.key_rank.label(KEY_RANK)
+        ).group_by(k.item_id, k.key_rank).order_by(a.part_number)
+        exact = self._group_rows(await self._execute(query, a, "CATEGORY EXACT"))
+        for item_id, ranked in ranked_by_item.items():
+            for rank, key in ranked:
+                if (item_id, rank) in exact:
+                    results[item_id] = exact[(item_id, rank)][0]
+                    break
+
+        pending = {item_id: ranked for item_id, ranked in ranked_by_item.items() if item_id not in results}
+        if pending:
+            await self._fill_keys(pending)
+            query, a, distance = ArchiveBookRepository.build_category_partial_query(k.key)
+            ranked_query = query.add_columns(
+                k.item_id.label(ITEM_ID),
+                k.key_rank.label(KEY_RANK),
+                func.row_number().over(
+                    partition_by=(k.item_id, k.key_rank), order_by=(distance, a.id)
+                ).label('candidate_rank')
+            ).subquery()
+            query = select(
+                *[column for column in ranked_query.c if column.name != 'candidate_rank']
+            ).filter(
+                ranked_query.c.candidate_rank <= 10
+            ).order_by(
+                ranked_query.c[ITEM_ID], ranked_query.c[KEY_RANK], ranked_query.c.candidate_rank
+            )
+            partial = self._group_rows(await self._execute(query, ArchiveBook, "CATEGORY PARTIAL"))
+            for item_id, ranked in pending.items():
+                for rank, key in ranked:
+                    candidates = partial.get((item_id, rank))
+                    best_match = ArchiveBookRepository.best_partial_category(
+                        key, candidates, self.part_number_filter
+                    ) if candidates else None
+                    if best_match:
+                        results[item_id] = best_match
+                        break
+
+        pending_comments = {
+            item_id: comment for item_id, comment in comments.items()
+            if comment and item_id in keys_by_item and item_id not in results
+        }
+        if pending_comments:
+            query, c = CollisionRepository.build_query()
+            if self.book_indexes:
+                matcher = await self.book_indexes.collision_matcher(self.session)
+                await self._fill(lookup_rules, [
+                    {'item_id': item_id, 'rule_id': rule_id}
+                    for item_id, comment in pending_comments.items()
+                    for rule_id in matcher.match(comment)
+                ])
+                query = query.join(lookup_rules, c.id == lookup_rules.c.rule_id)
+                item_column = lookup_rules.c.item_id
+            else:
+                await self._fill(lookup_comments, [
+                    {'item_id': item_id, 'comment': comment} for item_id, comment in pending_comments.items()
+                ])
+                query = query.filter(CollisionRepository.comment_condition(c, lookup_comments.c.comment))
+                item_column = lookup_comments.c.item_id
+            query = query.add_columns(item_column.label(ITEM_ID))
+            results.update(
+                (item_id, row) for item_id, row in self._first_by_item(await self._execute(query, c, "COLLISION")).items()
+                if item_id not in results
+            )
+
+        pending = {item_id: keys for item_id, keys in keys_by_item.items() if item_id not in results}
+        if pending:
+            query, s = CategoryRepository.build_query()
+            book_index = await self.book_indexes.get(self.session, s) if self.book_indexes else None
+            if book_index:
+                await self._fill(lookup_hits, [
+                    {'item_id': item_id, 'key_rank': 0, 'key': keys[0], 'stored_key': prefix}
+                    for item_id, keys in pending.items()
+                    for prefix in book_index.prefix_keys(keys[0])
+                ])
+                query = query.join(lookup_hits, s.normalized_part_number == lookup_hits.c.stored_key)
+                item_column = lookup_hits.c.item_id
+            else:
+                await self._fill_keys({item_id: [(0, keys[0])] for item_id, keys in pending.items()})
+                query = query.filter(func.instr(k.key, s.normalized_part_number) == 1)
+                item_column = k.item_id
+            query = query.add_columns(item_column.label(ITEM_ID))
+            for item_id, row in self._first_by_item(await self._execute(query, s, "SECOND CATEGORY")).items():
+                row['MATCH_TYPE'] = {'КАТЕГОРИЯ': True}
+                results[item_id] = row
+
+        for item_id in keys_by_item:
+            if item_id not in results:
+                results[item_id] = dict(DEFAULT_CATEGORY)
+        return results
+
+    async def find_chassis(self, keys_by_item: dict[int, list[str]]) -> dict[int, dict[str, Any]]:
+        """Шасси по основному ключу каждой строки."""
+        if not keys_by_item:
+            return {}
+        await self._fill_keys({item_id: [(0, keys[0])] for item_id, keys in keys_by_item.items()})
+        k = lookup_keys.c
+        query, c = ChassisRepository.build_query()
+        query = query.join(
+            lookup_keys, starts_with(c.normalized_part_number, k.key)
+        ).add_columns(k.item_id.label(ITEM_ID)).order_by(k.item_id, c.id)
+        results = {}
+        for row in await AbstractQuaryORM.fetch(self.session, query, None, c, "BATCH CHASSIS"):
+            item_id = getattr(row, ITEM_ID)
+            if item_id not in results:
+                results[item_id] = ChassisRepository.format_result(row)
+        return results
 
 
 class ORMQuary(IORMQuary):
-    def __init__(self, settings_alchemy: SQLAlchemySettings, robot_logger: IRobotLogger, part_number_filter: IPartNumberFilter):
+    def __init__(self, settings_alchemy: SQLAlchemySettings, robot_logger: IRobotLogger, part_number_filter: IPartNumberFilter,
+                 lookup_settings: Optional[LookupSettings] = None):
         self.session_factory = settings_alchemy.session_factory
+        self.read_session = settings_alchemy.read_session
         self.robot_logger = robot_logger
         self.part_number_filter = part_number_filter
+        self.lookup_settings = lookup_settings or LookupSettings()
+        self.book_indexes = BookIndexRegistry(self.lookup_settings.bloom)
+        if self.lookup_settings.instrumentation.enabled:
+            AbstractQuaryORM.metrics = LookupMetrics(self.lookup_settings.instrumentation, robot_logger)
+        self.memory_engine = None
+        if self.lookup_settings.engine in ('memory', 'columnar'):
+            self.memory_engine = ReferenceBooksEngine(
+                settings_alchemy.read_session_factory, robot_logger, part_number_filter,
+                ColumnarPartNumberBook if self.lookup_settings.engine == 'columnar' else PartNumberBook
+            )
+        self.result_cache = None
+        if self.lookup_settings.cache_size > 0:
+            self.result_cache = LookupResultCache(self.lookup_settings.cache_size, robot_logger)
+        self._lookup_errors = 0
 
-    async def _execute_repository_query(self, query_func, *args, **kwargs):
+    def log_lookup_summary(self, label: str) -> None:
+        """Пишет в лог сводку инструментации поиска (если включена) и сбрасывает её."""
+        if AbstractQuaryORM.metrics:
+            AbstractQuaryORM.metrics.log_summary(label)
+
+    async def on_table_updated(self, table_name: str, changed_keys: Optional[set[str]] = None,
+                               deleted_keys: Optional[set[str]] = None) -> None:
+        """
+        Вызывается DatabaseRepository после фиксации обновления таблицы.
+        changed_keys — нормализованные парт-номера изменённых строк (None — изменилась вся таблица),
+        deleted_keys — парт-номера удалённых строк.
+        """
+        self.book_indexes.invalidate(table_name, changed_keys, deleted_keys)
+        if self.memory_engine:
+            await self.memory_engine.reload(table_name)
+        if self.result_cache:
+            self.result_cache.invalidate(table_name, changed_keys)
+
+    async def _execute_repository_query(self, session: AsyncSession, query_func, *args, **kwargs):
         try:
-            async with self.session_factory() as session:
-                return await query_func(session, *args, **kwargs)
+            return await query_func(session, *args, **kwargs)
         except Exception as e:
+            self._lookup_errors += 1
             self.robot_logger.error(f"Ошибка выполнения запроса: {str(query_func)} {e}")
             return None
 
@@ -458,97 +1061,212 @@ class ORMQuary(IORMQuary):
         """
         self.robot_logger.debug(f"Процесс поиска по directory_books для ключей: {keys}")
 
-        primary_result = await self._find_primary_data(keys)
-        if primary_result:
-            self._log_and_update_item(item, primary_result)
+        results = self._get_cached(keys, normalized_comment)
+        if results is None:
+            snapshot = self._cache_snapshot()
+            results = await self._lookup(keys, normalized_comment)
+            self._put_cached(keys, normalized_comment, results, snapshot)
+            if self.result_cache and self.result_cache.misses % 1000 == 0:
+                self.result_cache.log_stats()
 
-        archive_result = await self._find_archive_data(keys, True if primary_result else False)
-        if archive_result:
-            self._log_and_update_item(item, archive_result)
+        for result in results:
+            self._log_and_update_item(item, result)
 
-        category_result = await self._find_category(keys, normalized_comment)
-        if category_result:
-            self._log_and_update_item(item, category_result)
+    async def directory_books_query_many(self, batch: list[tuple[dict, list, str]]) -> None:
+        """
+        Пакетный вариант directory_books_query для всех строк листа.
+        batch — список (item, keys, normalized_comment); результаты добавляются в item
+        с теми же приоритетами и MATCH_TYPE, что и при построчном поиске.
+        """
+        self.robot_logger.debug(f"Пакетный поиск по directory_books для {len(batch)} строк")
+
+        misses = []
+        for item, keys, normalized_comment in batch:
+            results = self._get_cached(keys, normalized_comment)
+            if results is None:
+                misses.append((item, keys, normalized_comment))
+                continue
+            for result in results:
+                self._log_and_update_item(item, result)
+
+        if misses:
+            snapshot = self._cache_snapshot()
+            found = await self._lookup_many([(keys, normalized_comment) for _, keys, normalized_comment in misses])
+            for (item, keys, normalized_comment), results in zip(misses, found):
+                self._put_cached(keys, normalized_comment, results, snapshot)
+                for result in results:
+                    self._log_and_update_item(item, result)
+
+        if self.result_cache:
+            self.result_cache.log_stats()
+
+    def _get_cached(self, keys: list, normalized_comment: str) -> Optional[list[dict[str, Any]]]:
+        if not self.result_cache:
+            return None
+        return self.result_cache.get(LookupResultCache.make_key(keys, normalized_comment))
+
+    def _cache_snapshot(self) -> Optional[tuple[dict[str, int], int]]:
+        """Поколения таблиц и счётчик ошибок до начала поиска."""
+        if not self.result_cache:
+            return None
+        return self.result_cache.snapshot(), self._lookup_errors
 
-        chassis_result = await self._find_chassis_data(keys[0])
-        if chassis_result:
-            self._log_and_update_item(item, chassis_result)
+    def _put_cached(self, keys: list, normalized_comment: str, results: list[dict[str, Any]],
+                    snapshot: Optional[tuple[dict[str, int], int]]) -> None:
+        """Кэширует результат, если за время поиска не было ошибок запросов."""
+        if not self.result_cache or snapshot is None:
+            return
+        generations, errors = snapshot
+        if errors == self._lookup_errors:
+            self.result_cache.put(LookupResultCache.make_key(keys, normalized_comment), results, generations)
 
-    async def _find_primary_data(self, keys: list):
+    async def _lookup(self, keys: list, normalized_comment: str) -> list[dict[str, Any]]:
+        """Каскад поиска по одной строке; результаты в порядке применения к item."""
+        if self.memory_engine:
+            await self.memory_engine.ensure_loaded()
+            return self.memory_engine.directory_books_query(keys, normalized_comment)
+
+        if self.lookup_settings.concurrent_groups:
+            # Категория и шасси не зависят от основных книг: группы идут параллельно, каждая в своей сессии.
+            (primary_result, archive_result), category_result, chassis_result = await asyncio.gather(
+                self._in_read_session(self._find_book_data, keys),
+                self._in_read_session(self._find_category, keys, normalized_comment),
+                self._in_read_session(self._find_chassis_data, keys[0]),
+            )
+        else:
+            async with self.read_session() as session:
+                primary_result, archive_result = await self._find_book_data(session, keys)
+                category_result = await self._find_category(session, keys, normalized_comment)
+                chassis_result = await self._find_chassis_data(session, keys[0])
+        return [result for result in (primary_result, archive_result, category_result, chassis_result) if result]
+
+    async def _in_read_session(self, find, *args):
+        """Выполняет группу поиска в отдельной читающей сессии."""
+        async with self.read_session() as session:
+            return await find(session, *args)
+
+    async def _find_book_data(self, session: AsyncSession, keys: list[str]) -> tuple[Optional[dict[str, Any]], Optional[dict[str, Any]]]:
+        """Основные книги и Архив: ветка Архива зависит от того, найдено ли что-то в основных книгах."""
+        primary_result = await self._find_primary_data(session, keys)
+        archive_result = await self._find_archive_data(session, keys, True if primary_result else False)
+        return primary_result, archive_result
+
+    async def _lookup_isolated(self, keys: list, normalized_comment: str) -> list[dict[str, Any]]:
+        """Построчный каскад, в котором ошибка одной строки не прерывает поиск остальных."""
+        try:
+            return await self._lookup(keys, normalized_comment)
+        except Exception as e:
+            self._lookup_errors += 1
+            self.robot_logger.error(f"Ошибка поиска по ключам {keys}: {e}")
+            return []
+
+    async def _lookup_many(self, entries: list[tuple[list, str]]) -> list[list[dict[str, Any]]]:
+        """Каскад поиска для всех строк листа пакетными запросами; при ошибке — построчно."""
+        if self.memory_engine:
+            return [await self._lookup_isolated(keys, normalized_comment) for keys, normalized_comment in entries]
+
+        keys_by_item = {item_id: keys for item_id, (keys, _) in enumerate(entries)}
+        comments = {item_id: comment for item_id, (_, comment) in enumerate(entries)}
+        try:
+            async with self.read_session() as session:
+                lookup = BatchLookup(session, self.part_number_filter, self.robot_logger, self.book_indexes)
+                await lookup.prepare()
+
+                primary = {}
+                pending = dict(keys_by_item)
+                for repository in (CodeBookRepository, PurchaseBuyRepository, PurchaseWantRepository):
+                    found = await lookup.search_book(repository, pending)
+                    primary.update(found)
+                    pending = {item_id: keys for item_id, keys in pending.items() if item_id not in found}
+
+                archive = await lookup.search_book(ArchiveBookRepository, pending)
+                archive.update(await lookup.select_qty(
+                    {item_id: keys for item_id, keys in keys_by_item.items() if item_id in primary}
+                ))
+                categories = await lookup.find_categories(keys_by_item, comments)
+                chassis = await lookup.find_chassis(keys_by_item)
+        except Exception as e:
+            self._lookup_errors += 1
+            self.robot_logger.error(f"Ошибка пакетного поиска, выполняется построчный поиск: {e}")
+            return [await self._lookup_isolated(keys, normalized_comment) for keys, normalized_comment in entries]
+
+        return [
+            [results[item_id] for results in (primary, archive, categories, chassis) if item_id in results]
+            for item_id in range(len(entries))
+        ]
+
+    async def _find_primary_data(self, session: AsyncSession, keys: list):
         repositories = [
             CodeBookRepository.get_items_by_keys,
             PurchaseBuyRepository.get_items_by_keys,
             PurchaseWantRepository.get_items_by_keys
         ]
         for repo_method in repositories:
-            result = await self._execute_repository_query(repo_method, keys, self.part_number_filter, self.robot_logger)
+            result = await self._execute_repository_query(
+                session, repo_method, keys, self.part_number_filter, self.robot_logger, self.book_indexes
+            )
             if result:
                 self.robot_logger.debug(f"Найдены данные в {repo_method.__name__}: {result}")
                 return result
         return None
 
-    async def _find_archive_data(self, keys: list[str], primary_result: bool) -> Optional[dict[str, Any]]:
+    async def _find_archive_data(self, session: AsyncSession, keys: list[str], primary_result: bool) -> Optional[dict[str, Any]]:
         """
         Ищет данные в ArchiveBook и добавляет информацию о количестве (QTY).
         """
         if not primary_result:
             archive_result = await self._execute_repository_query(
-                ArchiveBookRepository.get_items_by_keys, keys, self.part_number_filter, self.robot_logger
+                session, ArchiveBookRepository.get_items_by_keys, keys, self.part_number_filter, self.robot_logger, self.book_indexes
             )
             if archive_result:
                 self.robot_logger.debug(f"Найдены данные в ArchiveBook: {archive_result}")
                 return archive_result
         else:
-            qty_result = await self._execute_repository_query(ArchiveBookRepository.select_qty, keys[0])
+            qty_result = await self._execute_repository_query(session, ArchiveBookRepository.select_qty, keys[0])
             if qty_result:
                 self.robot_logger.debug(f"Найдены qty в ArchiveBook: {qty_result}")
                 return qty_result
         return None
 
-    async def _find_chassis_data(self, key: str) -> Optional[dict[str, Any]]:
+    async def _find_chassis_data(self, session: AsyncSession, key: str) -> Optional[dict[str, Any]]:
         """
         Ищет данные по шасси для указанного ключа.
         """
-        return await self._execute_repository_query(ChassisRepository.get_items_by_keys, key)
+        return await self._execute_repository_query(session, ChassisRepository.get_items_by_keys, key)
 
-    async def _find_category(self, keys: list[str], normalized_comment: str) -> Optional[dict[str, Any]]:
+    async def _find_category(self, session: AsyncSession, keys: list[str], normalized_comment: str) -> Optional[dict[str, Any]]:
         """
         Ищет категорию в ArchiveBook (точное или частичное совпадение) или по комментарию/ключу.
         """
-        async with self.session_factory() as session:
-            for key in keys:
-                exact_result = await ArchiveBookRepository.select_category(session, key)
-                if exact_result:
-                    self.robot_logger.debug(f"Найдена категория (точное совпадение) для {key}: {exact_result}")
-                    return exact_result
+        for key in keys:
+            exact_result = await ArchiveBookRepository.select_category(session, key)
+            if exact_result:
+                self.robot_logger.debug(f"Найдена категория (точное совпадение) для {key}: {exact_result}")
+                return exact_result
 
-            for key in keys:
-                partial_result = await ArchiveBookRepository.select_category_partial(
-                    session, key, self.part_number_filter
-                )
-                if partial_result:
-                    self.robot_logger.debug(f"Найдена категория (частичное совпадение) для {key}: {partial_result}")
-                    return partial_result
+        for key in keys:
+            partial_result = await ArchiveBookRepository.select_category_partial(
+                session, key, self.part_number_filter
+            )
+            if partial_result:
+                self.robot_logger.debug(f"Найдена категория (частичное совпадение) для {key}: {partial_result}")
+                return partial_result
 
         if normalized_comment:
             comment_result = await self._execute_repository_query(
-                CollisionRepository.get_items_by_keys, normalized_comment
+                session, CollisionRepository.get_items_by_keys, normalized_comment, self.book_indexes
             )
             if comment_result:
                 self.robot_logger.debug(f"Найдена категория по комментарию: {comment_result}")
                 return comment_result
 
-        key_result = await self._execute_repository_query(CategoryRepository.get_items_by_keys, keys[0])
+        key_result = await self._execute_repository_query(session, CategoryRepository.get_items_by_keys, keys[0], self.book_indexes)
         if key_result:
             key_result['MATCH_TYPE'] = {'КАТЕГОРИЯ': True}
             self.robot_logger.debug(f"Найдена категория по ключу {keys[0]}: {key_result}")
             return key_result
 
-        default_result = {
-            'РЕМОНТ': 6001,
-            'ТРУДОЗАТРАТЫ': 4,
-            'КАТЕГОРИЯ': 'EMPTY'
-        }
+        default_result = dict(DEFAULT_CATEGORY)
         self.robot_logger.debug(f"Категория не найдена, используются значения по умолчанию: {default_result}")
         return default_result
 
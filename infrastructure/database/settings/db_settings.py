@@ -1,31 +1,115 @@
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 import re
-from sqlalchemy import event
-from sqlalchemy.ext.asyncio import AsyncSession
+from functools import lru_cache
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import AsyncIterator, Optional
+from urllib.parse import quote
+from sqlalchemy import event, text
+from sqlalchemy.engine import URL, make_url
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+from settings.config import SQLiteProfile
+from core import PartNumberFilter
 
 
 class SQLAlchemySettings:
-    def __init__(self, url_database: str):
-        self.engine = create_async_engine(url_database, future=True, echo=False)
+    def __init__(self, url_database: str, pool_size: int = 20, max_overflow: int = 10,
+                 sqlite_profile: Optional[SQLiteProfile] = None):
+        self.sqlite_profile = sqlite_profile or SQLiteProfile()
+        url = make_url(url_database)
+        file_database = url.database not in (None, '', ':memory:')
+        pool_options = {}
+        if file_database:
+            # Вместо NullPool соединения переиспользуются; пул рассчитан на параллельные читающие сессии поиска.
+            pool_options = {'poolclass': AsyncAdaptedQueuePool, 'pool_size': pool_size, 'max_overflow': max_overflow}
+        self.engine = create_async_engine(url_database, future=True, echo=False, **pool_options)
+        self._configure_connections(self.engine, read_only=False)
+
+        # Поиск читает через отдельный движок только для чтения: в режиме WAL перезаливка книг его не блокирует.
+        self.read_engine = self.engine
+        if file_database and self.sqlite_profile.read_only_lookups:
+            self.read_engine = create_async_engine(self._read_only_url(url), future=True, echo=False, **pool_options)
+            self._configure_connections(self.read_engine, read_only=True)
 
-        @event.listens_for(self.engine.sync_engine, 'connect')
-        def register_functions(dbapi_connection, connection_record):
-            dbapi_connection.create_function('regexp', 2, self.sqlite_regexp)
-            dbapi_connection.create_function('regexp_replace', 3, self.sqlite_regexp_replace)
-        
         self.session_factory = async_sessionmaker(
             self.engine,
             expire_on_commit=False
         )
+        self.read_session_factory = async_sessionmaker(
+            self.read_engine,
+            expire_on_commit=False,
+            autoflush=False
+        )
+
+    @staticmethod
+    def _read_only_url(url: URL) -> URL:
+        """URL той же базы, открытой в режиме mode=ro."""
+        return url.set(
+            database=f"file:{quote(Path(url.database).as_posix())}",
+            query={**url.query, 'mode': 'ro', 'uri': 'true'}
+        )
+
+    def _configure_connections(self, engine: AsyncEngine, read_only: bool) -> None:
+        @event.listens_for(engine.sync_engine, 'connect')
+        def register_functions(dbapi_connection, connection_record):
+            # deterministic: SQLite может вычислять их один раз для константных аргументов и использовать в индексах.
+            dbapi_connection.create_function('regexp', 2, self.sqlite_regexp, deterministic=True)
+            dbapi_connection.create_function('regexp_replace', 3, self.sqlite_regexp_replace, deterministic=True)
+            dbapi_connection.create_function('normalize_pn', 1, self.sqlite_normalize_pn, deterministic=True)
+            self._apply_profile(dbapi_connection, read_only)
+
+    def _apply_profile(self, dbapi_connection, read_only: bool) -> None:
+        """PRAGMA профиля производительности для нового соединения."""
+        profile = self.sqlite_profile
+        pragmas = [
+            f"synchronous = {profile.synchronous}",
+            f"mmap_size = {profile.mmap_size}",
+            f"cache_size = {profile.cache_size}",
+            f"temp_store = {profile.temp_store}",
+        ]
+        if not read_only:
+            # Режим журнала хранится в самой базе, поэтому его задаёт только пишущее соединение.
+            pragmas.insert(0, f"journal_mode = {profile.journal_mode}")
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+            cursor.execute(f"PRAGMA {pragma}")
+        cursor.close()
+
+    @asynccontextmanager
+    async def read_session(self) -> AsyncIterator[AsyncSession]:
+        """
+        Сессия для поиска: одно соединение и одна транзакция, которая только читает
+        и всегда откатывается, поэтому весь поиск видит один снимок базы.
+        """
+        async with self.read_session_factory() as session:
+            await session.execute(text('BEGIN'))
+            try:
+                yield session
+            finally:
+                await session.rollback()
+
+    @staticmethod
+    @lru_cache(maxsize=256)
+    def _compile(pattern: str) -> re.Pattern:
+        """Скомпилированное регулярное выражение: шаблон один на весь запрос, а функция вызывается на каждую строку."""
+        return re.compile(pattern)
 
     def sqlite_regexp(self, item, expr):
         """Проверка соответствия регулярному выражению."""
         if item is None:
             return False
-        return re.search(expr, item) is not None
+        return self._compile(expr).search(item) is not None
 
     def sqlite_regexp_replace(self, text, pattern, replacement):
         """Замена по регулярному выражению."""
         if text is None:
             return None
-        return re.sub(pattern, replacement, text)
\ No newline at end of file
+        return self._compile(pattern).sub(replacement, text)
+
+    @staticmethod
+    def sqlite_normalize_pn(value):
+        """normalize_pn(x): PartNumberFilter.normalize_part_number для текстовых значений, иначе NULL."""
+        if not isinstance(value, str):
+            return None
+        return PartNumberFilter.normalize_part_number(value)
@@ -8,7 +8,12 @@ async def main():
     """Main driver."""
     settings = Settings()
 
-    sql_alchemy_settings = SQLAlchemySettings(settings.alchemy_db.url_database)
+    sql_alchemy_settings = SQLAlchemySettings(
+        settings.alchemy_db.url_database,
+        settings.alchemy_db.pool_size,
+        settings.alchemy_db.max_overflow,
+        settings.alchemy_db.sqlite
+    )
     robot_logger = RobotLogger(LOG_FILE)
 
     redis_client = RedisClient(
@@ -1,16 +1,23 @@
 from core.interfaces.i_database import IDatabaseRepository, IORMQuary
+from typing import Optional
 
 
 class DatabaseService:
     def __init__(self, database_repository: IDatabaseRepository):
         self.database_repository = database_repository
 
+    async def initialize(self):
+        return await self.database_repository.initialize()
+
     async def get_all_tables(self):
         return await self.database_repository.get_all_tables()
 
     async def update_table(self, event):
         return await self.database_repository.update_table(event)
 
+    def add_update_listener(self, listener):
+        return self.database_repository.add_update_listener(listener)
+
 
 class ORMService:
     def __init__(self, orm_quary: IORMQuary):
@@ -18,3 +25,13 @@ class ORMService:
 
     async def directory_books_query(self, item: dict, keys: list, normalized_comment: str):
         return await self.orm_quary.directory_books_query(item, keys, normalized_comment)
+
+    async def directory_books_query_many(self, batch: list[tuple[dict, list, str]]):
+        return await self.orm_quary.directory_books_query_many(batch)
+
+    async def on_table_updated(self, table_name: str, changed_keys: Optional[set[str]] = None,
+                               deleted_keys: Optional[set[str]] = None):
+        return await self.orm_quary.on_table_updated(table_name, changed_keys, deleted_keys)
+
+    def log_lookup_summary(self, label: str):
+        return self.orm_quary.log_lookup_summary(label)
@@ -24,8 +24,43 @@ class Outlook(BaseModel):
 
 
 # Sql_Alchemy
+class SQLiteProfile(BaseModel):
+    journal_mode: str = 'WAL'
+    synchronous: str = 'NORMAL'
+    mmap_size: int = 256 * 1024 * 1024
+    cache_size: int = -64 * 1024  # отрицательное значение — размер в КиБ
+    temp_store: str = 'MEMORY'
+    read_only_lookups: bool = True
+
+
 class AlchemyDB(BaseModel):
     url_database: str
+    pool_size: int = 20
+    max_overflow: int = 10
+    sqlite: SQLiteProfile = SQLiteProfile()
+
+
+# Lookup
+class BloomSettings(BaseModel):
+    enabled: bool = True
+    false_positive_rate: float = 0.01
+    substring_length: int = 4
+    max_bytes: int = 32 * 1024 * 1024
+
+
+class InstrumentationSettings(BaseModel):
+    enabled: bool = False
+    window: int = 1000
+    slow_query_ms: float = 200.0
+    capture_plans: bool = False
+
+
+class LookupSettings(BaseModel):
+    engine: str = 'sql'
+    cache_size: int = 10000
+    concurrent_groups: bool = True
+    bloom: BloomSettings = BloomSettings()
+    instrumentation: InstrumentationSettings = InstrumentationSettings()
 
 
 # Huawei
@@ -60,6 +95,7 @@ class Settings(BaseSettings):
     sysdata: SysData
     huaweidata: HuaweiData
     ebay: Ebay
+    lookup: LookupSettings = LookupSettings()
 
     class Config:
         env_nested_delimiter = '__'
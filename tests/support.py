@@ -0,0 +1,58 @@
+from pathlib import Path
+from infrastructure import SQLAlchemySettings, DatabaseRepository
+from core import PartNumberFilter
+from typing import Optional
+
+
+class RecordingLogger:
+    """Логгер для тестов: сообщения не выводятся, ошибки сохраняются для проверок."""
+
+    def __init__(self):
+        self.errors: list[str] = []
+
+    def verify_logs_and_alert(self, file_path: Path = None):
+        pass
+
+    def success(self, message: str, extra: dict = None):
+        pass
+
+    def debug(self, message: str, extra: dict = None) -> None:
+        pass
+
+    def info(self, message: str, extra: dict = None) -> None:
+        pass
+
+    def error(self, message: str, extra: dict = None) -> None:
+        self.errors.append(message)
+
+    def critical(self, message: str, extra: dict = None) -> None:
+        self.errors.append(message)
+
+
+class UpdateRecorder:
+    """Подписчик DatabaseRepository: запоминает оповещения об обновлении таблиц."""
+
+    def __init__(self):
+        self.events: list[tuple[str, Optional[set[str]], Optional[set[str]]]] = []
+
+    async def __call__(self, table_name: str, changed_keys: Optional[set[str]] = None,
+                       deleted_keys: Optional[set[str]] = None) -> None:
+        self.events.append((table_name, changed_keys, deleted_keys))
+
+    def last(self, table_name: str) -> tuple[Optional[set[str]], Optional[set[str]]]:
+        return next((changed, deleted) for name, changed, deleted in reversed(self.events) if name == table_name)
+
+
+async def open_repository(path: Path) -> tuple[SQLAlchemySettings, DatabaseRepository, RecordingLogger]:
+    """Пустая файловая база со всеми таблицами, как после DatabaseRepository.initialize."""
+    logger = RecordingLogger()
+    settings = SQLAlchemySettings(f'sqlite+aiosqlite:///{path}')
+    repository = DatabaseRepository(settings, logger, PartNumberFilter(logger))
+    await repository.initialize()
+    return settings, repository, logger
+
+
+async def close_repository(settings: SQLAlchemySettings) -> None:
+    await settings.engine.dispose()
+    if settings.read_engine is not settings.engine:
+        await settings.read_engine.dispose()
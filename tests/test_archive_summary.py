@@ -0,0 +1,54 @@
+import asyncio
+from sqlalchemy import insert, select
+from sqlalchemy.ext.asyncio import create_async_engine
+from infrastructure.database.orm.models import AbstractTable, ArchiveBook, ArchiveSummary, Status
+from infrastructure.database.lookup.archive_summary import refresh_archive_summary
+
+
+def _table_row(model, **values) -> dict:
+    """Значения по атрибутам модели → по ключам столбцов таблицы (для Core INSERT)."""
+    return {model.__mapper__.columns[name].key: value for name, value in values.items()}
+
+
+def _archive_row(project_code: str, appointment: str, zip_values: str, amount: int) -> dict:
+    return _table_row(
+        ArchiveBook,
+        part_number='FAN-1945108-HI',
+        normalized_part_number='FAN1945108HI',
+        cost_of_zip='10',
+        zip_values=zip_values,
+        dtk_service=None,
+        appointment=appointment,
+        amount=amount,
+        project_code=project_code,
+        category=None,
+        agreement_weight=1,
+    )
+
+
+async def _summary(archive_rows: list[dict]) -> dict:
+    engine = create_async_engine('sqlite+aiosqlite://')
+    try:
+        async with engine.begin() as conn:
+            await conn.run_sync(AbstractTable.metadata.create_all,
+                                tables=[ArchiveBook.__table__, Status.__table__, ArchiveSummary.__table__])
+            await conn.execute(insert(Status.__table__), [
+                _table_row(Status, request_number='REQ000012', status='отправлено'),
+                _table_row(Status, request_number='REQ000013', status='отправлено'),
+            ])
+            await conn.execute(insert(ArchiveBook.__table__), archive_rows)
+            await refresh_archive_summary(conn)
+            return (await conn.execute(select(ArchiveSummary))).mappings().one()
+    finally:
+        await engine.dispose()
+
+
+def test_summary_takes_latest_shipped_row():
+    """Два отправленных ряда одного парт-номера: значения берутся из последнего по id, QTY суммируется."""
+    row = asyncio.run(_summary([
+        _archive_row('REQ000012', 'PRJ025', 'ZIP1', 1),
+        _archive_row('REQ000013', 'PRJ026', 'ZIP2', 2),
+    ]))
+    assert (row['project_code'], row['appointment'], row['zip_values']) == ('REQ000013', 'PRJ026', 'ZIP2')
+    assert row['shipped_qty'] == 3 and row['shipped_rows'] == 2
+    assert row['qty'] == 3 and row['qty_request_number'] == 'REQ000013'
@@ -0,0 +1,39 @@
+import asyncio
+import pytest
+from benchmarks.lookup_benchmark import load_books, prepare_items
+from benchmarks.synthetic_books import SyntheticBooks
+from core import PartNumberFilter
+from infrastructure import ORMQuary
+from settings.config import LookupSettings
+from tests.support import open_repository, close_repository
+
+BATCH = 64
+
+
+async def _lookups(tmp_path, engine: str) -> tuple[list[dict], list[dict], list[str]]:
+    """Результаты поштучного directory_books_query на SQL и directory_books_query_many на engine."""
+    books = SyntheticBooks(300, 1)
+    settings, repository, logger = await open_repository(tmp_path / 'books.db')
+    try:
+        await load_books(repository, books)
+        single = ORMQuary(settings, logger, PartNumberFilter(logger), LookupSettings(engine='sql', cache_size=0))
+        expected = await prepare_items(books, 400, None, 2, logger)
+        for item, keys, comment in expected:
+            await single.directory_books_query(item, keys, comment)
+
+        batched = ORMQuary(settings, logger, PartNumberFilter(logger), LookupSettings(engine=engine, cache_size=0))
+        actual = await prepare_items(books, 400, None, 2, logger)
+        for i in range(0, len(actual), BATCH):
+            await batched.directory_books_query_many(actual[i:i + BATCH])
+        return [item for item, _, _ in expected], [item for item, _, _ in actual], logger.errors
+    finally:
+        await close_repository(settings)
+
+
+@pytest.mark.parametrize('engine', ['sql', 'memory', 'columnar'])
+def test_batch_lookup_matches_single_item_lookup(tmp_path, engine):
+    """Пакетный поиск (временная таблица ключей для SQL) даёт те же поля строки, что и поштучный."""
+    expected, actual, errors = asyncio.run(_lookups(tmp_path, engine))
+    assert errors == []
+    assert any(item.get('ГДЕ НАШЛИ') for item in expected)
+    assert actual == expected
@@ -0,0 +1,128 @@
+import asyncio
+from sqlalchemy import select
+from infrastructure.database.orm.models import CodeBook
+from infrastructure.database.loading.diff_load import ID_GAP
+from tests.support import UpdateRecorder, open_repository, close_repository
+
+BOOK = CodeBook.__tablename__
+
+
+def _book_row(part_number: str, appointment: str = 'PRJ1') -> dict:
+    """Строка Свода с заголовками Excel."""
+    columns = CodeBook.__mapper__.columns
+    return {
+        columns['part_number'].name: part_number,
+        columns['appointment'].name: appointment,
+        columns['logical_accounting'].name: 'СКЛАД',
+        columns['cost_price'].name: '10',
+    }
+
+
+def _book(count: int) -> list[dict]:
+    return [_book_row(f'PN{number:04d}') for number in range(count)]
+
+
+async def _contents(settings) -> list[tuple[int, str, str]]:
+    async with settings.session_factory() as session:
+        return (await session.execute(
+            select(CodeBook.id, CodeBook.part_number, CodeBook.appointment).order_by(CodeBook.id)
+        )).all()
+
+
+async def _reload(tmp_path, rows: list[dict], *reloads: list[dict]) -> tuple[list, UpdateRecorder]:
+    """Загружает книгу, перезагружает её наборами reloads; возвращает итоговые строки и оповещения."""
+    settings, repository, logger = await open_repository(tmp_path / 'books.db')
+    try:
+        await repository.load_table(BOOK, rows)
+        recorder = UpdateRecorder()
+        repository.add_update_listener(recorder)
+        for reload in reloads:
+            await repository.load_table(BOOK, reload)
+        assert logger.errors == []
+        return [tuple(row) for row in await _contents(settings)], recorder
+    finally:
+        await close_repository(settings)
+
+
+def _part_numbers(contents: list) -> list[str]:
+    return [part_number for _, part_number, _ in contents]
+
+
+def test_full_load_spaces_ids_by_id_gap(tmp_path):
+    contents, _ = asyncio.run(_reload(tmp_path, _book(3)))
+    assert [row_id for row_id, _, _ in contents] == [ID_GAP, 2 * ID_GAP, 3 * ID_GAP]
+
+
+def test_insert_between_rows_keeps_existing_ids(tmp_path):
+    rows = _book(10)
+    edited = rows[:4] + [_book_row('NEW0001')] + rows[4:]
+    contents, recorder = asyncio.run(_reload(tmp_path, rows, edited))
+
+    assert _part_numbers(contents) == [row[CodeBook.part_number.name] for row in edited]
+    ids = [row_id for row_id, _, _ in contents]
+    assert ids[:4] == [ID_GAP, 2 * ID_GAP, 3 * ID_GAP, 4 * ID_GAP]
+    assert 4 * ID_GAP < ids[4] < 5 * ID_GAP
+    assert ids[5:] == [number * ID_GAP for number in range(5, 11)]
+    assert recorder.last(BOOK) == ({'NEW0001'}, set())
+
+
+def test_edit_and_delete_report_changed_keys(tmp_path):
+    rows = _book(10)
+    edited = [row for row in rows if row[CodeBook.part_number.name] != 'PN0007']
+    edited[2] = _book_row('PN0002', 'PRJ2')
+    contents, recorder = asyncio.run(_reload(tmp_path, rows, edited))
+
+    assert _part_numbers(contents) == [row[CodeBook.part_number.name] for row in edited]
+    assert contents[2][2] == 'PRJ2'
+    assert contents[0][0] == ID_GAP
+    assert recorder.last(BOOK) == ({'PN0002', 'PN0007'}, {'PN0002', 'PN0007'})
+
+
+def test_renumbers_with_full_reload_when_id_gap_is_exhausted(tmp_path):
+    rows = _book(10)
+    reloads = []
+    current = list(rows)
+    # Каждая вставка перед предыдущей новой строкой делит интервал id пополам — он кончается за log2(ID_GAP) шагов.
+    for number in range(ID_GAP.bit_length()):
+        current = current[:1] + [_book_row(f'NEW{number:04d}')] + current[1:]
+        reloads.append(list(current))
+    contents, recorder = asyncio.run(_reload(tmp_path, rows, *reloads))
+
+    assert _part_numbers(contents) == [row[CodeBook.part_number.name] for row in current]
+    assert [row_id for row_id, _, _ in contents] == [number * ID_GAP for number in range(1, len(current) + 1)]
+    assert recorder.last(BOOK) == (None, None)
+    assert recorder.events[0][1] == {'NEW0000'}
+
+
+def test_falls_back_to_full_reload_above_max_changed_share(tmp_path):
+    rows = _book(10)
+    edited = [_book_row(row[CodeBook.part_number.name], 'PRJ2') if number < 6 else row
+              for number, row in enumerate(rows)]
+    contents, recorder = asyncio.run(_reload(tmp_path, rows, edited))
+
+    assert [appointment for _, _, appointment in contents] == ['PRJ2'] * 6 + ['PRJ1'] * 4
+    assert [row_id for row_id, _, _ in contents] == [number * ID_GAP for number in range(1, 11)]
+    assert recorder.last(BOOK) == (None, None)
+
+
+def test_duplicate_rows_fall_back_to_full_reload(tmp_path):
+    # Книга из повторяющихся строк: каждый хеш встречается чаще 1% строк, и difflib (autojunk) не берёт
+    # их опорными. Совпадает только общее начало, остаток выглядит изменённым — книга перезаливается целиком.
+    pattern = [_book_row('PN0001'), _book_row('DUP0001'), _book_row('DUP0001'), _book_row('PN0002')]
+    rows = pattern * 100
+    edited = rows[:200] + [_book_row('NEW0001')] + rows[200:]
+    contents, recorder = asyncio.run(_reload(tmp_path, rows, edited))
+
+    assert _part_numbers(contents) == [row[CodeBook.part_number.name] for row in edited]
+    assert [row_id for row_id, _, _ in contents] == [number * ID_GAP for number in range(1, len(edited) + 1)]
+    assert recorder.last(BOOK) == (None, None)
+
+
+def test_duplicate_rows_with_unique_anchors_reload_by_diff(tmp_path):
+    # Частые дубли между уникальными строками сопоставляются через соседние совпадения.
+    rows = [_book_row('DUP0001') if number % 3 == 0 else _book_row(f'PN{number:04d}') for number in range(300)]
+    edited = rows[:150] + [_book_row('NEW0001')] + rows[150:]
+    contents, recorder = asyncio.run(_reload(tmp_path, rows, edited))
+
+    assert _part_numbers(contents) == [row[CodeBook.part_number.name] for row in edited]
+    assert recorder.last(BOOK) == ({'NEW0001'}, set())